@@ -0,0 +1,141 @@
+"""Nhiều LoRA adapter (tiếng Anh, tiếng Đức, luyện thi...) trên cùng một base model (PeftModel).
+
+Mỗi job chọn adapter bằng trường `adapter`, không có thì theo `lang` (`routes`), cuối cùng là `default`.
+Một batch có thể trộn nhiều adapter: PEFT nhận `adapter_names` (mỗi dòng một tên) và áp đúng LoRA
+cho từng dòng trong cùng một lượt forward. Adapter ít dùng được nạp khi cần; quá `max_loaded` thì
+adapter dùng lâu nhất (trừ `pinned` và `default`) bị xóa khỏi model.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from prefix_cache import adapter_version
+
+# Tên PEFT dùng cho dòng chạy base model không có LoRA trong batch trộn adapter
+BASE_ADAPTER = "__base__"
+
+
+class AdapterRegistry:
+    def __init__(self, model, paths, default, routes=None, max_loaded=3, pinned=(), log_every=0, on_reload=None):
+        if default not in paths:
+            raise ValueError(f"adapters.default = {default!r} không có trong adapters.paths")
+        for lang, name in (routes or {}).items():
+            if name not in paths:
+                raise ValueError(f"adapters.routes.{lang} = {name!r} không có trong adapters.paths")
+        self.model = model  # PeftModel đã nạp sẵn adapter `default`
+        self.paths = dict(paths)
+        self.default = default
+        self.routes = dict(routes or {})
+        self.max_loaded = max_loaded
+        self.pinned = set(pinned) | {default}
+        self.log_every = log_every
+        self.on_reload = on_reload  # on_reload(name): adapter được nạp lại với file khác
+
+        self._versions = {name: adapter_version(path) for name, path in self.paths.items()}
+        self._loaded = OrderedDict((name, None) for name in model.peft_config)  # dùng gần nhất ở cuối
+        # Hook `adapter_names` của PEFT gắn lên toàn model trong suốt một lần forward / generate:
+        # hai lượt chạy đồng thời với adapter khác nhau sẽ giẫm lên nhau, nên mọi lượt chạy đi qua khóa này
+        self._forward_lock = threading.RLock()
+
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.requests = {name: 0 for name in self.paths}  # số hội thoại đã sinh theo adapter
+
+    @classmethod
+    def from_config(cls, adapters_config, base_model):
+        from peft import PeftModel
+
+        paths = adapters_config["paths"]
+        default = adapters_config.get("default") or next(iter(paths))
+        model = PeftModel.from_pretrained(base_model, paths[default], adapter_name=default)
+        model.eval()
+        registry = cls(
+            model,
+            paths,
+            default,
+            routes=adapters_config.get("routes", {}),
+            max_loaded=adapters_config.get("max_loaded", 3),
+            pinned=adapters_config.get("pinned", []),
+            log_every=adapters_config.get("log_every", 0),
+        )
+        with registry._forward_lock:
+            for name in registry.pinned:
+                registry._ensure_loaded(name)
+        return registry
+
+    def resolve(self, adapter=None, lang=None):
+        """Tên adapter cho một job: `adapter` nếu có, rồi theo `lang`, cuối cùng là default."""
+        if adapter:
+            if adapter not in self.paths:
+                raise ValueError(f"Adapter không tồn tại: {adapter!r} (có: {', '.join(self.paths)})")
+            return adapter
+        return self.routes.get(lang, self.default)
+
+    def version(self, name):
+        # Dùng trong khóa response cache: đổi file adapter là đổi version
+        return f"{name}:{self._versions[name]}"
+
+    def fingerprint(self):
+        """Version gộp của mọi adapter, đổi khi bất kỳ adapter nào được nạp lại với file khác."""
+        return ",".join(self.version(name) for name in self.paths)
+
+    def _ensure_loaded(self, name, keep=()):
+        if name in self._loaded:
+            self._loaded.move_to_end(name)
+            return
+        # Chừa chỗ trước khi nạp; adapter giữ cố định hoặc đang cần cho cùng batch (`keep`) không bị xóa
+        evictable = [loaded for loaded in self._loaded if loaded not in self.pinned and loaded not in keep]
+        while len(self._loaded) >= self.max_loaded and evictable:
+            victim = evictable.pop(0)
+            start = time.perf_counter()
+            self.model.delete_adapter(victim)
+            del self._loaded[victim]
+            self.evictions += 1
+            print(f"[adapters] Xóa adapter {victim} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        start = time.perf_counter()
+        self.model.load_adapter(self.paths[name], adapter_name=name)
+        seconds = time.perf_counter() - start
+        self.model.eval()
+        self._loaded[name] = None
+        # File adapter có thể đã đổi từ lần nạp trước: version (khóa response cache) theo bản vừa nạp
+        version = adapter_version(self.paths[name])
+        if version != self._versions[name]:
+            self._versions[name] = version
+            if self.on_reload is not None:
+                self.on_reload(name)
+        self.loads += 1
+        self.load_seconds += seconds
+        print(f"[adapters] Nạp adapter {name} ({seconds * 1000:.0f} ms)")
+
+    @contextmanager
+    def activate(self, names, record=True):
+        """Nạp (nếu cần) các adapter của một lượt chạy và giữ khóa forward; yield `adapter_names` cho PEFT.
+
+        Batch cần nhiều adapter hơn `max_loaded` thì tạm vượt, lần nạp sau sẽ xóa bớt.
+        """
+        names = [name or self.default for name in names]
+        with self._forward_lock:
+            for name in dict.fromkeys(names):
+                if name != BASE_ADAPTER:
+                    self._ensure_loaded(name, keep=set(names))
+            yield names
+            if not record:
+                return
+            before = sum(self.requests.values())
+            for name in names:
+                if name in self.requests:
+                    self.requests[name] += 1
+            log = self.log_every and before // self.log_every != sum(self.requests.values()) // self.log_every
+        if log:
+            print(f"[adapters] {self.stats()}")
+
+    def stats(self):
+        return {
+            "loaded": list(self._loaded),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "avg_load_ms": round(self.load_seconds / self.loads * 1000, 1) if self.loads else None,
+            "requests": dict(self.requests),
+        }
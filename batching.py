@@ -0,0 +1,83 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchScheduler:
+    """Gom các request chạy đồng thời thành batch rồi gọi `batch_fn` một lần cho cả batch.
+
+    `batch_fn(items) -> results` là hàm đồng bộ (vd: model.generate có padding),
+    được chạy trong một thread riêng để không chặn event loop của RunPod.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=20):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        # Một worker duy nhất: GPU chỉ chạy một batch tại một thời điểm,
+        # trong lúc đó batch tiếp theo được gom trên event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-worker")
+        self._queue = None
+        self._worker_task = None
+
+        self.batches_run = 0
+        self.items_run = 0
+        self.busy_seconds = 0.0
+
+    def _ensure_worker(self):
+        if self._worker_task is None or self._worker_task.done():
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            items = [item for item, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self.batch_fn, items)
+                # Thiếu kết quả thì zip sẽ bỏ sót future, request tương ứng treo mãi
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn trả về {len(results)} kết quả cho batch {len(batch)} request")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+
+            self.batches_run += 1
+            self.items_run += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches_run,
+            "items": self.items_run,
+            "avg_batch_size": self.items_run / self.batches_run if self.batches_run else 0.0,
+            "busy_seconds": self.busy_seconds,
+        }
@@ -0,0 +1,51 @@
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+# Mô hình nhỏ để benchmark trên CPU (không cần GPU / trọng số 8B)
+DEFAULT_TINY_MODEL = "hf-internal-testing/tiny-random-LlamaForCausalLM"
+
+SAMPLE_SENTENCES = [
+    "I goes to school yesterday.",
+    "She have two cat and one dogs.",
+    "Ich bin gestern in die Schule gehen.",
+    "He don't like playing football on the weekend.",
+    "Wir haben keine Zeit gehabt, weil wir müde war.",
+    "They was very happy when they sees the results.",
+    "My brother work in a bank since five years.",
+    "Der Hund spielen mit dem Ball im Garten.",
+]
+
+
+def load_tiny_lm(model_id=DEFAULT_TINY_MODEL):
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32)
+    model.eval()
+    return tokenizer, model
+
+
+def render_prompt(tokenizer, messages):
+    if tokenizer.chat_template:
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    # Tokenizer thử nghiệm không có chat template: ghép thô để vẫn đo được
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages) + "\nassistant:"
+
+
+def tutor_prompts(tokenizer, n):
+    prompts = []
+    for i in range(n):
+        sentence = SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]
+        messages = [
+            {"role": "system", "content": (
+                "You are a friendly and strict English tutor for Vietnamese students. "
+                f"The user provided a English input: '{sentence}'. "
+                "Task: 1. Correct any grammatical, spelling, or pronunciation mistakes. "
+                "2. Explain the corrections clearly in Vietnamese. "
+                "3. Provide the perfectly corrected sentence in English at the very end."
+            )},
+            {"role": "user", "content": "Hãy chấm bài và sửa lỗi cho tôi."},
+        ]
+        prompts.append(render_prompt(tokenizer, messages))
+    return prompts
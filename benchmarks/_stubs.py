@@ -0,0 +1,122 @@
+"""Bản giả lập STT / OCR / LLM có độ trễ điều chỉnh được, cùng API với stt_engine / ocr_pipeline / llm_backend.
+
+Dùng để đo handler.py trên CPU mà không cần Whisper, Tesseract hay trọng số 8B.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks._common import SAMPLE_SENTENCES
+from llm_backend import GenerationStream, LLMBackend, finish_stats
+from media_io import SAMPLE_RATE
+from ocr_pipeline import OCRPipeline, OCRResult
+from stt_engine import STTResult
+
+STUB_RESPONSE = (
+    "Bạn đã chia sai động từ ở thì quá khứ đơn. "
+    "Với chủ ngữ số ít, 'goes' chỉ dùng ở thì hiện tại đơn. "
+    "Vì có trạng từ 'yesterday' nên động từ phải ở dạng quá khứ là 'went'. "
+    "Ngoài ra, hãy chú ý phát âm đuôi '-ed' khi luyện nói. "
+    "Câu đúng là: I went to school yesterday."
+)
+
+
+class StubSTT:
+    """Độ trễ = thời lượng audio * rtf; trả về một câu mẫu (chọn theo độ dài audio)."""
+
+    def __init__(self, rtf=0.1, language="en"):
+        self.rtf = rtf
+        self.language = language
+
+    def transcribe(self, audio, language=None):
+        duration = len(audio) / SAMPLE_RATE
+        time.sleep(duration * self.rtf)
+        text = SAMPLE_SENTENCES[len(audio) % len(SAMPLE_SENTENCES)]
+        return STTResult(text, language or self.language, 1.0, duration, duration)
+
+
+class StubOCR(OCRPipeline):
+    """Tiền xử lý + chia tile chạy thật (NumPy); bước Tesseract được thay bằng `tile_ms` mỗi tile."""
+
+    def __init__(self, tile_ms=150, **kwargs):
+        super().__init__(**kwargs)
+        self.tile_ms = tile_ms
+
+    def check(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    def recognize(self, image, lang=None):
+        timings = {}
+        total_start = time.perf_counter()
+        page = self.preprocess(image, timings)
+        start = time.perf_counter()
+        tiles = self.tiles(page)
+        timings["tile_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        # Các tile được nhận dạng song song trên max_workers tiến trình
+        waves = -(-len(tiles) // max(1, self.max_workers))
+        time.sleep(waves * self.tile_ms / 1000.0)
+        timings["recognize_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        timings["total_ms"] = round((time.perf_counter() - total_start) * 1000, 1)
+        text = "\n".join(SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)] for i in range(len(tiles)))
+        return OCRResult(text, len(tiles), timings)
+
+
+class StubLLM(LLMBackend):
+    """Giả lập một GPU: mỗi lần chỉ chạy một lượt sinh, độ trễ = prefill + số token * token_ms.
+
+    Batch (`generate`) trả về cùng lúc mọi hội thoại; mỗi bước decode chậm thêm `batch_overhead`
+    cho mỗi hội thoại thêm vào batch.
+    """
+
+    name = "stub"
+
+    def __init__(self, prefill_ms=40, token_ms=15, batch_overhead=0.05, response=STUB_RESPONSE, max_new_tokens=400):
+        self.prefill = prefill_ms / 1000.0
+        self.token = token_ms / 1000.0
+        self.batch_overhead = batch_overhead
+        self.response = response
+        self.generation_kwargs = {"max_new_tokens": max_new_tokens, "temperature": 0.3}
+        self._device = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stub-generate")
+
+    def _tokens(self, max_new_tokens):
+        # Mỗi từ của câu trả lời mẫu coi như một token
+        return [word + " " for word in self.response.split(" ")][:max_new_tokens]
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, conversations, **overrides):
+        tokens = self._tokens(overrides.get("max_new_tokens", self.generation_kwargs["max_new_tokens"]))
+        step = self.token * (1 + self.batch_overhead * (len(conversations) - 1))
+        with self._device:
+            time.sleep(self.prefill + step * len(tokens))
+        return ["".join(tokens).strip()] * len(conversations)
+
+    def _run_stream(self, output, stats, max_new_tokens):
+        try:
+            with self._device:
+                start = time.perf_counter()
+                time.sleep(self.prefill)
+                stats["prefill_ms"] = round(self.prefill * 1000, 1)
+                tokens = self._tokens(max_new_tokens)
+                for token in tokens:
+                    time.sleep(self.token)
+                    output.put(token)
+                finish_stats(stats, time.perf_counter() - start, len(tokens))
+        finally:
+            output.put(None)
+
+    def stream(self, messages, cache_key=None, **overrides):
+        output = queue.Queue()
+        stats = {"prefill_ms": None, "prefix_tokens_reused": 0, "prompt_tokens": sum(
+            self.count_tokens(message["content"]) for message in messages)}
+        max_new_tokens = overrides.get("max_new_tokens", self.generation_kwargs["max_new_tokens"])
+        future = self._executor.submit(self._run_stream, output, stats, max_new_tokens)
+        return GenerationStream(iter(output.get, None), future, stats)
@@ -0,0 +1,85 @@
+"""Nhiều LoRA adapter trên một base: batch trộn adapter so với chạy từng nhóm adapter riêng.
+
+Tạo vài adapter ngẫu nhiên trên model nhỏ, kiểm tra câu trả lời của batch trộn giống khi mỗi hội thoại
+chạy riêng với đúng adapter của nó, in thời gian và độ trễ nạp / xóa adapter:
+    python -m benchmarks.bench_adapters --model <thư-mục-model> --adapters 3 --max-loaded 2
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from adapter_registry import AdapterRegistry
+from benchmarks._common import DEFAULT_TINY_MODEL, SAMPLE_SENTENCES, load_tiny_lm
+from llm_backend import TransformersBackend
+from tutor_prompts import worker_messages
+
+
+def save_random_adapters(model_id, root, count, rank):
+    from peft import LoraConfig, get_peft_model
+
+    paths = {}
+    for i in range(count):
+        _, base = load_tiny_lm(model_id)
+        torch.manual_seed(i)
+        config = LoraConfig(r=rank, lora_alpha=2 * rank, init_lora_weights=False,
+                            target_modules=["q_proj", "k_proj", "v_proj", "o_proj"])
+        path = os.path.join(root, f"adapter{i}")
+        get_peft_model(base, config).save_pretrained(path)
+        paths[f"adapter{i}"] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--adapters", type=int, default=3)
+    parser.add_argument("--max-loaded", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--rank", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = save_random_adapters(args.model, root, args.adapters, args.rank)
+        tokenizer, base = load_tiny_lm(args.model)
+        registry = AdapterRegistry.from_config({"paths": paths, "max_loaded": args.max_loaded}, base)
+        generation_kwargs = {"max_new_tokens": args.max_new_tokens, "pad_token_id": tokenizer.pad_token_id}
+        llm = TransformersBackend(registry.model, tokenizer, generation_kwargs, adapters=registry)
+
+        names = list(paths)
+        conversations = [worker_messages("text", SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)], "en")
+                         for i in range(args.batch_size)]
+        batch_adapters = [names[i % len(names)] for i in range(args.batch_size)]
+
+        # Đáp án: từng hội thoại chạy riêng với adapter của nó
+        reference = [llm.generate([messages], adapters=[name])[0]
+                     for messages, name in zip(conversations, batch_adapters)]
+
+        mixed_seconds = grouped_seconds = 0.0
+        identical = True
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            mixed = llm.generate(conversations, adapters=batch_adapters)
+            mixed_seconds += time.perf_counter() - start
+            identical &= mixed == reference
+
+            # Cách cũ: mỗi adapter một batch (tương đương mỗi adapter một worker phục vụ lần lượt)
+            start = time.perf_counter()
+            for name in names:
+                group = [messages for messages, adapter in zip(conversations, batch_adapters) if adapter == name]
+                if group:
+                    llm.generate(group, adapters=[name] * len(group))
+            grouped_seconds += time.perf_counter() - start
+
+        print(f"Batch trộn {args.batch_size} hội thoại / {len(names)} adapter: {mixed_seconds / args.rounds * 1000:.0f} ms")
+        print(f"Mỗi adapter một batch: {grouped_seconds / args.rounds * 1000:.0f} ms")
+        print(f"Giống khi chạy riêng từng hội thoại: {identical}")
+        print(f"Registry: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""So sánh jobs/sec giữa đường tuần tự (mỗi job một lần generate) và BatchScheduler.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_batching --jobs 32 --max-batch-size 8
+"""
+import argparse
+import asyncio
+import time
+
+import torch
+
+from batching import BatchScheduler
+from benchmarks._common import DEFAULT_TINY_MODEL, load_tiny_lm, tutor_prompts
+
+
+def make_generate_batch(tokenizer, model, max_new_tokens):
+    def generate_batch(prompts):
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        return tokenizer.batch_decode(outputs[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
+    return generate_batch
+
+
+def run_serial(generate_batch, prompts):
+    start = time.perf_counter()
+    for prompt in prompts:
+        generate_batch([prompt])
+    return time.perf_counter() - start
+
+
+async def run_batched(scheduler, prompts):
+    start = time.perf_counter()
+    await asyncio.gather(*(scheduler.submit(p) for p in prompts))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    tokenizer, model = load_tiny_lm(args.model)
+    prompts = tutor_prompts(tokenizer, args.jobs)
+    generate_batch = make_generate_batch(tokenizer, model, args.max_new_tokens)
+
+    generate_batch(prompts[:1])  # warmup
+
+    serial_s = run_serial(generate_batch, prompts)
+    scheduler = BatchScheduler(generate_batch, args.max_batch_size, args.max_wait_ms)
+    batched_s = asyncio.run(run_batched(scheduler, prompts))
+
+    print(f"jobs={args.jobs} max_new_tokens={args.max_new_tokens} max_batch_size={args.max_batch_size}")
+    print(f"serial : {args.jobs / serial_s:8.2f} jobs/s ({serial_s:.2f}s)")
+    print(f"batched: {args.jobs / batched_s:8.2f} jobs/s ({batched_s:.2f}s) {scheduler.stats()}")
+    print(f"speedup: {serial_s / batched_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
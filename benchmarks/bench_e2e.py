@@ -0,0 +1,412 @@
+"""Đo độ trễ end-to-end của handler.py (STT / OCR -> LLM -> TTS) mà không cần deploy.
+
+handler.py được import và khởi tạo thật (init_worker, BatchScheduler, TTSService, response cache);
+chỉ các model nặng được thay thế: LLM giả lập (--llm stub) hoặc model nhỏ trên CPU (--llm tiny --model ...),
+STT / OCR giả lập (mặc định) hoặc thật (--stt real / --ocr real), TTS dùng LocalSynthesizer.
+
+Corpus là file JSONL, mỗi dòng một job RunPod ({"input": {...}}). Ngoài các trường của handler,
+`image_path` / `audio_path` (đường dẫn tương đối theo file corpus) được đọc và mã hóa base64,
+`synthetic_image` / `synthetic_audio` sinh ảnh bài tập / audio tổng hợp:
+    python -m benchmarks.bench_e2e --handler async --concurrency 8 --jobs 64
+    python -m benchmarks.bench_e2e --handler stream --llm tiny --model /path/to/tiny-llama
+    python -m benchmarks.bench_e2e --baseline benchmarks/results/e2e-<commit>.json
+
+Kết quả (p50 / p95 / p99 theo từng bước và end-to-end, jobs/s, RSS đỉnh) được ghi ra JSON
+theo commit hiện tại để so sánh giữa các commit.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+
+from benchmarks.bench_ocr import make_worksheet
+from benchmarks.bench_stt import make_sample_wav
+from media_io import b64encode
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "tutor_jobs.jsonl")
+STAGES = ("stt", "ocr", "llm", "tts", "ttft", "ttfa", "e2e")
+
+# Thời gian từng bước của job đang chạy (dict dùng chung giữa thread / task của cùng job)
+_job_timings = contextvars.ContextVar("job_timings", default=None)
+
+
+def record(stage, seconds):
+    timings = _job_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+# ==========================================
+# CORPUS
+# ==========================================
+def load_corpus(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            job_input = dict(json.loads(line).get("input", {}))
+            if "image_path" in job_input:
+                with open(os.path.join(base_dir, job_input.pop("image_path")), "rb") as image:
+                    job_input["image_base64"] = b64encode(image.read())
+            if "audio_path" in job_input:
+                with open(os.path.join(base_dir, job_input.pop("audio_path")), "rb") as audio:
+                    job_input["audio_base64"] = b64encode(audio.read())
+            if "synthetic_image" in job_input:
+                job_input["image_base64"] = b64encode(make_worksheet(**job_input.pop("synthetic_image")))
+            if "synthetic_audio" in job_input:
+                job_input["audio_base64"] = b64encode(make_sample_wav(**job_input.pop("synthetic_audio")))
+            jobs.append(job_input)
+    return jobs
+
+
+def job_kind(job_input):
+    if "audio_base64" in job_input:
+        return "audio"
+    if "image_base64" in job_input:
+        return "image"
+    return "text"
+
+
+# ==========================================
+# DỰNG HANDLER VỚI MODEL GIẢ LẬP / MODEL NHỎ
+# ==========================================
+class TimedStream:
+    """Bọc GenerationStream: thời gian từ lúc gọi llm.stream tới khi sinh xong được tính cho bước llm."""
+
+    def __init__(self, stream, timings, start):
+        self._stream = stream
+        self._timings = timings
+        self._start = start
+        self.stats = stream.stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._stream)
+        except StopIteration:
+            self._timings["llm"] = self._timings.get("llm", 0.0) + (time.perf_counter() - self._start) * 1000
+            self._timings["_llm_done"] = time.perf_counter()
+            raise
+
+
+def instrument(handler):
+    """Bọc STT / OCR / LLM / TTS của handler đã khởi tạo để ghi thời gian từng bước vào job đang chạy."""
+    stt, ocr, llm, tts_service, scheduler = (
+        handler.get_stt_engine(), handler.get_ocr(), handler.llm, handler.tts_service, handler.scheduler)
+
+    def timed(fn, stage):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return wrapper
+
+    stt.transcribe = timed(stt.transcribe, "stt")
+    ocr.recognize = timed(ocr.recognize, "ocr")
+
+    stream = llm.stream
+
+    def timed_stream(*args, **kwargs):
+        timings = _job_timings.get()
+        start = time.perf_counter()
+        generation = stream(*args, **kwargs)
+        return TimedStream(generation, timings, start) if timings is not None else generation
+
+    llm.stream = timed_stream
+
+    submit = scheduler.submit
+
+    async def timed_submit(*args, **kwargs):
+        # Gồm cả thời gian chờ gom batch
+        start = time.perf_counter()
+        try:
+            return await submit(*args, **kwargs)
+        finally:
+            record("llm", time.perf_counter() - start)
+
+    scheduler.submit = timed_submit
+    tts_service.synthesize = timed(tts_service.synthesize, "tts")
+
+    make_pipeline = tts_service.pipeline
+
+    def timed_pipeline(voice):
+        # Handler tuần tự: TTS chạy gối đầu với LLM, chỉ phần chờ sau khi LLM xong được tính cho tts
+        pipeline = make_pipeline(voice)
+        pipeline.finish = timed(pipeline.finish, "tts")
+        return pipeline
+
+    tts_service.pipeline = timed_pipeline
+
+
+def build_config(args):
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f) or {}
+    worker = config.setdefault("worker", {})
+    worker.setdefault("tts", {})["engine"] = "local"
+    worker["tts"]["local_base_latency_ms"] = args.tts_base_ms
+    worker["tts"]["local_per_char_ms"] = args.tts_per_char_ms
+    worker["max_new_tokens"] = args.max_new_tokens
+    worker.setdefault("batching", {}).update({"max_batch_size": args.max_batch_size, "max_wait_ms": args.max_wait_ms})
+    worker.setdefault("startup", {}).update({"preload": [], "warmup": True})
+    config.setdefault("tts_cache", {}).update({"enabled": False})
+    config.setdefault("response_cache", {})["enabled"] = args.response_cache
+    config.setdefault("llm", {})["backend"] = "transformers"
+    return config
+
+
+def load_handler(args):
+    config = build_config(args)
+    config_file = tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False)
+    with config_file:
+        yaml.safe_dump(config, config_file)
+    # handler.py đọc config lúc import
+    os.environ["DENGLISH_CONFIG"] = config_file.name
+    import handler
+    from benchmarks._stubs import StubLLM, StubOCR, StubSTT
+
+    def load_llm():
+        if args.llm == "stub":
+            handler.llm = StubLLM(args.prefill_ms, args.token_ms, max_new_tokens=args.max_new_tokens)
+            return
+        from benchmarks._common import load_tiny_lm
+        from llm_backend import TransformersBackend
+        from prefix_cache import PrefixCache
+
+        tokenizer, model = load_tiny_lm(args.model)
+        prefix_cache = PrefixCache(model, tokenizer) if handler.PREFIX_CACHE_CONFIG.get("enabled", True) else None
+        generation_kwargs = {
+            "max_new_tokens": args.max_new_tokens,
+            "min_new_tokens": args.max_new_tokens,  # Model ngẫu nhiên: cố định số token để các lần đo so sánh được
+            "pad_token_id": tokenizer.eos_token_id,
+        }
+        handler.llm = TransformersBackend(model, tokenizer, generation_kwargs, prefix_cache)
+
+    handler.load_llm = load_llm
+    if args.stt == "stub":
+        handler.stt_engine = StubSTT(rtf=args.stt_rtf)
+    if args.ocr == "stub":
+        handler.ocr_pipeline = StubOCR.from_config(handler.CONFIG.get("vision", {}))
+        handler.ocr_pipeline.tile_ms = args.ocr_tile_ms
+
+    start = time.perf_counter()
+    handler.init_worker()
+    startup_s = time.perf_counter() - start
+    instrument(handler)
+    os.remove(config_file.name)
+    return handler, startup_s
+
+
+# ==========================================
+# PHÁT LẠI CORPUS
+# ==========================================
+def finish_job(timings, start, result):
+    done = time.perf_counter()
+    timings["e2e"] = (done - start) * 1000
+    llm_done = timings.pop("_llm_done", None)
+    if "tts" not in timings and llm_done is not None:
+        # Streaming: TTS chạy gối đầu, phần còn lại sau khi LLM xong là audio của các câu cuối
+        timings["tts"] = (done - llm_done) * 1000
+    error = result.get("error") if isinstance(result, dict) else None
+    return {"timings": timings, "error": error}
+
+
+def run_serial(handler, jobs, concurrency):
+    def run_job(job_input, index):
+        timings = {}
+        _job_timings.set(timings)
+        start = time.perf_counter()
+        result = handler.handler({"id": f"bench-{index}", "input": job_input})
+        return finish_job(timings, start, result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, run_job, job_input, i)
+            for i, job_input in enumerate(jobs)
+        ]
+        return [future.result() for future in futures]
+
+
+async def run_async(handler, jobs, concurrency, streaming):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_job(job_input, index):
+        async with semaphore:
+            timings = {}
+            _job_timings.set(timings)
+            job = {"id": f"bench-{index}", "input": job_input}
+            start = time.perf_counter()
+            if not streaming:
+                return finish_job(timings, start, await handler.async_handler(job))
+            result = None
+            async for event in handler.stream_handler(job):
+                now = time.perf_counter()
+                if event.get("type") == "text" and "ttft" not in timings:
+                    timings["ttft"] = (now - start) * 1000
+                elif event.get("type") == "audio" and "ttfa" not in timings:
+                    timings["ttfa"] = (now - start) * 1000
+                result = event
+            return finish_job(timings, start, result)
+
+    return await asyncio.gather(*(run_job(job_input, i) for i, job_input in enumerate(jobs)))
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(len(values)),
+        "mean_ms": round(float(values.mean()), 1),
+        "p50_ms": round(float(np.percentile(values, 50)), 1),
+        "p95_ms": round(float(np.percentile(values, 95)), 1),
+        "p99_ms": round(float(np.percentile(values, 99)), 1),
+        "max_ms": round(float(values.max()), 1),
+    }
+
+
+def summarize(results, jobs):
+    summary = {"all": {}}
+    for kind in ("text", "image", "audio"):
+        summary[kind] = {}
+    for result, job_input in zip(results, jobs):
+        if result["error"]:
+            continue
+        for stage, ms in result["timings"].items():
+            summary["all"].setdefault(stage, []).append(ms)
+            summary[job_kind(job_input)].setdefault(stage, []).append(ms)
+    return {
+        group: {stage: percentiles(values[stage]) for stage in STAGES if stage in values}
+        for group, values in summary.items() if values
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux; gồm cả tiến trình con (process pool OCR)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report, baseline=None):
+    print(f"\n{report['jobs']} jobs, handler={report['args']['handler']}, concurrency={report['args']['concurrency']}: "
+          f"{report['throughput_jobs_per_s']:.2f} jobs/s, {report['errors']} lỗi, "
+          f"peak RSS {report['peak_rss_mb']['self']:.0f} MB (+{report['peak_rss_mb']['children']:.0f} MB con)")
+    print(f"{'nhóm':6} {'bước':6} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  {'Δp50 / Δp95 so với baseline':>28}")
+    for group, stages in report["latency"].items():
+        for stage, stats in stages.items():
+            delta = ""
+            old = (baseline or {}).get("latency", {}).get(group, {}).get(stage)
+            if old:
+                delta = (f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+7.1f}% / "
+                         f"{(stats['p95_ms'] / old['p95_ms'] - 1) * 100:+7.1f}%")
+            print(f"{group:6} {stage:6} {stats['count']:5d} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} "
+                  f"{stats['p99_ms']:9.1f}  {delta:>28}")
+    if baseline:
+        ratio = report["throughput_jobs_per_s"] / baseline["throughput_jobs_per_s"] - 1
+        print(f"throughput so với baseline ({baseline.get('commit')}): {ratio * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--jobs", type=int, default=0, help="Số job phát lại (lặp vòng corpus); 0 = đúng một lượt")
+    parser.add_argument("--handler", choices=("serial", "async", "stream"), default="async")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--llm", choices=("stub", "tiny"), default="stub")
+    parser.add_argument("--model", default=None, help="Model nhỏ cho --llm tiny (mặc định: model của _common)")
+    parser.add_argument("--stt", choices=("stub", "real"), default="stub")
+    parser.add_argument("--ocr", choices=("stub", "real"), default="stub")
+    parser.add_argument("--prefill-ms", type=float, default=40)
+    parser.add_argument("--token-ms", type=float, default=15)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--stt-rtf", type=float, default=0.1)
+    parser.add_argument("--ocr-tile-ms", type=float, default=150)
+    parser.add_argument("--tts-base-ms", type=float, default=150)
+    parser.add_argument("--tts-per-char-ms", type=float, default=2)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--response-cache", action="store_true", help="Bật response cache (corpus lặp lại sẽ trúng cache)")
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định: benchmarks/results/e2e-<commit>.json)")
+    parser.add_argument("--baseline", default=None, help="File JSON của một lần chạy trước để so sánh")
+    args = parser.parse_args()
+    if args.llm == "tiny" and args.model is None:
+        from benchmarks._common import DEFAULT_TINY_MODEL
+
+        args.model = DEFAULT_TINY_MODEL
+
+    corpus = load_corpus(args.corpus)
+    n_jobs = args.jobs or len(corpus)
+    jobs = [corpus[i % len(corpus)] for i in range(n_jobs)]
+    print(f"corpus {args.corpus}: {len(corpus)} jobs -> phát lại {n_jobs} "
+          f"({', '.join(f'{k}={sum(job_kind(j) == k for j in jobs)}' for k in ('text', 'image', 'audio'))})")
+
+    handler, startup_s = load_handler(args)
+
+    start = time.perf_counter()
+    if args.handler == "serial":
+        results = run_serial(handler, jobs, args.concurrency)
+    else:
+        results = asyncio.run(run_async(handler, jobs, args.concurrency, streaming=args.handler == "stream"))
+    elapsed = time.perf_counter() - start
+
+    errors = [r["error"] for r in results if r["error"]]
+    rss = peak_rss_mb()  # Đo trước khi gọi git: tiến trình con fork ra mang theo RSS của tiến trình cha
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "args": vars(args),
+        "jobs": n_jobs,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "startup_s": round(startup_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_jobs_per_s": round(n_jobs / elapsed, 3),
+        "peak_rss_mb": rss,
+        "latency": summarize(results, jobs),
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", f"e2e-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Đã ghi {output}")
+    # TTS loop nền / process pool OCR là thread daemon: thoát thẳng, không đợi
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Chạy build_and_push_gguf.GGUFPipeline với Hub giả (thư mục local) và convert / llama-quantize giả.
+
+Kiểm tra từng kịch bản: lần đầu build hết, chạy lại thì bỏ qua mọi bước, thêm một loại quant thì chỉ
+build bản đó, đổi trọng số trên Hub thì build lại từ đầu, file quant bị sửa thì dừng trước khi upload.
+So sánh thêm thời gian lượng tử hóa tuần tự với song song:
+    python -m benchmarks.bench_gguf_pipeline --quantize-ms 500
+"""
+import argparse
+import os
+import stat
+import sys
+import tempfile
+import time
+
+from build_and_push_gguf import GGUFPipeline, LocalHub
+
+REPO_ID = "phgrouptechs/Denglish-8B-Instruct"
+
+FAKE_CONVERT = '''
+import hashlib, os, sys, time
+model_dir, outfile = sys.argv[1], sys.argv[sys.argv.index("--outfile") + 1]
+digest = hashlib.sha256()
+for name in sorted(os.listdir(model_dir)):
+    with open(os.path.join(model_dir, name), "rb") as f:
+        digest.update(name.encode() + f.read())
+time.sleep({convert_s})
+with open(outfile, "wb") as f:
+    f.write(b"GGUF-F16 " + digest.hexdigest().encode() + b"\\n" * 1024)
+'''
+
+FAKE_QUANTIZE = '''#!{python}
+import hashlib, sys, time
+src, dst, quant, threads = sys.argv[1:5]
+with open(src, "rb") as f:
+    digest = hashlib.sha256(f.read()).hexdigest()
+time.sleep({quantize_s})
+with open(dst, "wb") as f:
+    f.write(f"GGUF-{{quant}} {{digest}}\\n".encode())
+'''
+
+
+def write_tools(tools_dir, convert_ms, quantize_ms):
+    convert_script = os.path.join(tools_dir, "convert_hf_to_gguf.py")
+    with open(convert_script, "w") as f:
+        f.write(FAKE_CONVERT.format(convert_s=convert_ms / 1000))
+    quantize_bin = os.path.join(tools_dir, "llama-quantize")
+    with open(quantize_bin, "w") as f:
+        f.write(FAKE_QUANTIZE.format(python=sys.executable, quantize_s=quantize_ms / 1000))
+    os.chmod(quantize_bin, os.stat(quantize_bin).st_mode | stat.S_IEXEC)
+    return convert_script, quantize_bin
+
+
+def write_model(hub_root, version):
+    repo_dir = os.path.join(hub_root, REPO_ID)
+    os.makedirs(repo_dir, exist_ok=True)
+    with open(os.path.join(repo_dir, "model.safetensors"), "wb") as f:
+        f.write(f"weights v{version}".encode() * 1000)
+    with open(os.path.join(repo_dir, "config.json"), "w") as f:
+        f.write('{"model_type": "llama"}')
+
+
+def run(label, pipeline, expect=None):
+    start = time.perf_counter()
+    actions = pipeline.run()
+    seconds = time.perf_counter() - start
+    summary = {}
+    for step, action in actions.items():
+        summary.setdefault(action, []).append(step)
+    print(f"\n== {label}: {seconds:.2f}s")
+    for action, steps in sorted(summary.items()):
+        print(f"   {action:9} {', '.join(steps)}")
+    if expect is not None:
+        built = sorted(step for step, action in actions.items() if action in ("built", "uploaded"))
+        if built != sorted(expect):
+            raise SystemExit(f"Sai kỳ vọng: build/upload {built}, mong đợi {sorted(expect)}")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--convert-ms", type=int, default=300)
+    parser.add_argument("--quantize-ms", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        hub_root, work_dir, tools_dir = (os.path.join(root, name) for name in ("hub", "work", "tools"))
+        os.makedirs(tools_dir)
+        convert_script, quantize_bin = write_tools(tools_dir, args.convert_ms, args.quantize_ms)
+        write_model(hub_root, 1)
+
+        def pipeline(quant_types, max_parallel=3):
+            return GGUFPipeline(
+                source=REPO_ID, name="Denglish-8B-Instruct", work_dir=work_dir, quant_types=quant_types,
+                hub=LocalHub(hub_root), convert_script=convert_script, quantize_bin=quantize_bin,
+                upload_repo_id=REPO_ID, max_parallel=max_parallel, threads=6)
+
+        quants = ["Q4_K_M", "Q5_K_M", "Q8_0"]
+        uploads = [f"upload:Denglish-8B-Instruct-{quant}.gguf" for quant in quants]
+        run("lần đầu", pipeline(quants), ["snapshot", "convert"] + [f"quantize:{q}" for q in quants] + uploads)
+        run("chạy lại, không đổi gì", pipeline(quants), [])
+        run("thêm Q6_K", pipeline(quants + ["Q6_K"]), ["quantize:Q6_K", "upload:Denglish-8B-Instruct-Q6_K.gguf"])
+
+        write_model(hub_root, 2)
+        sequential = run("trọng số mới trên Hub, lượng tử hóa tuần tự", pipeline(quants, max_parallel=1),
+                         ["snapshot", "convert"] + [f"quantize:{q}" for q in quants] + uploads)
+        write_model(hub_root, 3)
+        parallel = run("trọng số mới trên Hub, 3 song song", pipeline(quants, max_parallel=3),
+                       ["snapshot", "convert"] + [f"quantize:{q}" for q in quants] + uploads)
+        print(f"\nTuần tự {sequential:.2f}s vs song song {parallel:.2f}s")
+
+        # Sửa file quant nhưng giữ nguyên size / mtime: cache hash không thấy, checksum trước upload phải bắt được
+        path = os.path.join(work_dir, "Denglish-8B-Instruct-Q8_0.gguf")
+        info = os.stat(path)
+        with open(path, "r+b") as f:
+            f.write(b"X")
+        os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns))
+        try:
+            pipeline(quants).run()
+        except RuntimeError as error:
+            print(f"\n== file hỏng: dừng trước khi upload ({error})")
+        else:
+            raise SystemExit("File hỏng vẫn được upload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Đo tokens/sec của một LLM backend (transformers hoặc llama.cpp GGUF) trên prompt gia sư.
+
+    python -m benchmarks.bench_llm_backend --backend transformers --model <hf-id-hoặc-thư-mục>
+    python -m benchmarks.bench_llm_backend --backend llamacpp --gguf /tmp/Denglish-8B-Instruct-Q4_K_M.gguf
+"""
+import argparse
+import time
+
+from benchmarks._common import DEFAULT_TINY_MODEL, SAMPLE_SENTENCES, load_tiny_lm
+from llm_backend import LlamaCppBackend, TransformersBackend
+from tutor_prompts import worker_messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["transformers", "llamacpp"], default="transformers")
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--gguf")
+    parser.add_argument("--n-threads", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    generation_kwargs = {"max_new_tokens": args.max_new_tokens}
+    if args.backend == "llamacpp":
+        llm = LlamaCppBackend.from_config({"gguf_path": args.gguf, "n_threads": args.n_threads}, generation_kwargs)
+    else:
+        tokenizer, model = load_tiny_lm(args.model)
+        llm = TransformersBackend(model, tokenizer, {**generation_kwargs, "pad_token_id": tokenizer.pad_token_id})
+
+    # Lượt đầu để khởi tạo (không tính)
+    "".join(llm.stream(worker_messages("text", SAMPLE_SENTENCES[0], "en"), max_new_tokens=4))
+
+    generated_tokens, ttft_total, start = 0, 0.0, time.perf_counter()
+    for i in range(args.jobs):
+        messages = worker_messages("text", SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)], "en")
+        job_start = time.perf_counter()
+        parts = []
+        for delta in llm.stream(messages):
+            if not parts:
+                ttft_total += time.perf_counter() - job_start
+            parts.append(delta)
+        generated_tokens += llm.count_tokens("".join(parts))
+    elapsed = time.perf_counter() - start
+
+    print(f"backend={llm.name} jobs={args.jobs} generated_tokens={generated_tokens}")
+    print(f"decode : {generated_tokens / elapsed:8.2f} tokens/s")
+    print(f"ttft   : {ttft_total / args.jobs * 1000:8.1f} ms (trung bình)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""So sánh lora_merge (streaming) với PeftModel.merge_and_unload: RAM đỉnh, thời gian và kết quả trùng từng bit.
+
+Tạo một Llama ngẫu nhiên (lưu bf16, chia shard) và một adapter LoRA ngẫu nhiên (B khác 0) trên các
+projection giống train.py, rồi chạy mỗi cách gộp trong một tiến trình riêng để đo RSS đỉnh:
+    python -m benchmarks.bench_lora_merge
+    python -m benchmarks.bench_lora_merge --hidden 2048 --layers 8 --shard-mb 500 --adapter-dtype bfloat16
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from safetensors import safe_open
+
+TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+
+
+def build_fixture(workdir, hidden, layers, vocab, shard_mb, adapter_dtype, modules_to_save):
+    from peft import LoraConfig, get_peft_model
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        hidden_size=hidden, intermediate_size=hidden * 7 // 2, num_hidden_layers=layers, num_attention_heads=max(1, hidden // 128),
+        num_key_value_heads=max(1, hidden // 512), vocab_size=vocab, tie_word_embeddings=False)
+    model = LlamaForCausalLM(config).to(torch.bfloat16)
+    base_dir = os.path.join(workdir, "base")
+    model.save_pretrained(base_dir, max_shard_size=f"{shard_mb}MB")
+
+    lora_config = LoraConfig(
+        r=16, lora_alpha=32, target_modules=TARGET_MODULES, modules_to_save=modules_to_save, init_lora_weights=False)
+    peft_model = get_peft_model(model.to(adapter_dtype), lora_config)
+    adapter_dir = os.path.join(workdir, "adapter")
+    peft_model.save_pretrained(adapter_dir)
+    return base_dir, adapter_dir
+
+
+def run_merge(mode, base_dir, adapter_dir, output_dir):
+    start = time.perf_counter()
+    if mode == "streaming":
+        from lora_merge import merge_lora_streaming
+        merge_lora_streaming(base_dir, adapter_dir, output_dir, "bfloat16")
+    else:
+        # Đúng cách merge_and_push.py làm khi merge.streaming: False
+        from peft import PeftModel
+        from transformers import AutoModelForCausalLM
+        base_model = AutoModelForCausalLM.from_pretrained(base_dir, torch_dtype=torch.bfloat16, device_map="cpu")
+        merged = PeftModel.from_pretrained(base_model, adapter_dir).merge_and_unload()
+        merged.save_pretrained(output_dir)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def peak_rss_mb():
+    # VmHWM được đặt lại khi exec; ru_maxrss thì giữ đỉnh của tiến trình cha lúc fork
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_tensors(model_dir):
+    tensors = {}
+    for name in sorted(os.listdir(model_dir)):
+        if name.endswith(".safetensors"):
+            with safe_open(os.path.join(model_dir, name), framework="pt") as f:
+                tensors.update({key: f.get_tensor(key) for key in f.keys()})
+    return tensors
+
+
+def compare(reference_dir, candidate_dir):
+    reference, candidate = read_tensors(reference_dir), read_tensors(candidate_dir)
+    if set(reference) != set(candidate):
+        return [f"khác tên tensor: {sorted(set(reference) ^ set(candidate))[:5]}"]
+    problems = []
+    for name, tensor in reference.items():
+        other = candidate[name]
+        if tensor.dtype != other.dtype or tensor.shape != other.shape:
+            problems.append(f"{name}: {tensor.dtype}{tuple(tensor.shape)} != {other.dtype}{tuple(other.shape)}")
+        elif not torch.equal(tensor.reshape(-1).view(torch.uint8), other.reshape(-1).view(torch.uint8)):
+            problems.append(f"{name}: khác giá trị (max diff {(tensor.float() - other.float()).abs().max():.3g})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--vocab", type=int, default=32000)
+    parser.add_argument("--shard-mb", type=int, default=200)
+    parser.add_argument("--adapter-dtype", default="float32", choices=["float32", "bfloat16"])
+    parser.add_argument("--modules-to-save", nargs="*", default=[])
+    parser.add_argument("--run", choices=["streaming", "peft"], help=argparse.SUPPRESS)
+    parser.add_argument("--dirs", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # Tiến trình con: chỉ chạy một cách gộp để RSS đỉnh không bị lẫn
+        print(json.dumps(run_merge(args.run, *args.dirs)))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base_dir, adapter_dir = build_fixture(
+            workdir, args.hidden, args.layers, args.vocab, args.shard_mb, getattr(torch, args.adapter_dtype),
+            args.modules_to_save or None)
+        shards = [name for name in os.listdir(base_dir) if name.endswith(".safetensors")]
+        size_mb = sum(os.path.getsize(os.path.join(base_dir, name)) for name in shards) / 2**20
+        print(f"base: {size_mb:.0f} MB bf16 trong {len(shards)} shard; adapter {args.adapter_dtype}")
+
+        outputs = {}
+        for mode in ("peft", "streaming"):
+            outputs[mode] = os.path.join(workdir, f"merged-{mode}")
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_lora_merge", "--run", mode, "--dirs", base_dir, adapter_dir, outputs[mode]],
+                check=True, capture_output=True, text=True)
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{mode:10} {stats['seconds']:7.1f}s  RSS đỉnh {stats['peak_rss_mb']:8.0f} MB")
+
+        problems = compare(outputs["peft"], outputs["streaming"])
+        if problems:
+            print("KHÁC PEFT:\n  " + "\n  ".join(problems[:10]))
+            sys.exit(1)
+        print("Kết quả trùng từng bit với PEFT merge_and_unload.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""So sánh đường file tạm cũ với đường in-memory mới cho audio đầu vào (STT) và audio TTS trả về.
+
+Đo thời gian (trung vị) và đỉnh bộ nhớ Python (tracemalloc) của từng đường:
+    python -m benchmarks.bench_media_io --seconds 30 --tmpdir /runpod-volume
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+from media_io import SAMPLE_RATE, b64decode, b64encode, decode_audio
+
+
+def make_wav_bytes(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(signal.tobytes())
+    return buffer.getvalue()
+
+
+def stt_input_tempfile(audio_base64, tmpdir):
+    # Đường cũ: base64 -> NamedTemporaryFile -> đọc lại từ đường dẫn -> dọn file
+    audio_bytes = base64.b64decode(audio_base64)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav", dir=tmpdir) as temp_audio:
+        temp_audio.write(audio_bytes)
+        path = temp_audio.name
+    try:
+        with open(path, "rb") as f:
+            return decode_audio(f.read())
+    finally:
+        os.remove(path)
+
+
+def stt_input_memory(audio_base64, tmpdir):
+    return decode_audio(b64decode(audio_base64))
+
+
+def tts_output_tempfile(audio_bytes, tmpdir):
+    # Đường cũ: edge-tts ghi mp3 ra đĩa, đọc lại để base64 rồi xóa
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3", dir=tmpdir) as temp_tts:
+        path = temp_tts.name
+    try:
+        with open(path, "wb") as f:
+            f.write(audio_bytes)
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+    finally:
+        os.remove(path)
+
+
+def tts_output_memory(audio_bytes, tmpdir):
+    return b64encode(audio_bytes)
+
+
+def measure(fn, payload, tmpdir, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(payload, tmpdir)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(payload, tmpdir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times) * 1000, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=30, help="Độ dài audio đầu vào giả lập")
+    parser.add_argument("--tts-kb", type=int, default=256, help="Kích thước mp3 TTS giả lập")
+    parser.add_argument("--tmpdir", default=None, help="Thư mục cho file tạm (vd: network volume)")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    wav_base64 = base64.b64encode(make_wav_bytes(args.seconds)).decode("ascii")
+    tts_bytes = os.urandom(args.tts_kb * 1024)
+
+    cases = [
+        ("stt input  / tempfile", stt_input_tempfile, wav_base64),
+        ("stt input  / memory  ", stt_input_memory, wav_base64),
+        ("tts output / tempfile", tts_output_tempfile, tts_bytes),
+        ("tts output / memory  ", tts_output_memory, tts_bytes),
+    ]
+    for name, fn, payload in cases:
+        latency_ms, peak_mb = measure(fn, payload, args.tmpdir, args.repeats)
+        print(f"{name}: {latency_ms:8.2f} ms  peak {peak_mb:7.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
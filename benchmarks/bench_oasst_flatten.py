@@ -0,0 +1,104 @@
+"""Đo thời gian làm phẳng cây hội thoại OASST2: vòng lặp cũ (quét cả bảng cho mỗi prompter) so với join/chỉ mục.
+
+Cây tổng hợp có kích thước giống OASST2 (~130k tin nhắn):
+    python -m benchmarks.bench_oasst_flatten --messages 130000
+    python -m benchmarks.bench_oasst_flatten --legacy-limit 0   # bỏ qua vòng lặp cũ
+
+Vòng lặp cũ là O(n^2) nên mặc định chỉ chạy trên `--legacy-limit` prompter đầu tiên rồi ngoại suy,
+đồng thời kiểm tra kết quả của nó trùng với flatten_oasst_pairs trên cùng tập prompter.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_preparation import flatten_oasst_pairs, flatten_oasst_threads
+
+LANGS = ["en", "de", "es", "ru", "zh", "fr"]
+LANG_WEIGHTS = [0.45, 0.15, 0.15, 0.1, 0.1, 0.05]
+
+
+def make_oasst_tree(n_messages, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    tree = 0
+    while len(rows) < n_messages:
+        tree_lang = rng.choice(LANGS, p=LANG_WEIGHTS)
+        root_id = f"m{len(rows)}"
+        rows.append((root_id, None, "prompter", tree_lang, f"question {len(rows)}", np.nan, f"t{tree}"))
+        frontier = [(root_id, "prompter", 0)]
+        while frontier and len(rows) < n_messages:
+            parent_id, parent_role, depth = frontier.pop()
+            if parent_role == "prompter":
+                for rank in range(int(rng.integers(1, 4))):
+                    message_id = f"m{len(rows)}"
+                    rows.append((message_id, parent_id, "assistant", tree_lang, f"answer {len(rows)}", float(rank), f"t{tree}"))
+                    frontier.append((message_id, "assistant", depth + 1))
+            elif rng.random() < 0.5 / (depth + 1):
+                for _ in range(int(rng.integers(1, 3))):
+                    message_id = f"m{len(rows)}"
+                    rows.append((message_id, parent_id, "prompter", tree_lang, f"follow-up {len(rows)}", np.nan, f"t{tree}"))
+                    frontier.append((message_id, "prompter", depth + 1))
+        tree += 1
+    columns = ["message_id", "parent_id", "role", "lang", "text", "rank", "message_tree_id"]
+    return pd.DataFrame(rows[:n_messages], columns=columns)
+
+
+def legacy_flatten(oasst_df, limit):
+    # Đúng vòng lặp cũ trong prepare_datasets(), dừng sau `limit` prompter
+    oasst_filtered = oasst_df[oasst_df["lang"].isin(["en", "de"])]
+    oasst_data = []
+    seen = 0
+    for _, row in oasst_filtered.iterrows():
+        if row["role"] == "prompter":
+            seen += 1
+            if seen > limit:
+                break
+            responses = oasst_df[oasst_df["parent_id"] == row["message_id"]]
+            for _, resp in responses.iterrows():
+                if resp["role"] == "assistant":
+                    oasst_data.append({"instruction": row["text"], "input": "", "output": resp["text"]})
+    return oasst_data, min(seen, limit)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=130_000)
+    parser.add_argument("--legacy-limit", type=int, default=500, help="Số prompter chạy bằng vòng lặp cũ; 0 = bỏ qua")
+    args = parser.parse_args()
+
+    oasst_df = make_oasst_tree(args.messages)
+    is_prompter = (oasst_df["role"] == "prompter") & oasst_df["lang"].isin(["en", "de"])
+    n_prompters = int(is_prompter.sum())
+    print(f"{len(oasst_df)} messages, {oasst_df['message_tree_id'].nunique()} trees, {n_prompters} en/de prompters")
+
+    pairs, pairs_s = timed(flatten_oasst_pairs, oasst_df)
+    print(f"pairs (join)        : {pairs_s * 1000:9.1f} ms  {len(pairs)} samples")
+    top_pairs, top_pairs_s = timed(flatten_oasst_pairs, oasst_df, top_ranked_only=True)
+    print(f"pairs (top-ranked)  : {top_pairs_s * 1000:9.1f} ms  {len(top_pairs)} samples")
+    threads, threads_s = timed(flatten_oasst_threads, oasst_df)
+    print(f"threads             : {threads_s * 1000:9.1f} ms  {len(threads)} samples")
+    top_threads, top_threads_s = timed(flatten_oasst_threads, oasst_df, top_ranked_only=True)
+    print(f"threads (top-ranked): {top_threads_s * 1000:9.1f} ms  {len(top_threads)} samples")
+
+    # Bỏ phần lịch sử thì mỗi mẫu threads là đúng một cặp (prompter, assistant) của pairs
+    assert sorted((s["instruction"], s["output"]) for s in threads) == sorted((s["instruction"], s["output"]) for s in pairs)
+
+    if args.legacy_limit:
+        legacy, legacy_s = timed(legacy_flatten, oasst_df, args.legacy_limit)
+        legacy_data, checked = legacy
+        assert legacy_data == pairs[:len(legacy_data)], "kết quả khác vòng lặp cũ"
+        estimate = legacy_s / checked * n_prompters
+        print(f"legacy ({checked} prompters): {legacy_s:7.2f} s -> ước tính toàn bộ {estimate:8.1f} s "
+              f"({estimate / pairs_s:.0f}x chậm hơn join)")
+
+
+if __name__ == "__main__":
+    main()
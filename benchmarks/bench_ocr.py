@@ -0,0 +1,104 @@
+"""So sánh OCR cũ (img.point lambda + một lần image_to_string cho cả ảnh) với OCRPipeline.
+
+Dùng ảnh thật nếu có, nếu không thì tự sinh một trang bài tập cỡ ảnh điện thoại (nghiêng 3°, có 2 cột):
+    python -m benchmarks.bench_ocr --image samples/worksheet.jpg --workers 4
+    python -m benchmarks.bench_ocr --no-recognize   # chỉ đo các bước tiền xử lý (không cần tesseract)
+"""
+import argparse
+import io
+import statistics
+import time
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from ocr_pipeline import OCRPipeline
+
+SAMPLE_LINES = [
+    "1. Yesterday I go to the school with my brother.",
+    "2. She don't like apples, but she likes bananas.",
+    "3. Ich habe gestern ein Buch gelest.",
+    "4. We was very happy when the holidays started.",
+    "5. Er hat mit seine Freunde Fußball gespielt.",
+]
+
+
+def make_worksheet(width=3024, height=4032, skew=3.0):
+    img = Image.new("RGB", (width, height), (236, 232, 222))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=width // 55)
+    line_height = width // 32
+    y = width // 15
+    for block in range(3):
+        for line in SAMPLE_LINES:
+            draw.text((width // 20, y), line, fill=(25, 25, 35), font=font)
+            y += line_height
+        y += line_height * 3
+    # Phần bài tập 2 cột
+    for row, line in enumerate(SAMPLE_LINES):
+        draw.text((width // 20, y + row * line_height), line[:24], fill=(25, 25, 35), font=font)
+        draw.text((width // 2 + width // 20, y + row * line_height), line[24:], fill=(25, 25, 35), font=font)
+    img = img.rotate(skew, expand=True, fillcolor=(236, 232, 222))
+
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def legacy_ocr(image_bytes, lang, recognize):
+    # Đường cũ của VoiceTutor: ngưỡng bằng lambda Python cho từng giá trị pixel, OCR cả ảnh một lần
+    img = Image.open(io.BytesIO(image_bytes))
+    img = ImageOps.grayscale(img)
+    img = img.point(lambda p: 255 if p > 128 else 0)
+    if not recognize:
+        return ""
+    import pytesseract
+
+    return pytesseract.image_to_string(img, lang=lang).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", default=None, help="Ảnh bài tập; bỏ trống để tự sinh")
+    parser.add_argument("--lang", default="eng+deu")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-recognize", action="store_true", help="Bỏ qua tesseract, chỉ đo tiền xử lý")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+    else:
+        image_bytes = make_worksheet()
+    recognize = not args.no_recognize
+
+    legacy_times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        legacy_ocr(image_bytes, args.lang, recognize)
+        legacy_times.append(time.perf_counter() - start)
+    print(f"legacy   : {statistics.median(legacy_times) * 1000:9.1f} ms")
+
+    pipeline = OCRPipeline(lang=args.lang, max_workers=args.workers)
+    pipeline.warmup()
+    runs = []
+    for _ in range(args.repeats):
+        if recognize:
+            runs.append(pipeline.recognize(image_bytes).timings)
+        else:
+            timings = {}
+            start = time.perf_counter()
+            page = pipeline.preprocess(image_bytes, timings)
+            timings["tile_count"] = len(pipeline.tiles(page))
+            timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            runs.append(timings)
+    pipeline.close()
+
+    print(f"pipeline : {statistics.median(run['total_ms'] for run in runs):9.1f} ms")
+    for stage in runs[0]:
+        if stage != "total_ms":
+            print(f"  {stage:14s} {statistics.median(run[stage] for run in runs):9.1f}")
+
+
+if __name__ == "__main__":
+    main()
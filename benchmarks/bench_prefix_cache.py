@@ -0,0 +1,63 @@
+"""Đo thời gian prefill (tới token đầu tiên) khi có / không có prefix KV cache cho prompt gia sư.
+
+    python -m benchmarks.bench_prefix_cache --jobs 32
+"""
+import argparse
+import statistics
+
+import torch
+from transformers import LogitsProcessorList
+
+from benchmarks._common import DEFAULT_TINY_MODEL, SAMPLE_SENTENCES, load_tiny_lm
+from prefix_cache import PrefillTimer, PrefixCache
+from tutor_prompts import render_with_static_prefix, template_hash, worker_messages
+
+
+def prefill_ms(model, tokenizer, inputs):
+    timer = PrefillTimer()
+    with torch.inference_mode():
+        model.generate(
+            **inputs,
+            max_new_tokens=1,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+            logits_processor=LogitsProcessorList([timer]),
+        )
+    return timer.prefill_seconds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--jobs", type=int, default=32)
+    args = parser.parse_args()
+
+    tokenizer, model = load_tiny_lm(args.model)
+    cache = PrefixCache(model, tokenizer)
+
+    jobs = []
+    for i in range(args.jobs):
+        input_type = "image" if i % 4 == 0 else "text"
+        lang = "de" if i % 3 == 0 else "en"
+        messages = worker_messages(input_type, SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)], lang)
+        jobs.append((input_type, lang, *render_with_static_prefix(tokenizer, messages)))
+
+    baseline, cached, prompt_tokens = [], [], 0
+    for input_type, lang, prompt, static_prefix in jobs:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        prompt_tokens += inputs.input_ids.shape[1]
+        baseline.append(prefill_ms(model, tokenizer, dict(inputs)))
+
+        cached_inputs, _ = cache.generate_inputs(prompt, static_prefix, lang, input_type, template_hash(static_prefix))
+        cached.append(prefill_ms(model, tokenizer, cached_inputs))
+
+    stats = cache.stats()
+    print(f"jobs={args.jobs} prompt_tokens={prompt_tokens} tokens_saved={stats['tokens_saved']} "
+          f"({stats['tokens_saved'] / prompt_tokens:.0%})")
+    print(f"prefill p50 no cache  : {statistics.median(baseline):7.2f} ms")
+    print(f"prefill p50 with cache: {statistics.median(cached):7.2f} ms (prefix builds: {stats['builds']}, "
+          f"{stats['prefix_build_ms']} ms total)")
+
+
+if __name__ == "__main__":
+    main()
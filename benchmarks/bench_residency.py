@@ -0,0 +1,76 @@
+"""ResidencyManager: hai model chỉ đủ chỗ cho một, chạy xen kẽ như job audio (STT rồi LLM).
+
+So sánh policy unload (nạp lại từ ổ cứng mỗi lần) với offload (giữ bản sao trên RAM, pinned khi có CUDA),
+kiểm tra câu trả lời của LLM giống hệt trước / sau khi bị đẩy ra, in độ trễ nạp / đẩy ra / đưa lại:
+    python -m benchmarks.bench_residency --model <thư-mục-model> --jobs 6
+Không có GPU thì ngân sách được tính trên CPU: offload chỉ là chép sang bộ đệm RAM, vẫn đo được logic LRU.
+"""
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM
+
+from benchmarks._common import DEFAULT_TINY_MODEL, load_tiny_lm, tutor_prompts
+from residency import LazyResident, ResidencyManager, TorchResident
+
+
+def run(args, policy, device):
+    tokenizer, model = load_tiny_lm(args.model)
+    model.to(device)
+    llm = TorchResident("llm", model)
+
+    def load_stt():
+        # Model thứ hai đóng vai Whisper: nạp từ ổ cứng mỗi lần load
+        stand_in = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32).to(device)
+        return stand_in.eval()
+
+    stt = LazyResident(
+        "stt", load_stt, device=device, policy=policy, footprint_bytes=llm.footprint_bytes,
+        offload=lambda m: m.to("cpu"), restore=lambda m: m.to(device))
+    # Ngân sách chỉ đủ cho một trong hai model
+    manager = ResidencyManager(int(llm.footprint_bytes * 1.5), log=False, budget_device=device.split(":")[0])
+    manager.register(llm)
+    manager.register(stt)
+
+    prompt = tutor_prompts(tokenizer, 1)[0]
+    inputs = tokenizer(prompt, return_tensors="pt")
+    generate_kwargs = {"max_new_tokens": args.max_new_tokens, "do_sample": False, "pad_token_id": tokenizer.pad_token_id}
+
+    with manager.use("llm") as lm, torch.inference_mode():
+        reference = lm.generate(**inputs.to(device), **generate_kwargs)
+
+    identical = True
+    start = time.perf_counter()
+    for _ in range(args.jobs):
+        manager.prefetch("stt", "llm")
+        time.sleep(args.decode_ms / 1000)  # giải mã audio: prefetch chạy gối đầu
+        with manager.use("stt") as stand_in, torch.inference_mode():
+            stand_in(**inputs.to(device))
+        with manager.use("llm") as lm, torch.inference_mode():
+            output = lm.generate(**inputs.to(device), **generate_kwargs)
+        identical &= torch.equal(output, reference)
+    seconds = time.perf_counter() - start
+    return seconds / args.jobs, identical, manager.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--jobs", type=int, default=6)
+    parser.add_argument("--decode-ms", type=float, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Device: {device}")
+    for policy in ("unload", "offload"):
+        per_job, identical, stats = run(args, policy, device)
+        print(f"stt.policy = {policy}: {per_job * 1000:.0f} ms / job, LLM giống trước khi bị đẩy ra: {identical}")
+        print(f"  budget {stats['budget_mb']} MB, model {stats['models']['llm']['footprint_mb']} MB mỗi cái")
+        for event, values in sorted(stats["events"].items()):
+            print(f"  {event}: {values['count']} lần, {values['avg_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Hội thoại nhiều lượt: so sánh gửi lại cả lịch sử mỗi lượt với SessionStore (giữ KV giữa các lượt).
+
+Kiểm tra câu trả lời greedy giống hệt nhau, in số token phải prefill và thời gian prefill theo lượt:
+    python -m benchmarks.bench_sessions --model <thư-mục-model> --turns 8 --sessions 3 --max-resident 1
+"""
+import argparse
+
+from benchmarks._common import DEFAULT_TINY_MODEL, SAMPLE_SENTENCES, load_tiny_lm
+from llm_backend import TransformersBackend
+from session_store import SessionStore
+from tutor_prompts import VOICE_TUTOR_SYSTEM_PROMPT
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=3, help="Số phiên chạy xen kẽ")
+    parser.add_argument("--max-resident", type=int, default=1)
+    parser.add_argument("--offload", default="cpu", choices=["cpu", "disk", "none"])
+    parser.add_argument("--max-context-tokens", type=int, default=3072)
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    args = parser.parse_args()
+
+    tokenizer, model = load_tiny_lm(args.model)
+    generation_kwargs = {"max_new_tokens": args.max_new_tokens, "pad_token_id": tokenizer.pad_token_id}
+    llm = TransformersBackend(model, tokenizer, generation_kwargs)
+    store = SessionStore(model, max_resident=args.max_resident, offload=args.offload,
+                         max_context_tokens=args.max_context_tokens, summary_max_new_tokens=32)
+
+    totals = {"full": [0, 0.0], "session": [0, 0.0]}
+    identical = True
+    print(f"{'lượt':>4} {'prefill (full)':>15} {'prefill (phiên)':>16} {'ms (full)':>10} {'ms (phiên)':>11}")
+    for turn in range(args.turns):
+        row = {"full": [0, 0.0], "session": [0, 0.0]}
+        for i in range(args.sessions):
+            session = store.open(f"s{i}")
+            text = SAMPLE_SENTENCES[(turn * args.sessions + i) % len(SAMPLE_SENTENCES)]
+            messages = store.build_messages(session, VOICE_TUTOR_SYSTEM_PROMPT, text, llm,
+                                            reserve_tokens=args.max_new_tokens)
+            full = llm.stream(messages)
+            full_text = "".join(full)
+            generation = llm.stream(messages, session=session)
+            response = "".join(generation)
+            identical &= response == full_text
+            store.add_turn(session, text, response.strip(), generation.stats)
+            for name, stats in (("full", full.stats), ("session", generation.stats)):
+                row[name][0] += stats["prompt_tokens"] - (stats["prefix_tokens_reused"] or 0)
+                row[name][1] += stats["prefill_ms"] or 0.0
+        for name in totals:
+            totals[name][0] += row[name][0]
+            totals[name][1] += row[name][1]
+        print(f"{turn + 1:>4} {row['full'][0]:>15} {row['session'][0]:>16} {row['full'][1]:>10.1f} {row['session'][1]:>11.1f}")
+
+    print(f"tổng {totals['full'][0]:>15} {totals['session'][0]:>16} {totals['full'][1]:>10.1f} {totals['session'][1]:>11.1f}")
+    print(f"Câu trả lời giống hệt: {identical}")
+    print(f"SessionStore: {store.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""So sánh sinh bình thường với speculative decoding (prompt lookup / draft model) trên prompt gia sư.
+
+Kiểm tra câu trả lời greedy giống hệt nhau, in tỉ lệ chấp nhận, tốc độ decode và speedup:
+    python -m benchmarks.bench_speculative --model <thư-mục-model>
+    python -m benchmarks.bench_speculative --model <model 8B> --draft <model 1B cùng tokenizer>
+"""
+import argparse
+import time
+
+from benchmarks._common import DEFAULT_TINY_MODEL, SAMPLE_SENTENCES, load_tiny_lm
+from llm_backend import TransformersBackend
+from speculative import SpeculativeDecoding
+from tutor_prompts import worker_messages
+
+
+def run(llm, jobs, lang):
+    texts, stats = [], []
+    start = time.perf_counter()
+    for i in range(jobs):
+        messages = worker_messages("text", SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)], lang)
+        generation = llm.stream(messages, cache_key=(lang, "text"))
+        texts.append("".join(generation))
+        stats.append(generation.stats)
+    return texts, stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--draft", help="Model nháp cho method draft_model (bỏ trống: chỉ đo prompt_lookup)")
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--num-tokens", type=int, default=10)
+    parser.add_argument("--lang", default="en")
+    args = parser.parse_args()
+
+    tokenizer, model = load_tiny_lm(args.model)
+    generation_kwargs = {"max_new_tokens": args.max_new_tokens, "pad_token_id": tokenizer.pad_token_id}
+    methods = {"none": None, "prompt_lookup": SpeculativeDecoding("prompt_lookup", num_tokens=args.num_tokens)}
+    if args.draft:
+        draft_tokenizer, draft_model = load_tiny_lm(args.draft)
+        methods["draft_model"] = SpeculativeDecoding("draft_model", draft_model=draft_model, draft_tokenizer=draft_tokenizer)
+
+    # Lượt đầu để khởi tạo (không tính)
+    "".join(TransformersBackend(model, tokenizer, generation_kwargs).stream(
+        worker_messages("text", SAMPLE_SENTENCES[0], args.lang), max_new_tokens=4))
+
+    reference = None
+    print(f"{'method':14} {'tổng s':>7} {'decode tok/s':>12} {'chấp nhận':>10} {'speedup':>8}  giống baseline")
+    for name, speculative in methods.items():
+        llm = TransformersBackend(model, tokenizer, generation_kwargs, speculative=speculative)
+        texts, stats, seconds = run(llm, args.jobs, args.lang)
+        decode_tokens = sum(s["generated_tokens"] - 1 for s in stats if s.get("decode_ms"))
+        decode_rate = decode_tokens / (sum(s["decode_ms"] for s in stats if s.get("decode_ms")) / 1000)
+        if reference is None:
+            reference = (texts, decode_rate)
+        acceptance = speculative.stats()["acceptance_rate"] if speculative is not None else None
+        print(f"{name:14} {seconds:7.2f} {decode_rate:12.1f} {acceptance if acceptance is not None else '-':>10} "
+              f"{decode_rate / reference[1]:8.2f}  {texts == reference[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Đo real-time factor (RTF = thời gian xử lý / độ dài audio) của STTEngine trên CPU.
+
+Dùng file WAV thật nếu có, nếu không thì tự sinh WAV mẫu (tín hiệu xen kẽ khoảng lặng):
+    python -m benchmarks.bench_stt --wav samples/short.wav samples/lecture.wav
+    python -m benchmarks.bench_stt --model tiny --seconds 10 60 --threads 4
+
+Mỗi file chạy với 3 cấu hình: không VAD, có VAD, có VAD + giải mã batch (bản ghi dài).
+"""
+import argparse
+import io
+import statistics
+import time
+import wave
+
+import numpy as np
+
+from media_io import SAMPLE_RATE, decode_audio
+from stt_engine import STTEngine
+
+
+def make_sample_wav(seconds, speech_ratio=0.6, seed=0):
+    # Các đoạn "tiếng nói" (hài âm có điều biên) xen với khoảng lặng, để VAD có cái để cắt
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+    position = 0
+    while position < len(audio):
+        speech = int(rng.uniform(1.0, 3.0) * SAMPLE_RATE)
+        silence = int(speech * (1 - speech_ratio) / speech_ratio)
+        t = np.arange(min(speech, len(audio) - position)) / SAMPLE_RATE
+        f0 = rng.uniform(110, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+        audio[position:position + len(t)] = 0.2 * voiced * envelope
+        position += speech + silence
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def measure(engine, audio, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = engine.transcribe(audio)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", nargs="*", default=[], help="File WAV mẫu; bỏ trống để tự sinh")
+    parser.add_argument("--seconds", type=float, nargs="*", default=[10, 60], help="Độ dài các WAV tự sinh")
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    samples = []
+    for path in args.wav:
+        with open(path, "rb") as f:
+            samples.append((path, decode_audio(f.read())))
+    if not args.wav:
+        for seconds in args.seconds:
+            samples.append((f"synthetic {seconds:.0f}s", decode_audio(make_sample_wav(seconds))))
+
+    common = dict(model_size=args.model, device="cpu", compute_type="int8", cpu_threads=args.threads,
+                  batch_size=args.batch_size)
+    engines = [
+        ("no vad        ", STTEngine(vad_filter=False, batch_min_seconds=float("inf"), **common)),
+        ("vad           ", STTEngine(vad_filter=True, batch_min_seconds=float("inf"), **common)),
+        ("vad + batched ", STTEngine(vad_filter=True, batch_min_seconds=0, **common)),
+    ]
+
+    for name, audio in samples:
+        duration = len(audio) / SAMPLE_RATE
+        print(f"{name} ({duration:.1f}s audio)")
+        for label, engine in engines:
+            engine.transcribe(audio[:SAMPLE_RATE]) # warmup
+            seconds, result = measure(engine, audio, args.repeats)
+            print(f"  {label}: {seconds * 1000:9.1f} ms  RTF {seconds / duration:.3f}  "
+                  f"speech {result.speech_duration:.1f}s  lang {result.language} ({result.language_probability:.2f})")
+
+
+if __name__ == "__main__":
+    main()
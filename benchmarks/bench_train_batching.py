@@ -0,0 +1,111 @@
+"""So sánh padding / group_by_length / packing khi fine-tune một model nhỏ trên CPU.
+
+Dataset tổng hợp có phân bố độ dài lệch giống Alpaca (đa số mẫu ngắn, ít mẫu rất dài):
+    python -m benchmarks.bench_train_batching --model /path/to/tiny-llama --steps 30
+    python -m benchmarks.bench_train_batching --samples 5000 --max-length 512 --batch-size 8
+
+Đo thêm thời gian pretokenize lần đầu so với khi đọc lại cache.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import torch
+from datasets import Dataset
+from torch.utils.data import DataLoader
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks._common import DEFAULT_TINY_MODEL
+from train_data import BATCHING_MODES, SFTCollator, batch_order, batching_stats, pack_dataset, pretokenize
+
+WORDS = ("the a cat dog school went goes yesterday apple like don't she he we they book read write "
+         "Haus Schule gestern gehen spielen Garten ich wir sind haben").split()
+
+
+def make_alpaca_like(n, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def words(mean):
+        return " ".join(rng.choice(WORDS, size=max(1, int(rng.lognormal(np.log(mean), 0.8)))))
+
+    return Dataset.from_dict({
+        "instruction": [words(12) for _ in range(n)],
+        "input": [words(10) if rng.random() < 0.4 else "" for _ in range(n)],
+        "output": [words(40) for _ in range(n)],
+    })
+
+
+def run_mode(model, dataset, collator, mode, batch_size, steps, seed=0):
+    order = batch_order(dataset["length"], batch_size, 1, mode, seed)
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=order.tolist(), collate_fn=collator)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+
+    real_tokens = computed_tokens = done = 0
+    start = None
+    for batch in loader:
+        if done == 1:
+            # Bỏ bước đầu (khởi tạo optimizer, cấp phát bộ nhớ) khỏi phép đo
+            start = time.perf_counter()
+            real_tokens = computed_tokens = 0
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        mask = batch.get("attention_mask")
+        real_tokens += int(mask.sum()) if mask is not None else batch["input_ids"].numel()
+        computed_tokens += batch["input_ids"].numel()
+        done += 1
+        if done > steps:
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        "tokens_per_s": real_tokens / elapsed,
+        "step_ms": elapsed / (done - 1) * 1000,
+        "padding_efficiency": real_tokens / computed_tokens,
+        "tokens_per_step": real_tokens / (done - 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_TINY_MODEL)
+    parser.add_argument("--samples", type=int, default=4000)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--modes", nargs="+", default=list(BATCHING_MODES), choices=BATCHING_MODES)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    raw = make_alpaca_like(args.samples)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        tokenized = pretokenize(raw, tokenizer, args.max_length, cache_dir, source_fingerprint="bench")
+        cold_s = time.perf_counter() - start
+        start = time.perf_counter()
+        tokenized = pretokenize(raw, tokenizer, args.max_length, cache_dir, source_fingerprint="bench")
+        warm_s = time.perf_counter() - start
+        print(f"pretokenize {len(raw)} samples: {cold_s * 1000:.0f} ms lần đầu, {warm_s * 1000:.0f} ms từ cache")
+        lengths = np.asarray(tokenized["length"])
+        print(f"độ dài token: mean {lengths.mean():.0f}, p50 {np.percentile(lengths, 50):.0f}, "
+              f"p95 {np.percentile(lengths, 95):.0f}, max {lengths.max()}")
+
+        collator = SFTCollator(tokenizer.pad_token_id)
+        print(f"{'mode':16} {'pad eff (est)':>13} {'pad eff':>8} {'tok/step':>9} {'step ms':>8} {'tok/s':>9}")
+        for mode in args.modes:
+            dataset = pack_dataset(tokenized, args.max_length) if mode == "packing" else tokenized
+            estimate = batching_stats(dataset["length"], args.batch_size, 1, mode)
+            model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+            result = run_mode(model, dataset, collator, mode, args.batch_size, args.steps)
+            print(f"{mode:16} {estimate['padding_efficiency']:13.3f} {result['padding_efficiency']:8.3f} "
+                  f"{result['tokens_per_step']:9.0f} {result['step_ms']:8.1f} {result['tokens_per_s']:9.0f}")
+
+
+if __name__ == "__main__":
+    main()
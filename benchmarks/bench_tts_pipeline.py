@@ -0,0 +1,69 @@
+"""Đo độ trễ TTS: đợi LLM sinh xong rồi đọc cả đoạn vs. đọc gối đầu từng câu trong lúc sinh.
+
+Dùng LocalSynthesizer nên chạy offline, đồng thời kiểm tra audio được ghép đúng thứ tự câu.
+    python -m benchmarks.bench_tts_pipeline --token-ms 25
+"""
+import argparse
+import time
+
+from tts_service import LocalSynthesizer, TTSService
+
+RESPONSE = (
+    "Bạn đã chia sai động từ ở thì quá khứ đơn. "
+    "Với chủ ngữ số ít, 'goes' chỉ dùng ở thì hiện tại đơn. "
+    "Vì có trạng từ 'yesterday' nên động từ phải ở dạng quá khứ là 'went'. "
+    "Ngoài ra, hãy chú ý phát âm đuôi '-ed' khi luyện nói. "
+    "Câu đúng là: I went to school yesterday."
+)
+
+
+def fake_token_stream(text, token_ms):
+    for word in text.split(" "):
+        time.sleep(token_ms / 1000.0)
+        yield word + " "
+
+
+def run_sequential(service, voice, token_ms):
+    # Đường cũ: gom đủ câu trả lời rồi gửi cả đoạn sang TTS một lần
+    start = time.perf_counter()
+    text = "".join(fake_token_stream(RESPONSE, token_ms)).strip()
+    audio = service.submit(text, voice).result()
+    return time.perf_counter() - start, audio
+
+
+def run_pipelined(service, voice, token_ms):
+    start = time.perf_counter()
+    pipeline = service.pipeline(voice)
+    for delta in fake_token_stream(RESPONSE, token_ms):
+        pipeline.feed(delta)
+    audio = pipeline.finish()
+    return time.perf_counter() - start, audio, pipeline.sentences
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--token-ms", type=float, default=25, help="Độ trễ giả lập cho mỗi token của LLM")
+    parser.add_argument("--base-latency-ms", type=float, default=300, help="Độ trễ cố định mỗi phiên TTS")
+    parser.add_argument("--per-char-ms", type=float, default=8)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    synthesizer = LocalSynthesizer(args.base_latency_ms, args.per_char_ms)
+    service = TTSService(synthesizer, max_concurrency=args.max_concurrency)
+    voice = "vi-VN-HoaiMyNeural"
+
+    sequential_s, _ = run_sequential(service, voice, args.token_ms)
+    pipelined_s, audio, sentences = run_pipelined(service, voice, args.token_ms)
+    service.close()
+
+    expected = b"".join(f"[{voice}] {s}\n".encode("utf-8") for s in sentences)
+    assert audio == expected, "Audio chunks were concatenated out of order"
+
+    print(f"sentences : {len(sentences)} (thứ tự ghép audio: OK)")
+    print(f"sequential: {sequential_s * 1000:8.1f} ms")
+    print(f"pipelined : {pipelined_s * 1000:8.1f} ms")
+    print(f"speedup   : {sequential_s / pipelined_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""VoiceTutor.respond (STT + OCR song song, TTS gối đầu LLM) so với luồng tuần tự cũ của main().
+
+STT / OCR / LLM / TTS là bản giả lập (benchmarks/_stubs.py, LocalSynthesizer) nên chạy được trên CPU.
+Đo một lượt có cả audio và ảnh, rồi nhiều phiên cùng lúc trong một event loop, kèm độ trễ lớn nhất
+của event loop (heartbeat) để thấy lời gọi chặn:
+    python -m benchmarks.bench_voice_async --sessions 8 --stt-rtf 0.1 --token-ms 15
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks._stubs import StubLLM, StubOCR, StubSTT
+from benchmarks.bench_ocr import make_worksheet
+from benchmarks.bench_stt import make_sample_wav
+from media_io import decode_audio
+from metrics import JobTimings
+from tts_service import LocalSynthesizer
+from voice_assistant import VoiceTutor
+
+
+class StubTutor(VoiceTutor):
+    """VoiceTutor với các model giả lập, không đọc config.yaml."""
+
+    def __init__(self, args):
+        self.config = {"voice": {}}
+        self.timings = JobTimings()
+        self.voice_en, self.voice_de, self.voice_vn = "en-US-EmmaNeural", "de-DE-KatjaNeural", "vi-VN-HoaiMyNeural"
+        self.ocr_enabled = True
+        self.ocr_lang = "eng"
+        self.ocr_pipeline = StubOCR(tile_ms=args.tile_ms)
+        self.analysis_prompt_template = "Analyze this text: {text}"
+        self.synthesizer = LocalSynthesizer(args.tts_base_ms, args.tts_char_ms)
+        self.min_sentence_chars = 20
+        self.executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="tutor")
+        self.stt_engine = StubSTT(rtf=args.stt_rtf)
+        self.generation_kwargs = {"max_new_tokens": args.max_new_tokens}
+        self.llm = StubLLM(args.prefill_ms, args.token_ms, max_new_tokens=args.max_new_tokens)
+        self.sessions = None
+
+
+async def sequential_turn(tutor, audio, image_path, output_path):
+    # Luồng cũ của main(): các lời gọi chặn chạy thẳng trên event loop, lần lượt từng bước
+    tutor.reset_timings()
+    user_text, lang = tutor.transcribe(audio)
+    image_text = tutor.process_image(image_path)
+    response = tutor.generate_response(user_text, lang, image_text)
+    await tutor.speak(response, output_path)
+    return response
+
+
+async def heartbeat(stop, interval=0.01):
+    """Độ trễ lớn nhất (ms) giữa lúc hẹn và lúc event loop thực sự chạy lại heartbeat."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst * 1000
+
+
+async def measure(turns):
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*turns)
+    seconds = time.perf_counter() - start
+    stop.set()
+    return seconds * 1000, await beat, results
+
+
+async def run(args, tmp):
+    tutor = StubTutor(args)
+    audio = decode_audio(make_sample_wav(args.audio_seconds))
+    image_path = os.path.join(tmp, "worksheet.jpg")
+    with open(image_path, "wb") as f:
+        f.write(make_worksheet(width=args.image_width, height=args.image_width * 4 // 3))
+    output = os.path.join(tmp, "response.mp3")
+
+    # Một lượt có cả audio và ảnh
+    sequential_ms, sequential_lag, (sequential,) = await measure([sequential_turn(tutor, audio, image_path, output)])
+    respond_ms, respond_lag, (turn,) = await measure([tutor.respond(audio, image_path, output_path=output)])
+    print(f"Một lượt (audio + ảnh): tuần tự {sequential_ms:.0f} ms, respond {respond_ms:.0f} ms "
+          f"({sequential_ms / respond_ms:.2f}x), cùng câu trả lời: {turn.response == sequential}")
+    print(f"  timings respond: {turn.timings}")
+
+    # Nhiều phiên cùng lúc trong một process
+    n = args.sessions
+    sequential_ms, sequential_lag, _ = await measure(
+        [sequential_turn(tutor, audio, image_path, output) for _ in range(n)])
+    respond_ms, respond_lag, turns = await measure(
+        [tutor.respond(audio, image_path, output_path=os.path.join(tmp, f"response{i}.mp3")) for i in range(n)])
+    print(f"{n} phiên đồng thời: tuần tự {sequential_ms:.0f} ms, respond {respond_ms:.0f} ms "
+          f"({sequential_ms / respond_ms:.2f}x)")
+    print(f"  event loop trễ tối đa: tuần tự {sequential_lag:.0f} ms, respond {respond_lag:.0f} ms")
+    print(f"  lượt có câu trả lời: {sum(bool(t.response) for t in turns)}/{n}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--audio-seconds", type=float, default=8)
+    parser.add_argument("--stt-rtf", type=float, default=0.1)
+    parser.add_argument("--image-width", type=int, default=1512)
+    parser.add_argument("--tile-ms", type=float, default=150)
+    parser.add_argument("--prefill-ms", type=float, default=40)
+    parser.add_argument("--token-ms", type=float, default=15)
+    parser.add_argument("--max-new-tokens", type=int, default=400)
+    parser.add_argument("--tts-base-ms", type=float, default=150)
+    parser.add_argument("--tts-char-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, tmp))
+
+
+if __name__ == "__main__":
+    main()
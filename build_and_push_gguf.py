@@ -1,65 +1,362 @@
+"""Build GGUF theo từng bước, mỗi artifact được khóa bằng hash nội dung đầu vào của nó.
+
+    snapshot  -> file model (safetensors + config + tokenizer) từ Hub hoặc thư mục local (vd: lora_merge.py)
+    convert   -> <name>-F16.gguf          khóa: hash model + hash convert_hf_to_gguf.py
+    quantize  -> <name>-<QUANT>.gguf      khóa: sha256 của F16 + loại quant + hash binary llama-quantize
+    upload    -> kiểm tra lại sha256 từng file, chỉ đẩy file mà Hub chưa có đúng nội dung, kèm SHA256SUMS
+
+Bước nào có khóa trùng với manifest và file còn nguyên thì bỏ qua; khóa đổi (model mới, llama.cpp mới)
+thì build lại thay vì lượng tử hóa nhầm file F16 cũ. Nhiều loại quant chạy song song từ một lần convert.
+Thử cả pipeline không cần mạng / llama.cpp: `--local-hub`, `--convert-script`, `--quantize-bin`
+(xem benchmarks/bench_gguf_pipeline.py).
+
+    python build_and_push_gguf.py
+    python build_and_push_gguf.py --quant Q4_K_M Q8_0 --no-upload
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
 import os
+import shutil
 import subprocess
-from huggingface_hub import snapshot_download, HfApi
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+# Đổi cách tính khóa / đặt tên artifact thì tăng số này để mọi bước chạy lại
+PIPELINE_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+MODEL_PATTERNS = ("*.safetensors", "*.json", "tokenizer.model", "*.jinja")
+HASH_CHUNK = 16 * 2**20
+
 
 def run_command(command):
-    print(f"\n[Denglish-AI] Đang chạy lệnh: {command}")
-    subprocess.run(command, shell=True, check=True)
+    print(f"\n[Denglish-AI] Đang chạy lệnh: {' '.join(command)}")
+    subprocess.run(command, check=True)
 
-def main():
-    repo_id = "phgrouptechs/Denglish-8B-Instruct"
-    
-    # ĐỔI ĐƯỜNG DẪN LƯU GGUF SANG Ổ /tmp ĐỂ KHÔNG BỊ FULL Ổ MẠNG
-    gguf_f16_path = "/tmp/Denglish-8B-Instruct-F16.gguf"
-    gguf_q4_path = "/tmp/Denglish-8B-Instruct-Q4_K_M.gguf"
-    repo_filename = "Denglish-8B-Instruct-Q4_K_M.gguf" # Tên hiển thị trên web Hugging Face
-    
-    print("\n--- BƯỚC 1: Tải Model từ Hugging Face ---")
-    model_path = snapshot_download(repo_id=repo_id)
-    print(f"Model đã tải xong tại: {model_path}")
-    
-    print("\n--- BƯỚC 2: Cài đặt & Biên dịch llama.cpp bằng CMake ---")
-    if not os.path.exists("llama.cpp"):
-        run_command("git clone https://github.com/ggerganov/llama.cpp")
-    
-    if not os.path.exists("llama.cpp/build"):
-        run_command("cd llama.cpp && pip install -r requirements.txt && cmake -B build && cmake --build build --config Release")
+
+def content_key(*parts):
+    return hashlib.sha256(json.dumps([PIPELINE_VERSION, *parts], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_model_file(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in MODEL_PATTERNS)
+
+
+class Manifest:
+    """manifest.json trong work_dir: khóa + sha256 của từng bước, và cache sha256 theo (path, size, mtime).
+
+    Cache hash giúp không phải đọc lại file 16 GB ở mỗi lần chạy; file bị sửa (đổi size / mtime) thì hash lại.
+    """
+
+    def __init__(self, work_dir):
+        self.path = os.path.join(work_dir, MANIFEST_FILE)
+        self.data = {"steps": {}, "file_hashes": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def step(self, name):
+        return self.data["steps"].get(name)
+
+    def record(self, name, **entry):
+        self.data["steps"][name] = {**entry, "time": time.time()}
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def sha256(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.data["file_hashes"].get(path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        digest = sha256_file(path)
+        self.data["file_hashes"][path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def is_fresh(self, name, key, path):
+        entry = self.step(name)
+        return bool(entry and entry["key"] == key and os.path.exists(path) and self.sha256(path) == entry["sha256"])
+
+
+class HfHub:
+    def __init__(self):
+        from huggingface_hub import HfApi
+        self.api = HfApi()
+
+    def files(self, repo_id):
+        """{tên file: sha256 (file LFS) hoặc blob id (file nhỏ)}; repo chưa tồn tại thì rỗng."""
+        from huggingface_hub.utils import RepositoryNotFoundError
+        try:
+            info = self.api.model_info(repo_id, files_metadata=True)
+        except RepositoryNotFoundError:
+            return {}
+        return {sibling.rfilename: sibling.lfs.sha256 if sibling.lfs else sibling.blob_id for sibling in info.siblings}
+
+    def download(self, repo_id, local_dir):
+        from huggingface_hub import snapshot_download
+        return snapshot_download(repo_id=repo_id, local_dir=local_dir, allow_patterns=list(MODEL_PATTERNS))
+
+    def upload(self, path, path_in_repo, repo_id, message):
+        self.api.upload_file(path_or_fileobj=path, path_in_repo=path_in_repo, repo_id=repo_id, repo_type="model",
+                             commit_message=message)
+
+
+class LocalHub:
+    """Thư mục đóng vai Hub khi thử pipeline: repo `org/name` nằm ở `<root>/org/name/`."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def files(self, repo_id):
+        repo_dir = os.path.join(self.root, repo_id)
+        if not os.path.isdir(repo_dir):
+            return {}
+        return {name: sha256_file(os.path.join(repo_dir, name)) for name in sorted(os.listdir(repo_dir))}
+
+    def download(self, repo_id, local_dir):
+        repo_dir = os.path.join(self.root, repo_id)
+        os.makedirs(local_dir, exist_ok=True)
+        for name in os.listdir(repo_dir):
+            if is_model_file(name):
+                shutil.copy2(os.path.join(repo_dir, name), os.path.join(local_dir, name))
+        return local_dir
+
+    def upload(self, path, path_in_repo, repo_id, message):
+        repo_dir = os.path.join(self.root, repo_id)
+        os.makedirs(repo_dir, exist_ok=True)
+        shutil.copy2(path, os.path.join(repo_dir, path_in_repo))
+
+
+def ensure_llama_cpp(llama_cpp_dir):
+    if not os.path.exists(llama_cpp_dir):
+        run_command(["git", "clone", "https://github.com/ggerganov/llama.cpp", llama_cpp_dir])
+    if not os.path.exists(os.path.join(llama_cpp_dir, "build")):
+        run_command([sys.executable, "-m", "pip", "install", "-r", os.path.join(llama_cpp_dir, "requirements.txt")])
+        run_command(["cmake", "-S", llama_cpp_dir, "-B", os.path.join(llama_cpp_dir, "build")])
+        run_command(["cmake", "--build", os.path.join(llama_cpp_dir, "build"), "--config", "Release"])
     else:
         print("Đã biên dịch llama.cpp xong, bỏ qua bước build.")
+    for candidate in ("build/bin/llama-quantize", "build/llama-quantize"):
+        if os.path.exists(os.path.join(llama_cpp_dir, candidate)):
+            return os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py"), os.path.join(llama_cpp_dir, candidate)
+    raise FileNotFoundError(f"Không tìm thấy llama-quantize trong {llama_cpp_dir}/build")
 
-    print("\n--- BƯỚC 3: Chuyển đổi sang GGUF (F16) ---")
-    if not os.path.exists(gguf_f16_path):
-        run_command(f"python llama.cpp/convert_hf_to_gguf.py {model_path} --outfile {gguf_f16_path} --outtype f16")
-    else:
-        print(f"File {gguf_f16_path} đã tồn tại.")
-
-    print("\n--- BƯỚC 4: Lượng tử hóa xuống Q4_K_M ---")
-    if not os.path.exists(gguf_q4_path):
-        quantize_cmd = "./llama.cpp/build/bin/llama-quantize"
-        if not os.path.exists(quantize_cmd):
-            quantize_cmd = "./llama.cpp/build/llama-quantize"
-            
-        run_command(f"{quantize_cmd} {gguf_f16_path} {gguf_q4_path} q4_k_m")
-    else:
-        print(f"File {gguf_q4_path} đã tồn tại.")
-
-    print("\n--- BƯỚC 5: Đẩy file GGUF lên Hugging Face ---")
-    api = HfApi()
-    
-    api.upload_file(
-        path_or_fileobj=gguf_q4_path,
-        path_in_repo=repo_filename,
-        repo_id=repo_id,
-        repo_type="model",
-        commit_message="Add Q4_K_M GGUF model for CPU inference"
+
+class GGUFPipeline:
+    def __init__(self, source, name, work_dir, quant_types, hub, convert_script, quantize_bin,
+                 upload_repo_id=None, max_parallel=2, threads=0, keep_f16=True):
+        self.source = source
+        self.name = name
+        self.work_dir = work_dir
+        self.quant_types = list(quant_types)
+        self.hub = hub
+        self.convert_script = convert_script
+        self.quantize_bin = quantize_bin
+        self.upload_repo_id = upload_repo_id
+        self.max_parallel = max(1, max_parallel)
+        self.threads = threads or os.cpu_count() or 1
+        self.keep_f16 = keep_f16
+        os.makedirs(work_dir, exist_ok=True)
+        self.manifest = Manifest(work_dir)
+        self.actions = {}  # bước -> built / skipped / uploaded / unchanged, cho log và để kiểm tra
+
+    def artifact_path(self, kind):
+        return os.path.join(self.work_dir, f"{self.name}-{kind}.gguf")
+
+    def snapshot(self):
+        """Trả về (thư mục model, khóa nội dung model)."""
+        if os.path.isdir(self.source):
+            files = sorted(name for name in os.listdir(self.source) if is_model_file(name))
+            key = content_key("model", {name: self.manifest.sha256(os.path.join(self.source, name)) for name in files})
+            self.manifest.save()
+            self.actions["snapshot"] = "local"
+            return self.source, key
+
+        remote = {name: digest for name, digest in self.hub.files(self.source).items() if is_model_file(name)}
+        if not remote:
+            raise FileNotFoundError(f"Không thấy file model nào trong {self.source}")
+        key = content_key("model", remote)
+        local_dir = os.path.join(self.work_dir, "snapshot")
+        entry = self.manifest.step("snapshot")
+        if entry and entry["key"] == key and all(os.path.exists(os.path.join(local_dir, name)) for name in remote):
+            print(f"Snapshot {self.source} không đổi, bỏ qua bước tải.")
+            self.actions["snapshot"] = "skipped"
+        else:
+            print(f"Đang tải {self.source} ({len(remote)} file)...")
+            self.hub.download(self.source, local_dir)
+            self.manifest.record("snapshot", key=key, source=self.source)
+            self.actions["snapshot"] = "built"
+        return local_dir, key
+
+    def convert(self, model_dir, model_key, force=False):
+        """Trả về sha256 của file F16 (dùng làm khóa cho bước quantize)."""
+        path = self.artifact_path("F16")
+        key = content_key("convert", model_key, self.manifest.sha256(self.convert_script))
+        entry = self.manifest.step("convert")
+        if not force and entry and entry["key"] == key:
+            if not os.path.exists(path) or self.manifest.sha256(path) == entry["sha256"]:
+                # F16 đã xóa sau lần build trước vẫn dùng được sha256 cũ để kiểm tra các bản quant
+                self.actions["convert"] = "skipped"
+                return entry["sha256"]
+        tmp_path = f"{path}.tmp"
+        run_command([sys.executable, self.convert_script, model_dir, "--outfile", tmp_path, "--outtype", "f16"])
+        os.replace(tmp_path, path)
+        digest = self.manifest.sha256(path)
+        self.manifest.record("convert", key=key, sha256=digest, path=path)
+        self.actions["convert"] = "built"
+        return digest
+
+    def _stale_quants(self, f16_sha, quantize_id):
+        keys = {quant: content_key("quantize", f16_sha, quant, quantize_id) for quant in self.quant_types}
+        stale = []
+        for quant in self.quant_types:
+            if self.manifest.is_fresh(f"quantize:{quant}", keys[quant], self.artifact_path(quant)):
+                self.actions[f"quantize:{quant}"] = "skipped"
+            else:
+                stale.append(quant)
+        return keys, stale
+
+    def _quantize_one(self, quant, key, threads):
+        path = self.artifact_path(quant)
+        tmp_path = f"{path}.tmp"
+        start = time.perf_counter()
+        run_command([self.quantize_bin, self.artifact_path("F16"), tmp_path, quant, str(threads)])
+        os.replace(tmp_path, path)
+        return quant, key, path, time.perf_counter() - start
+
+    def quantize(self, model_dir, model_key):
+        f16_sha = self.convert(model_dir, model_key)
+        quantize_id = self.manifest.sha256(self.quantize_bin)
+        keys, stale = self._stale_quants(f16_sha, quantize_id)
+        if not stale:
+            print("Mọi bản quant đều khớp manifest, bỏ qua bước lượng tử hóa.")
+            return
+        if not os.path.exists(self.artifact_path("F16")):
+            # Đã dọn F16 ở lần trước (keep_f16: False) mà giờ cần thêm / build lại một bản quant.
+            # Convert lại mà ra F16 khác (llama.cpp không tất định) thì mọi bản quant đều phải build lại
+            f16_sha = self.convert(model_dir, model_key, force=True)
+            keys, stale = self._stale_quants(f16_sha, quantize_id)
+
+        workers = min(self.max_parallel, len(stale))
+        # Chia đều số nhân CPU cho các tiến trình llama-quantize chạy song song
+        threads = max(1, self.threads // workers)
+        print(f"Lượng tử hóa {stale} ({workers} song song x {threads} thread)...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._quantize_one, quant, keys[quant], threads) for quant in stale]
+            for future in futures:
+                quant, key, path, seconds = future.result()
+                self.manifest.record(f"quantize:{quant}", key=key, sha256=self.manifest.sha256(path), path=path)
+                self.actions[f"quantize:{quant}"] = "built"
+                print(f"  {os.path.basename(path)}: {os.path.getsize(path) / 2**30:.2f} GB, {seconds:.1f}s")
+
+        if not self.keep_f16:
+            # Dọn file F16 trung gian (~16 GB); sha256 của nó vẫn nằm trong manifest
+            os.remove(self.artifact_path("F16"))
+            print("Đã dọn dẹp file tạm F16.")
+
+    def upload(self):
+        files = {}
+        for quant in self.quant_types:
+            path = self.artifact_path(quant)
+            expected = self.manifest.step(f"quantize:{quant}")["sha256"]
+            # Đọc lại toàn bộ file (không dùng cache): file hỏng / bị ghi đè thì dừng trước khi đẩy
+            actual = sha256_file(path)
+            if actual != expected:
+                raise RuntimeError(f"Checksum {os.path.basename(path)} không khớp manifest: {actual} != {expected}")
+            files[os.path.basename(path)] = (path, actual)
+
+        remote = self.hub.files(self.upload_repo_id)
+        for filename, (path, digest) in files.items():
+            if remote.get(filename) == digest:
+                print(f"{filename} trên Hub đã đúng nội dung, bỏ qua.")
+                self.actions[f"upload:{filename}"] = "unchanged"
+                continue
+            print(f"Đang đẩy {filename} lên {self.upload_repo_id}...")
+            self.hub.upload(path, filename, self.upload_repo_id, f"Add {filename} for CPU inference")
+            self.actions[f"upload:{filename}"] = "uploaded"
+
+        sums_path = os.path.join(self.work_dir, "SHA256SUMS")
+        with open(sums_path, "w") as f:
+            f.writelines(f"{digest}  {filename}\n" for filename, (_, digest) in sorted(files.items()))
+        remote_sums = remote.get("SHA256SUMS")
+        # Hub trả blob id (git sha1) cho file nhỏ, LocalHub trả sha256: so với cả hai
+        if remote_sums not in (sha256_file(sums_path), _git_blob_id(sums_path)):
+            self.hub.upload(sums_path, "SHA256SUMS", self.upload_repo_id, "Update GGUF checksums")
+
+    def run(self, upload=True):
+        model_dir, model_key = self.snapshot()
+        self.quantize(model_dir, model_key)
+        if upload:
+            self.upload()
+        return self.actions
+
+
+def _git_blob_id(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert model đã gộp sang GGUF, lượng tử hóa và đẩy lên Hub")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--quant", nargs="+", help="Ghi đè gguf.quant_types")
+    parser.add_argument("--no-upload", action="store_true")
+    parser.add_argument("--local-hub", help="Thư mục thay cho Hugging Face Hub (thử pipeline offline)")
+    parser.add_argument("--convert-script", help="Thay cho llama.cpp/convert_hf_to_gguf.py")
+    parser.add_argument("--quantize-bin", help="Thay cho llama.cpp/build/bin/llama-quantize")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    gguf_config = config.get("gguf", {})
+    # Repo trên Hub hoặc thư mục model đã gộp (merge.output_dir)
+    repo_id = gguf_config.get("source") or config.get("huggingface", {}).get("repo_name", "phgrouptechs/Denglish-8B-Instruct")
+
+    convert_script, quantize_bin = args.convert_script, args.quantize_bin
+    if not (convert_script and quantize_bin):
+        print("\n--- Cài đặt & Biên dịch llama.cpp bằng CMake ---")
+        default_convert, default_quantize = ensure_llama_cpp(gguf_config.get("llama_cpp_dir", "llama.cpp"))
+        convert_script = convert_script or default_convert
+        quantize_bin = quantize_bin or default_quantize
+
+    upload_repo_id = gguf_config.get("upload_repo_id") or config.get("huggingface", {}).get("repo_name", repo_id)
+    pipeline = GGUFPipeline(
+        source=repo_id,
+        # Tên file như trước: Denglish-8B-Instruct-Q4_K_M.gguf
+        name=gguf_config.get("name") or os.path.basename(upload_repo_id),
+        # ĐỂ GGUF Ở Ổ /tmp ĐỂ KHÔNG BỊ FULL Ổ MẠNG
+        work_dir=gguf_config.get("work_dir", "/tmp/denglish-gguf"),
+        quant_types=args.quant or gguf_config.get("quant_types", ["Q4_K_M"]),
+        hub=LocalHub(args.local_hub) if args.local_hub else HfHub(),
+        convert_script=convert_script,
+        quantize_bin=quantize_bin,
+        upload_repo_id=upload_repo_id,
+        max_parallel=gguf_config.get("max_parallel", 2),
+        threads=gguf_config.get("threads", 0),
+        keep_f16=gguf_config.get("keep_f16", True),
     )
-    
-    print("\n🎉 HOÀN TẤT! Đã đẩy file 4-bit lên Hugging Face.")
-    
-    # Dọn dẹp file 16GB trung gian để tránh nặng máy
-    if os.path.exists(gguf_f16_path):
-        os.remove(gguf_f16_path)
-        print("Đã dọn dẹp file tạm F16.")
+    start = time.perf_counter()
+    actions = pipeline.run(upload=not args.no_upload)
+    print(f"\n🎉 HOÀN TẤT sau {time.perf_counter() - start:.1f}s: {actions}")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
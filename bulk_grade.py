@@ -0,0 +1,319 @@
+"""Chấm bài hàng loạt (offline) từ file JSONL, dùng lại LLM / STT / OCR / TTS của worker (handler.py).
+
+Mỗi dòng là một job như của RunPod: {"id": ..., "input": {"text" | "image_base64" | "audio_base64", "lang", "adapter"}};
+`image_path` / `audio_path` (tương đối theo thư mục file JSONL) được đọc thay cho base64.
+- Job được đọc theo cửa sổ `window` dòng. STT / OCR của cửa sổ kế tiếp chạy trên thread pool trong lúc LLM
+  sinh câu trả lời cho cửa sổ hiện tại.
+- Trong mỗi cửa sổ, bài trùng nhau chỉ sinh một lần; các bài còn lại được xếp theo số token rồi cắt thành batch
+  `batch_size`, nên các dòng trong một batch dài gần bằng nhau và ít padding.
+- Kết quả được ghi dần ra JSONL theo đúng thứ tự job. Sau mỗi cửa sổ, file kết quả được fsync rồi checkpoint ghi
+  offset (byte) đã xử lý của file job. Chạy lại sau khi crash: file kết quả được cắt về kích thước lúc checkpoint
+  và đọc tiếp từ offset đó, nên không job nào bị mất hay bị ghi hai lần.
+
+    python bulk_grade.py homework.jsonl --output graded.jsonl
+"""
+import argparse
+import base64
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from media_io import b64encode
+from tutor_prompts import worker_messages
+
+
+def write_checkpoint(path, state):
+    # Ghi file tạm rồi đổi tên: crash giữa chừng vẫn còn checkpoint cũ nguyên vẹn
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BulkGrader:
+    def __init__(self, worker, input_path, output_path, checkpoint_path=None, batch_size=16, window=256,
+                 extract_workers=4, with_audio=False, log_every_seconds=30):
+        self.worker = worker  # module handler đã init_worker()
+        self.input_path = os.path.abspath(input_path)
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint.json"
+        self.batch_size = batch_size
+        self.window = window
+        self.with_audio = with_audio
+        self.log_every_seconds = log_every_seconds
+
+        self._base_dir = os.path.dirname(self.input_path)
+        self._extract_pool = ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="bulk-extract")
+        self._tts_pool = ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="bulk-tts")
+
+        self.state = {"input": self.input_path, "offset": 0, "lines": 0, "output_bytes": 0, "jobs": 0, "errors": 0}
+        self.jobs = 0  # số job của lần chạy này (không tính phần đã xong trước khi resume)
+        self.cache_hits = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.generated = 0  # số prompt đã đưa vào model.generate
+        self.generate_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, bulk_config, worker, input_path, output_path, checkpoint_path=None):
+        return cls(
+            worker,
+            input_path,
+            output_path,
+            checkpoint_path=checkpoint_path,
+            batch_size=bulk_config.get("batch_size", 16),
+            window=bulk_config.get("window", 256),
+            extract_workers=bulk_config.get("extract_workers", 4),
+            with_audio=bulk_config.get("with_audio", False),
+            log_every_seconds=bulk_config.get("log_every_seconds", 30),
+        )
+
+    def resume(self):
+        """Nạp checkpoint (nếu có) và cắt file kết quả về đúng phần đã được checkpoint."""
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            if state.get("input") != self.input_path:
+                raise ValueError(f"Checkpoint {self.checkpoint_path} thuộc về {state.get('input')}, "
+                                 f"không phải {self.input_path} (dùng --restart để chạy lại từ đầu)")
+            self.state = state
+            print(f"[bulk] Tiếp tục từ dòng {state['lines']} (byte {state['offset']}), đã chấm {state['jobs']} job")
+        # Phần ghi sau checkpoint cuối (cửa sổ đang dở lúc crash) bị bỏ, cửa sổ đó được chấm lại
+        with open(self.output_path, "ab") as f:
+            f.truncate(self.state["output_bytes"])
+
+    def restart(self):
+        for path in (self.checkpoint_path, self.output_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ==========================================
+    # ĐỌC JOB + TRÍCH XUẤT VĂN BẢN (STT / OCR)
+    # ==========================================
+    def _read_window(self, f, lines):
+        """Đọc tối đa `window` job tiếp theo của `f` (đã đọc `lines` dòng).
+
+        Trả về ([(số dòng, job hoặc lỗi)], offset, số dòng) tính tới hết cửa sổ; danh sách rỗng là hết file.
+        """
+        entries = []
+        while len(entries) < self.window:
+            line = f.readline()
+            if not line:
+                break
+            lines += 1
+            if not line.strip():
+                continue
+            try:
+                entries.append((lines, json.loads(line)))
+            except ValueError as e:
+                entries.append((lines, {"error": f"Dòng JSON không hợp lệ: {e}"}))
+        return entries, f.tell(), lines
+
+    def _job_input(self, job_input):
+        job_input = dict(job_input)
+        for field in ("image", "audio"):
+            path = job_input.pop(f"{field}_path", None)
+            if path and not job_input.get(f"{field}_base64"):
+                with open(os.path.join(self._base_dir, path), "rb") as f:
+                    job_input[f"{field}_base64"] = base64.b64encode(f.read()).decode("utf-8")
+        return job_input
+
+    def _extract(self, line, job):
+        """Chạy trên thread pool: STT / OCR, chọn adapter và đếm token prompt của một job."""
+        if not isinstance(job, dict):
+            return {"line": line, "id": None, "error": f"Job phải là JSON object, nhận {type(job).__name__}"}
+        entry = {"line": line, "id": job.get("id"), "error": job.get("error")}
+        if entry["error"]:
+            return entry
+        try:
+            job_input = self._job_input(job.get("input", {}))
+            input_type, text, error, lang = self.worker.extract_user_text(job_input)
+            entry.update(input_type=input_type, text=text, lang=lang, error=error)
+            if not error:
+                entry["adapter"] = self.worker.resolve_adapter(job_input, lang)
+                entry["tokens"] = self.worker.llm.count_tokens(text)
+        except Exception as e:
+            entry["error"] = f"Lỗi trong quá trình xử lý: {str(e)}"
+        return entry
+
+    def _submit_window(self, entries):
+        return [self._extract_pool.submit(self._extract, line, job) for line, job in entries]
+
+    # ==========================================
+    # SINH CÂU TRẢ LỜI THEO BATCH (XẾP THEO ĐỘ DÀI PROMPT)
+    # ==========================================
+    def _response(self, entry, ai_text=None, ai_audio=None, cache_hit=None):
+        if entry["error"]:
+            return {"id": entry["id"], "line": entry["line"], "error": entry["error"]}
+        response = {
+            "id": entry["id"],
+            "line": entry["line"],
+            "status": "success",
+            "input_type": entry["input_type"],
+            "lang": entry["lang"],
+            "adapter": entry["adapter"],
+            "recognized_text": entry["text"],
+            "ai_text": ai_text,
+            "cache": cache_hit,
+        }
+        if self.with_audio:
+            response["ai_audio_base64"] = b64encode(ai_audio or b"")
+        return response
+
+    def _grade_window(self, entries):
+        worker = self.worker
+        results = [None] * len(entries)
+        groups = {}  # bài trùng nhau trong cửa sổ -> vị trí các job
+        for i, entry in enumerate(entries):
+            if entry["error"]:
+                results[i] = self._response(entry)
+                continue
+            cached, cache_hit = worker.lookup_response(entry["input_type"], entry["text"], entry["lang"], entry["adapter"])
+            if cached is not None:
+                self.cache_hits += 1
+                results[i] = self._response(entry, cached[0], cached[1], cache_hit)
+                continue
+            key = (entry["input_type"], entry["text"], entry["lang"], entry["adapter"])
+            groups.setdefault(key, []).append(i)
+        self.deduplicated += sum(len(indices) - 1 for indices in groups.values())
+
+        # Bài ngắn đi với bài ngắn: batch có padding trái nên độ dài mỗi batch bằng prompt dài nhất của nó
+        keys = sorted(groups, key=lambda key: entries[groups[key][0]]["tokens"])
+        answers = {}
+        audio_futures = {}
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            items = [(worker_messages(input_type, text, lang), adapter) for input_type, text, lang, adapter in batch]
+            generate_start = time.perf_counter()
+            try:
+                ai_texts = worker.generate_batch(items)
+            except Exception as e:
+                for key in batch:
+                    for i in groups[key]:
+                        entries[i]["error"] = f"Lỗi trong quá trình xử lý: {str(e)}"
+                        results[i] = self._response(entries[i])
+                continue
+            finally:
+                self.generate_seconds += time.perf_counter() - generate_start
+                self.batches += 1
+                self.generated += len(batch)
+            for key, ai_text in zip(batch, ai_texts):
+                answers[key] = ai_text.strip()
+                if self.with_audio:
+                    # TTS của batch này chạy trong lúc LLM sinh batch sau
+                    audio_futures[key] = self._tts_pool.submit(
+                        worker.tts_service.synthesize, answers[key], worker.voice_for_lang(key[2]))
+
+        for key, ai_text in answers.items():
+            try:
+                ai_audio = audio_futures[key].result() if key in audio_futures else b""
+            except Exception as e:
+                # TTS lỗi chỉ làm hỏng các job của bài này, không dừng cả lượt chấm
+                for i in groups[key]:
+                    entries[i]["error"] = f"Lỗi TTS: {str(e)}"
+                    results[i] = self._response(entries[i])
+                continue
+            worker.store_response(key[0], key[1], key[2], ai_text, ai_audio, key[3])
+            for i in groups[key]:
+                results[i] = self._response(entries[i], ai_text, ai_audio)
+        return results
+
+    # ==========================================
+    # VÒNG LẶP CHÍNH + CHECKPOINT
+    # ==========================================
+    def _write_results(self, out, results, offset, lines):
+        for result in results:
+            out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+        out.flush()
+        os.fsync(out.fileno())
+        self.jobs += len(results)
+        self.state.update(
+            offset=offset,
+            lines=lines,
+            output_bytes=out.tell(),
+            jobs=self.state["jobs"] + len(results),
+            errors=self.state["errors"] + sum("error" in result for result in results),
+        )
+        write_checkpoint(self.checkpoint_path, self.state)
+
+    def _log_progress(self, start, total_bytes):
+        seconds = time.perf_counter() - start
+        progress = self.state["offset"] / total_bytes * 100 if total_bytes else 100.0
+        print(f"[bulk] {self.state['jobs']} job ({progress:.1f}% file), "
+              f"{self.jobs / seconds if seconds else 0.0:.2f} job/s, lỗi: {self.state['errors']}")
+
+    def run(self):
+        total_bytes = os.path.getsize(self.input_path)
+        start = last_log = time.perf_counter()
+        with open(self.input_path, "rb") as f, open(self.output_path, "ab") as out:
+            f.seek(self.state["offset"])
+            entries, offset, lines = self._read_window(f, self.state["lines"])
+            pending = (self._submit_window(entries), offset, lines)
+            while pending[0]:
+                # Đọc và trích xuất cửa sổ kế tiếp trong lúc LLM chấm cửa sổ hiện tại
+                entries, offset, lines = self._read_window(f, lines)
+                upcoming = (self._submit_window(entries), offset, lines)
+
+                futures, window_offset, window_lines = pending
+                results = self._grade_window([future.result() for future in futures])
+                self._write_results(out, results, window_offset, window_lines)
+                pending = upcoming
+
+                if time.perf_counter() - last_log >= self.log_every_seconds:
+                    self._log_progress(start, total_bytes)
+                    last_log = time.perf_counter()
+
+        seconds = time.perf_counter() - start
+        summary = self.stats(seconds)
+        print(f"[bulk] Xong: {summary}")
+        return summary
+
+    def stats(self, seconds):
+        return {
+            "jobs": self.jobs,
+            "total_jobs": self.state["jobs"],
+            "errors": self.state["errors"],
+            "cache_hits": self.cache_hits,
+            "deduplicated": self.deduplicated,
+            "batches": self.batches,
+            "avg_batch_size": round(self.generated / self.batches, 1) if self.batches else None,
+            "generate_seconds": round(self.generate_seconds, 1),
+            "seconds": round(seconds, 1),
+            "jobs_per_second": round(self.jobs / seconds, 2) if seconds else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chấm bài hàng loạt từ file JSONL (mỗi dòng một job của worker)")
+    parser.add_argument("input", help="File JSONL các job")
+    parser.add_argument("--output", required=True, help="File JSONL kết quả (ghi nối tiếp)")
+    parser.add_argument("--config", default=os.environ.get("DENGLISH_CONFIG", "config.yaml"))
+    parser.add_argument("--checkpoint", help="Mặc định: <output>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Bỏ checkpoint và file kết quả cũ, chấm lại từ đầu")
+    parser.add_argument("--batch-size", type=int, help="Ghi đè bulk_grade.batch_size")
+    parser.add_argument("--with-audio", action="store_true", default=None, help="Ghi kèm audio (TTS) của câu trả lời")
+    args = parser.parse_args()
+
+    # handler.py đọc config lúc import
+    os.environ["DENGLISH_CONFIG"] = args.config
+    import handler
+
+    bulk_config = dict(handler.CONFIG.get("bulk_grade", {}))
+    if args.batch_size:
+        bulk_config["batch_size"] = args.batch_size
+    if args.with_audio is not None:
+        bulk_config["with_audio"] = args.with_audio
+
+    grader = BulkGrader.from_config(bulk_config, handler, args.input, args.output, args.checkpoint)
+    if args.restart:
+        grader.restart()
+    grader.resume()
+    handler.init_worker()
+    grader.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,101 @@ import pandas as pd
 from datasets import load_dataset, concatenate_datasets, Dataset
 import json
 import os
+import yaml
+
+OASST_ROLES = {"prompter": "User", "assistant": "Assistant"}
+
+
+def _best_reply_mask(oasst_df):
+    """Mask (theo index của oasst_df) đánh dấu câu trả lời assistant có rank nhỏ nhất dưới mỗi tin nhắn cha."""
+    replies = oasst_df[oasst_df["role"] == "assistant"]
+    best = replies.sort_values("rank", na_position="last", kind="stable").drop_duplicates("parent_id")
+    return oasst_df.index.isin(best.index)
+
+
+def flatten_oasst_pairs(oasst_df, langs=("en", "de"), top_ranked_only=False):
+    """Mỗi cặp (prompter, assistant trả lời trực tiếp) -> một mẫu instruction/output.
+
+    Join theo parent_id thay cho việc quét toàn bộ bảng cho từng prompter (O(n^2)).
+    Thứ tự mẫu giống vòng lặp cũ: theo thứ tự prompter, rồi theo thứ tự câu trả lời.
+    """
+    prompters = oasst_df.loc[
+        (oasst_df["role"] == "prompter") & oasst_df["lang"].isin(langs), ["message_id", "text"]
+    ]
+    replies = oasst_df.loc[oasst_df["role"] == "assistant", ["message_id", "parent_id", "text"]]
+    if top_ranked_only:
+        replies = replies[_best_reply_mask(oasst_df)[(oasst_df["role"] == "assistant").to_numpy()]]
+
+    pairs = prompters.merge(
+        replies, left_on="message_id", right_on="parent_id", how="inner", suffixes=("_prompt", "_reply")
+    )
+    return [
+        {"instruction": instruction, "input": "", "output": output}
+        for instruction, output in zip(pairs["text_prompt"].tolist(), pairs["text_reply"].tolist())
+    ]
+
+
+def flatten_oasst_threads(oasst_df, langs=("en", "de"), top_ranked_only=False):
+    """Dựng lại toàn bộ hội thoại nhiều lượt: mỗi câu trả lời assistant -> một mẫu.
+
+    instruction là câu hỏi cuối của người dùng, các lượt trước đó (từ gốc cây) được đưa vào `input`.
+    Cây được duyệt một lần từ gốc qua chỉ mục parent -> children, lịch sử được mang theo khi đi xuống.
+    Với top_ranked_only, chỉ đi theo câu trả lời xếp hạng cao nhất ở mỗi nhánh.
+    """
+    keep = _best_reply_mask(oasst_df) | (oasst_df["role"] != "assistant").to_numpy() if top_ranked_only else None
+
+    children = {}
+    roots = []
+    messages = oasst_df if keep is None else oasst_df[keep]
+    columns = zip(
+        messages["message_id"].tolist(), messages["parent_id"].tolist(),
+        messages["role"].tolist(), messages["lang"].tolist(), messages["text"].tolist(),
+    )
+    for message_id, parent_id, role, lang, text in columns:
+        node = (message_id, role, lang, text)
+        if parent_id is None or parent_id != parent_id: # None hoặc NaN: gốc của cây
+            roots.append(node)
+        else:
+            children.setdefault(parent_id, []).append(node)
+
+    samples = []
+    # Mỗi phần tử: (node, lịch sử các lượt trước dưới dạng tuple (role, text), tin nhắn prompter vừa rồi)
+    stack = [(root, (), None) for root in reversed(roots)]
+    while stack:
+        (message_id, role, lang, text), history, prompt = stack.pop()
+        if role == "assistant" and prompt is not None and prompt[2] in langs:
+            samples.append({
+                "instruction": prompt[3],
+                "input": "\n".join(f"{OASST_ROLES[r]}: {t}" for r, t in history),
+                "output": text,
+            })
+        if role == "prompter":
+            next_history, next_prompt = history, (message_id, role, lang, text)
+        else:
+            next_history = history + (("prompter", prompt[3]),) if prompt is not None else history
+            next_history += (("assistant", text),)
+            next_prompt = None
+        for child in reversed(children.get(message_id, ())):
+            stack.append((child, next_history, next_prompt))
+    return samples
+
+
+def flatten_oasst(oasst_df, mode="pairs", langs=("en", "de"), top_ranked_only=False):
+    if mode == "threads":
+        return flatten_oasst_threads(oasst_df, langs, top_ranked_only)
+    return flatten_oasst_pairs(oasst_df, langs, top_ranked_only)
+
+
+def load_data_config(config_path="config.yaml"):
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r") as f:
+        return (yaml.safe_load(f) or {}).get("data", {})
+
 
 def prepare_datasets():
+    oasst_config = load_data_config().get("oasst", {})
+
     print("--- Loading Datasets ---")
     
     # 1. Alpaca Cleaned (English)
@@ -26,23 +119,14 @@ def prepare_datasets():
     try:
         oasst = load_dataset("OpenAssistant/oasst2", split="train")
         # OASST2 has a tree structure, we need to flatten it to instruction-output pairs
-        # For simplicity, we filter for English and German conversations
+        # (or full multi-turn threads). For simplicity, we keep English and German conversations
         oasst_df = oasst.to_pandas()
-        oasst_filtered = oasst_df[oasst_df["lang"].isin(["en", "de"])]
-        
-        # Helper to convert OASST to Alpaca format
-        oasst_data = []
-        for _, row in oasst_filtered.iterrows():
-            if row["role"] == "prompter":
-                # Find the next message which should be the assistant's response
-                responses = oasst_df[oasst_df["parent_id"] == row["message_id"]]
-                for _, resp in responses.iterrows():
-                    if resp["role"] == "assistant":
-                        oasst_data.append({
-                            "instruction": row["text"],
-                            "input": "",
-                            "output": resp["text"]
-                        })
+        oasst_data = flatten_oasst(
+            oasst_df,
+            mode=oasst_config.get("mode", "pairs"),
+            langs=tuple(oasst_config.get("langs", ["en", "de"])),
+            top_ranked_only=oasst_config.get("top_ranked_only", False),
+        )
         oasst_ds = Dataset.from_list(oasst_data)
         print(f"Loaded OASST2 (En/De): {len(oasst_ds)} samples")
     except Exception as e:
@@ -81,5 +165,37 @@ def prepare_datasets():
     combined_dataset.save_to_disk(output_path)
     print(f"Dataset prepared and saved to {output_path} with {len(combined_dataset)} samples.")
 
+def prepare_datasets_streaming(force=False):
+    """Build kiểu streaming (dataset_build.py): shard Arrow + manifest, chỉ xử lý lại nguồn đã thay đổi."""
+    from dataset_build import DEFAULT_SOURCES, build_streaming_dataset
+
+    data_config = load_data_config()
+    build_config = data_config.get("build", {})
+    manifest = build_streaming_dataset(
+        build_config.get("output_dir", "./processed_dataset_shards"),
+        sources=build_config.get("sources", DEFAULT_SOURCES),
+        num_proc=build_config.get("num_proc") or None,
+        chunk_size=build_config.get("chunk_size", 1000),
+        max_shard_mb=build_config.get("max_shard_mb", 256),
+        dedup_config=build_config.get("dedup", {}),
+        oasst_config=data_config.get("oasst", {}),
+        force=force,
+    )
+    print(f"Dataset prepared: {manifest['total_rows']} samples in "
+          f"{sum(len(entry['shards']) for entry in manifest['sources'].values())} shards.")
+
+
 if __name__ == "__main__":
-    prepare_datasets()
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="Build streaming (shard + manifest); mặc định theo data.build.streaming")
+    parser.add_argument("--force", action="store_true", help="Bỏ qua cache, xử lý lại mọi nguồn")
+    args = parser.parse_args()
+
+    streaming = args.streaming if args.streaming is not None else load_data_config().get("build", {}).get("streaming", False)
+    if streaming:
+        prepare_datasets_streaming(force=args.force)
+    else:
+        prepare_datasets()
@@ -0,0 +1,371 @@
+"""Build dataset kiểu streaming: đọc từng nguồn theo lô, chuẩn hóa song song, khử trùng lặp, ghi shard Arrow.
+
+Mỗi nguồn có fingerprint riêng (tên dataset + revision, hoặc sha256 của file JSON). Kết quả chuẩn hóa
+của từng nguồn được giữ trong `<output_dir>/sources/<tên>/`, nên khi chỉ vn_mix_data.json thay đổi thì
+chỉ nguồn đó được đọc và chuẩn hóa lại; các nguồn khác chỉ nạp lại chữ ký MinHash đã lưu.
+Khử trùng lặp đi theo thứ tự nguồn: một mẫu bị bỏ nếu trùng (chính xác hoặc gần đúng) với mẫu đã giữ
+ở nguồn đứng trước hoặc ở phía trước trong cùng nguồn.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import unicodedata
+from itertools import islice
+
+import numpy as np
+import pyarrow as pa
+
+from near_dup import LSHIndex, MinHasher
+
+# Đổi cách chuẩn hóa / tính chữ ký thì tăng số này để mọi nguồn được xử lý lại
+NORMALIZE_VERSION = 1
+FIELDS = ("instruction", "input", "output")
+OUTPUT_SCHEMA = pa.schema([(field, pa.string()) for field in FIELDS] + [("source", pa.string())])
+
+DEFAULT_SOURCES = [
+    {"name": "alpaca", "type": "hub", "path": "yahma/alpaca-cleaned", "split": "train"},
+    {"name": "german", "type": "hub", "path": "philschmid/translated_tasks_de_google_52k", "split": "train"},
+    {"name": "oasst", "type": "oasst", "path": "OpenAssistant/oasst2", "split": "train"},
+    {"name": "vn_mix", "type": "json", "path": "vn_mix_data.json"},
+]
+
+_hasher = None
+
+
+def normalize_field(value):
+    # NFC, bỏ khoảng trắng cuối mỗi dòng; giữ nguyên xuống dòng và thụt lề (code, danh sách)
+    if value is None:
+        return ""
+    text = unicodedata.normalize("NFC", str(value))
+    return re.sub(r"[ \t]+\n", "\n", text).strip()
+
+
+def exact_key(row):
+    joined = "\x1f".join(re.sub(r"\s+", " ", row[field]) for field in FIELDS)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+def _normalize_chunk(records, num_perm, ngram):
+    """Chạy trong tiến trình con: chuẩn hóa một lô bản ghi, trả về (rows, exact_keys, signatures)."""
+    global _hasher
+    if _hasher is None or (_hasher.num_perm, _hasher.ngram) != (num_perm, ngram):
+        _hasher = MinHasher(num_perm=num_perm, ngram=ngram)
+
+    rows, keys, signatures = [], [], []
+    for record in records:
+        row = {field: normalize_field(record.get(field)) for field in FIELDS}
+        if not row["instruction"] or not row["output"]:
+            continue
+        rows.append(row)
+        keys.append(exact_key(row))
+        signatures.append(_hasher.signature("\n".join(row[field] for field in FIELDS)))
+    return rows, keys, signatures
+
+
+class ShardWriter:
+    """Ghi các RecordBatch ra file Arrow (IPC stream), sang file mới khi vượt `max_bytes`."""
+
+    def __init__(self, directory, prefix, schema, max_bytes):
+        self.directory = directory
+        self.prefix = prefix
+        self.schema = schema
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._writer = None
+        self._sink = None
+        self._rows = 0
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        path = os.path.join(self.directory, f"{self.prefix}-{len(self.shards):05d}.arrow")
+        self._sink = pa.OSFile(path, "wb")
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+        self.shards.append({"path": path, "rows": 0, "bytes": 0})
+
+    def write(self, batch):
+        if not batch.num_rows:
+            return
+        if self._writer is None or (self._bytes and self._bytes + batch.nbytes > self.max_bytes):
+            self._close_current()
+            self._open()
+        self._writer.write_batch(batch)
+        self._rows += batch.num_rows
+        self._bytes += batch.nbytes
+
+    def _close_current(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        shard = self.shards[-1]
+        shard["rows"] = self._rows
+        shard["bytes"] = os.path.getsize(shard["path"])
+        self._writer = self._sink = None
+        self._rows = self._bytes = 0
+
+    def close(self):
+        self._close_current()
+        return self.shards
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_fingerprint(source, dedup_config):
+    if source["type"] == "json":
+        content = _file_sha256(source["path"]) if os.path.exists(source["path"]) else "missing"
+    else:
+        content = f"{source['path']}@{source.get('revision', 'main')}:{source.get('split', 'train')}"
+    extra = {k: v for k, v in source.items() if k not in ("name", "path", "revision", "split")}
+    payload = json.dumps(
+        {"content": content, "options": extra, "version": NORMALIZE_VERSION,
+         "num_perm": dedup_config.get("num_perm", 128), "ngram": dedup_config.get("ngram", 5)},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def iter_source(source, oasst_config):
+    """Đọc lười từng bản ghi của một nguồn."""
+    if source["type"] == "json":
+        if not os.path.exists(source["path"]):
+            print(f"Warning: {source['path']} not found. Skipping {source['name']}.")
+            return iter(())
+        with open(source["path"], "r", encoding="utf-8") as f:
+            return iter(json.load(f))
+
+    from datasets import load_dataset
+
+    if source["type"] == "oasst":
+        # Cây hội thoại cần toàn bộ bảng để nối cha - con nên OASST2 không đọc streaming được
+        from data_preparation import flatten_oasst
+
+        oasst_df = load_dataset(source["path"], split=source.get("split", "train"),
+                                revision=source.get("revision")).to_pandas()
+        return iter(flatten_oasst(
+            oasst_df,
+            mode=oasst_config.get("mode", "pairs"),
+            langs=tuple(oasst_config.get("langs", ["en", "de"])),
+            top_ranked_only=oasst_config.get("top_ranked_only", False),
+        ))
+
+    return iter(load_dataset(source["path"], split=source.get("split", "train"),
+                             revision=source.get("revision"), streaming=True))
+
+
+def _chunks(iterator, size):
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _rows_to_batch(rows, source_name):
+    columns = {field: [row[field] for row in rows] for field in FIELDS}
+    columns["source"] = [source_name] * len(rows)
+    return pa.RecordBatch.from_pydict(columns, schema=OUTPUT_SCHEMA)
+
+
+def normalize_source(source, cache_dir, pool, num_proc, chunk_size, dedup_config, max_bytes, oasst_config):
+    """Chuẩn hóa một nguồn và lưu (rows, exact_key, minhash) vào cache_dir. Trả về số bản ghi đọc/giữ."""
+    num_perm = dedup_config.get("num_perm", 128)
+    ngram = dedup_config.get("ngram", 5)
+    schema = OUTPUT_SCHEMA.append(pa.field("exact_key", pa.string())).append(
+        pa.field("minhash", pa.list_(pa.uint64(), num_perm))
+    )
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    writer = ShardWriter(cache_dir, "normalized", schema, max_bytes)
+
+    records_in = 0
+    chunks = _chunks(iter_source(source, oasst_config), chunk_size)
+    # Mỗi lượt chỉ đọc num_proc * 2 lô: bộ nhớ không phụ thuộc kích thước nguồn
+    while True:
+        window = list(islice(chunks, num_proc * 2))
+        if not window:
+            break
+        records_in += sum(len(chunk) for chunk in window)
+        args = [(chunk, num_perm, ngram) for chunk in window]
+        results = pool.starmap(_normalize_chunk, args) if pool is not None else [_normalize_chunk(*a) for a in args]
+        for rows, keys, signatures in results:
+            if not rows:
+                continue
+            batch = _rows_to_batch(rows, source["name"])
+            minhash = pa.FixedSizeListArray.from_arrays(pa.array(np.concatenate(signatures), pa.uint64()), num_perm)
+            writer.write(pa.RecordBatch.from_arrays(
+                batch.columns + [pa.array(keys, pa.string()), minhash], schema=schema
+            ))
+    shards = writer.close()
+    return records_in, sum(shard["rows"] for shard in shards)
+
+
+def _read_batches(directory):
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".arrow"):
+            with pa.memory_map(os.path.join(directory, name)) as source:
+                yield from pa.ipc.open_stream(source)
+
+
+class Deduplicator:
+    def __init__(self, num_perm=128, bands=16, threshold=0.85, near=True):
+        self.threshold = threshold
+        self.near = near
+        self.exact = set()
+        self.index = LSHIndex(num_perm, bands) if near else None
+        self._next_id = 0
+
+    def keep(self, key, signature):
+        """Trả về None nếu giữ mẫu, "exact" / "near" nếu là bản trùng. Mẫu được giữ thì thêm vào chỉ mục."""
+        if key in self.exact:
+            return "exact"
+        if self.near and self.index.query(signature, self.threshold):
+            return "near"
+        self.exact.add(key)
+        if self.near:
+            self.index.add(self._next_id, signature)
+            self._next_id += 1
+        return None
+
+
+def dedup_source(name, cache_dir, dedup, output_dir, max_bytes, write):
+    """Khử trùng lặp một nguồn (đã chuẩn hóa) theo chỉ mục chung; ghi shard đầu ra nếu `write`."""
+    writer = ShardWriter(output_dir, name, OUTPUT_SCHEMA, max_bytes) if write else None
+    stats = {"exact_dups": 0, "near_dups": 0, "kept": 0}
+    for batch in _read_batches(cache_dir):
+        keys = batch.column("exact_key").to_pylist()
+        num_perm = batch.schema.field("minhash").type.list_size
+        signatures = batch.column("minhash").flatten().to_numpy().reshape(-1, num_perm)
+        kept = []
+        for i, (key, signature) in enumerate(zip(keys, signatures)):
+            verdict = dedup.keep(key, signature)
+            if verdict is None:
+                kept.append(i)
+                stats["kept"] += 1
+            else:
+                stats[f"{verdict}_dups"] += 1
+        if writer is not None and kept:
+            writer.write(batch.select(list(OUTPUT_SCHEMA.names)).take(pa.array(kept)))
+    stats["shards"] = writer.close() if writer is not None else None
+    return stats
+
+
+def build_streaming_dataset(output_dir, sources=None, num_proc=None, chunk_size=1000, max_shard_mb=256,
+                            dedup_config=None, oasst_config=None, force=False):
+    """Build (hoặc cập nhật) dataset dạng shard; trả về manifest."""
+    sources = sources or DEFAULT_SOURCES
+    dedup_config = dedup_config or {}
+    oasst_config = oasst_config or {}
+    num_proc = num_proc or os.cpu_count()
+    max_bytes = int(max_shard_mb * 1024 * 1024)
+
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    previous = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, "r") as f:
+            previous = json.load(f).get("sources", {})
+
+    dedup = Deduplicator(
+        num_perm=dedup_config.get("num_perm", 128),
+        bands=dedup_config.get("bands", 16),
+        threshold=dedup_config.get("threshold", 0.85),
+        near=dedup_config.get("near", True),
+    )
+    dedup_settings = json.dumps({k: dedup_config.get(k) for k in ("num_perm", "bands", "threshold", "near", "ngram")},
+                                sort_keys=True)
+
+    pool = multiprocessing.get_context("spawn").Pool(num_proc) if num_proc > 1 else None
+    manifest_sources = {}
+    upstream = hashlib.sha256(dedup_settings.encode("utf-8")).hexdigest()[:16]
+    try:
+        for source in sources:
+            name = source["name"]
+            start = time.perf_counter()
+            cache_dir = os.path.join(output_dir, "sources", name)
+            fingerprint = source_fingerprint(source, dedup_config)
+            old = previous.get(name, {})
+
+            if old.get("fingerprint") == fingerprint and os.path.isdir(cache_dir):
+                records_in, normalized = old["records_in"], old["normalized"]
+                reprocessed = False
+            else:
+                print(f"[build] {name}: đọc và chuẩn hóa ({num_proc} tiến trình)...")
+                records_in, normalized = normalize_source(
+                    source, cache_dir, pool, num_proc, chunk_size, dedup_config, max_bytes, oasst_config
+                )
+                reprocessed = True
+
+            # Kết quả khử trùng lặp của nguồn phụ thuộc chính nó và mọi nguồn đứng trước
+            upstream = hashlib.sha256(f"{upstream}:{fingerprint}".encode("utf-8")).hexdigest()[:16]
+            old_paths = [os.path.join(output_dir, shard["path"]) for shard in old.get("shards", [])]
+            rewrite = reprocessed or old.get("dedup_key") != upstream or not all(map(os.path.exists, old_paths))
+            if rewrite:
+                for path in old_paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+            # Nguồn không đổi vẫn phải đi qua chỉ mục để các nguồn sau được so với nó
+            stats = dedup_source(name, cache_dir, dedup, os.path.join(output_dir, "shards"), max_bytes, rewrite)
+            shards = stats.pop("shards")
+            if rewrite:
+                # Đường dẫn trong manifest tính từ output_dir: chuyển cả thư mục đi nơi khác vẫn dùng được
+                shards = [{**shard, "path": os.path.relpath(shard["path"], output_dir)} for shard in shards]
+            else:
+                shards = old["shards"]
+
+            manifest_sources[name] = {
+                "fingerprint": fingerprint,
+                "dedup_key": upstream,
+                "records_in": records_in,
+                "normalized": normalized,
+                **stats,
+                "shards": shards,
+                "reprocessed": reprocessed,
+                "seconds": round(time.perf_counter() - start, 2),
+            }
+            print(f"[build] {name}: {manifest_sources[name]['kept']}/{records_in} mẫu giữ lại, "
+                  f"{stats['exact_dups']} trùng chính xác, {stats['near_dups']} gần trùng, "
+                  f"{'xử lý lại' if reprocessed else 'dùng cache'} ({manifest_sources[name]['seconds']}s)")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    manifest = {
+        "schema": OUTPUT_SCHEMA.names,
+        "dedup": json.loads(dedup_settings),
+        "total_rows": sum(entry["kept"] for entry in manifest_sources.values()),
+        "sources": manifest_sources,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def load_built_dataset(dataset_path, seed=42):
+    """Nạp dataset cho train.py: thư mục có manifest.json (build streaming) hoặc thư mục save_to_disk."""
+    from datasets import Dataset, concatenate_datasets, load_from_disk
+
+    manifest_path = os.path.join(dataset_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return load_from_disk(dataset_path)
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    shards = [
+        os.path.join(dataset_path, shard["path"])
+        for entry in manifest["sources"].values() for shard in entry["shards"]
+    ]
+    # Các shard được memory-map; shuffle chỉ tạo bảng chỉ số, không chép dữ liệu
+    return concatenate_datasets([Dataset.from_file(path) for path in shards]).shuffle(seed=seed)
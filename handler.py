@@ -1,170 +1,711 @@
 import os
 import runpod
 import torch
-import base64
-import tempfile
 import asyncio
-import io
-import whisper
-import edge_tts
-import pytesseract
-import threading # <--- ĐÃ BỔ SUNG THƯ VIỆN THREADING Ở ĐÂY
-from PIL import Image
+import time
+import threading
+import yaml
+from contextlib import contextmanager
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+from batching import BatchScheduler
+from streaming import stream_text_and_audio
+from tts_service import TTSService, build_synthesizer
+from tts_cache import CachedSynthesizer, TTSCache
+from media_io import b64decode, b64encode, decode_audio
+from prefix_cache import PrefixCache, adapter_version
+from tutor_prompts import worker_messages
+from llm_backend import LlamaCppBackend, TransformersBackend
+from response_cache import ResponseCache
+from metrics import JobTimings, MetricsRegistry
+from speculative import SpeculativeDecoding
+from adapter_registry import AdapterRegistry
+from residency import MB, LazyResident, ResidencyManager, TorchResident
+
+# Cấu hình worker (mục `worker` trong config.yaml), thiếu file thì dùng mặc định
+CONFIG_PATH = os.environ.get("DENGLISH_CONFIG", "config.yaml")
+if os.path.exists(CONFIG_PATH):
+    with open(CONFIG_PATH, "r") as f:
+        CONFIG = yaml.safe_load(f) or {}
+else:
+    CONFIG = {}
+
+WORKER_CONFIG = CONFIG.get("worker", {})
+TTS_CACHE_CONFIG = CONFIG.get("tts_cache", {})
+PREFIX_CACHE_CONFIG = CONFIG.get("prefix_cache", {})
+LLM_CONFIG = CONFIG.get("llm", {})
+RESPONSE_CACHE_CONFIG = CONFIG.get("response_cache", {})
+METRICS_CONFIG = CONFIG.get("metrics", {})
+SPECULATIVE_CONFIG = CONFIG.get("speculative", {})
+ADAPTERS_CONFIG = CONFIG.get("adapters", {})
+
+BATCHING_CONFIG = WORKER_CONFIG.get("batching", {})
+STREAMING_CONFIG = WORKER_CONFIG.get("streaming", {})
+TTS_CONFIG = WORKER_CONFIG.get("tts", {})
+STARTUP_CONFIG = WORKER_CONFIG.get("startup", {})
+RESIDENCY_CONFIG = WORKER_CONFIG.get("residency", {})
+
+BASE_MODEL_PATH = WORKER_CONFIG.get("base_model_path", "/runpod-volume/llama3-base")
+LORA_MODEL_PATH = WORKER_CONFIG.get("lora_model_path", "/runpod-volume/denglish-model")
+# Thư mục model đã gộp sẵn LoRA (merge_and_push.py): nạp thẳng safetensors, không cần PeftModel
+MERGED_MODEL_PATH = WORKER_CONFIG.get("merged_model_path")
+
+# Ngôn ngữ gia sư hỗ trợ: audio không kèm `lang` được định tuyến theo ngôn ngữ Whisper nhận diện
+SUPPORTED_LANGS = ("en", "de")
+
+# Các thành phần được khởi tạo trong init_worker() (LLM, TTS) hoặc ở lần dùng đầu tiên (Whisper, Tesseract)
+llm = None # LLMBackend: transformers hoặc llama.cpp (GGUF), chọn bằng llm.backend trong config.yaml
+adapters = None # AdapterRegistry khi bật adapters.enabled: nhiều LoRA trên cùng một base model
+tts_cache = None
+tts_service = None
+response_cache = None
+metrics_registry = None
+residency = None # ResidencyManager khi bật worker.residency.enabled: LLM / Whisper / OCR chia nhau ngân sách GPU
+stt_engine = None
+ocr_pipeline = None
+_lazy_load_lock = threading.Lock()
+
+startup_timings = {}
+
+
+@contextmanager
+def timed_phase(name):
+    start = time.perf_counter()
+    yield
+    startup_timings[name] = round(time.perf_counter() - start, 3)
+    print(f"[startup] {name}: {startup_timings[name]:.2f}s")
 
-print("--- Đang khởi tạo Denglish AI Worker (Đa phương tiện) ---")
 
 # ==========================================
 # 1. NẠP MÔ HÌNH TỪ Ổ CỨNG 50GB
 # ==========================================
-BASE_MODEL_PATH = "/runpod-volume/llama3-base"
-LORA_MODEL_PATH = "/runpod-volume/denglish-model"
-
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_PATH)
-base_model = AutoModelForCausalLM.from_pretrained(
-    BASE_MODEL_PATH,
-    torch_dtype=torch.bfloat16,
-    device_map="cuda"
-)
-model = PeftModel.from_pretrained(base_model, LORA_MODEL_PATH)
+def load_llm():
+    global llm, adapters
 
-stt_model = whisper.load_model("small", device="cuda")
+    generation_kwargs = {
+        "max_new_tokens": WORKER_CONFIG.get("max_new_tokens", 400),
+        "temperature": WORKER_CONFIG.get("temperature", 0.3),
+    }
 
-# Hàm tạo giọng nói (Edge TTS)
-async def generate_speech(text, voice, output_path):
-    communicate = edge_tts.Communicate(text, voice)
-    await communicate.save(output_path)
+    if LLM_CONFIG.get("backend", "transformers") == "llamacpp":
+        # Bản GGUF lượng tử hóa (build_and_push_gguf.py) chạy bằng llama.cpp, dùng cho replica chỉ có CPU
+        with timed_phase("llm_gguf"):
+            llm = LlamaCppBackend.from_config(
+                LLM_CONFIG, generation_kwargs, SpeculativeDecoding.from_config(SPECULATIVE_CONFIG))
+        return
 
-print("--- AI Worker Đã Sẵn Sàng ---")
+    with timed_phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(MERGED_MODEL_PATH or BASE_MODEL_PATH)
+        # Padding bên trái để các prompt trong cùng batch kết thúc thẳng hàng trước khi sinh token
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
 
-def handler(job):
-    job_input = job.get("input", {})
-    
+    if ADAPTERS_CONFIG.get("enabled", False) and MERGED_MODEL_PATH:
+        raise ValueError("adapters.enabled cần base model + LoRA riêng, bỏ worker.merged_model_path")
+
+    if MERGED_MODEL_PATH:
+        # safetensors được memory-map và chép thẳng lên GPU; không còn lớp LoRA trong mỗi lượt forward
+        with timed_phase("llm_merged"):
+            model = AutoModelForCausalLM.from_pretrained(
+                MERGED_MODEL_PATH,
+                torch_dtype=torch.bfloat16,
+                device_map="cuda",
+                use_safetensors=True
+            )
+    else:
+        from peft import PeftModel
+
+        with timed_phase("llm_base"):
+            base_model = AutoModelForCausalLM.from_pretrained(
+                BASE_MODEL_PATH,
+                torch_dtype=torch.bfloat16,
+                device_map="cuda"
+            )
+        with timed_phase("llm_lora"):
+            if ADAPTERS_CONFIG.get("enabled", False):
+                # Adapter tiếng Anh / tiếng Đức / luyện thi dùng chung một bản base 8B, mỗi job chọn adapter riêng
+                adapters = AdapterRegistry.from_config(ADAPTERS_CONFIG, base_model)
+                model = adapters.model
+            else:
+                model = PeftModel.from_pretrained(base_model, LORA_MODEL_PATH)
+                if STARTUP_CONFIG.get("merge_lora_on_load", False):
+                    model = model.merge_and_unload()
+
+    # KV cache của phần system prompt cố định, dùng lại giữa các request (đổi adapter là xóa cache)
+    prefix_cache = None
+    if PREFIX_CACHE_CONFIG.get("enabled", True):
+        prefix_cache = PrefixCache(
+            model,
+            tokenizer,
+            max_entries=PREFIX_CACHE_CONFIG.get("max_entries", 16),
+            adapter_version=prefix_cache_version(),
+            log_every=PREFIX_CACHE_CONFIG.get("log_every", 0),
+        )
+        if adapters is not None:
+            # Adapter bị xóa rồi nạp lại từ file đã đổi: KV prefix tính bằng trọng số cũ không dùng được nữa
+            adapters.on_reload = lambda name: prefix_cache.set_adapter_version(prefix_cache_version())
+
+    # Speculative decoding (prompt lookup / draft model) cho các lượt stream: handler tuần tự và streaming
+    speculative = None
+    if SPECULATIVE_CONFIG.get("method", "none") != "none":
+        with timed_phase("speculative"):
+            speculative = SpeculativeDecoding.from_config(SPECULATIVE_CONFIG, model)
+
+    generation_kwargs["pad_token_id"] = tokenizer.eos_token_id
+    llm = TransformersBackend(model, tokenizer, generation_kwargs, prefix_cache, speculative, adapters)
+
+
+def build_stt_engine():
+    from stt_engine import STTEngine
+
+    return STTEngine.from_config(CONFIG.get("voice", {}))
+
+
+def build_ocr():
+    from ocr_pipeline import OCRPipeline
+
+    pipeline = OCRPipeline.from_config(CONFIG.get("vision", {}))
+    pipeline.check() # Kiểm tra binary tesseract một lần
+    pipeline.warmup() # Spawn sẵn process pool nhận dạng tile
+    return pipeline
+
+
+def get_stt_engine():
+    # Whisper chỉ được nạp khi có job audio đầu tiên: worker chỉ nhận text không tốn VRAM / thời gian khởi động
+    global stt_engine
+    if stt_engine is None:
+        with _lazy_load_lock:
+            if stt_engine is None:
+                with timed_phase("stt"):
+                    stt_engine = build_stt_engine()
+    return stt_engine
+
+
+def get_ocr():
+    global ocr_pipeline
+    if ocr_pipeline is None:
+        with _lazy_load_lock:
+            if ocr_pipeline is None:
+                with timed_phase("tesseract"):
+                    ocr_pipeline = build_ocr()
+    return ocr_pipeline
+
+
+def init_residency():
+    """Đăng ký LLM / Whisper / OCR với ResidencyManager; Whisper và OCR vẫn chỉ nạp ở lần dùng đầu tiên."""
+    global residency
+    models_config = RESIDENCY_CONFIG.get("models", {})
+    on_event = metrics_registry.observe_residency if metrics_registry is not None else None
+    residency = ResidencyManager.from_config(RESIDENCY_CONFIG, on_event)
+
+    def options(name, policy):
+        model_config = models_config.get(name, {})
+        return {
+            "policy": model_config.get("policy", policy),
+            "footprint_bytes": int(model_config.get("footprint_mb", 0) * MB), # 0 = đo khi nạp
+        }
+
+    if isinstance(llm, TransformersBackend):
+        # llama.cpp (GGUF) chạy trên CPU, không chiếm GPU
+        residency.register(TorchResident("llm", llm.model, policy=options("llm", "offload")["policy"]))
+
+    stt_device = CONFIG.get("voice", {}).get("stt_device", "auto")
+    if stt_device == "auto":
+        stt_device = "cuda" if torch.cuda.is_available() else "cpu"
+    # CTranslate2 tự chuyển trọng số Whisper sang RAM và đưa lại GPU mà không đọc lại file model
+    residency.register(LazyResident(
+        "stt", build_stt_engine, device=stt_device, **options("stt", "offload"),
+        offload=lambda engine: engine.model.model.unload_model(to_cpu=True),
+        restore=lambda engine: engine.model.model.load_model(),
+        unload=lambda engine: engine.model.model.unload_model(),
+    ))
+    # Tesseract chạy trên CPU: chỉ đóng process pool khi rảnh quá idle_seconds
+    residency.register(LazyResident(
+        "ocr", build_ocr, device="cpu", **options("ocr", "unload"), unload=lambda pipeline: pipeline.close()))
+
+
+def acquire_model(name, timings=None):
+    """Model của một bước (llm / stt / ocr). Có residency thì chờ model lên GPU và giữ nó tới release_model."""
+    if residency is None or name not in residency:
+        return {"llm": lambda: llm, "stt": get_stt_engine, "ocr": get_ocr}[name]()
+    start = time.perf_counter()
+    model = residency.acquire(name)
+    if timings is not None:
+        timings.add("residency", time.perf_counter() - start)
+    return model
+
+
+def release_model(name):
+    if residency is not None and name in residency:
+        residency.release(name)
+
+
+@contextmanager
+def model_in_use(name, timings=None):
+    model = acquire_model(name, timings)
+    try:
+        yield model
+    finally:
+        release_model(name)
+
+
+def prefetch_models(job_input):
+    # Biết loại job là đưa model cần dùng lên GPU trên thread nền, gối đầu với bước giải mã audio / ảnh
+    if residency is None:
+        return
+    if job_input.get("audio_base64"):
+        residency.prefetch("stt", "llm")
+    elif job_input.get("image_base64"):
+        residency.prefetch("ocr", "llm")
+    elif job_input.get("text"):
+        residency.prefetch("llm")
+
+
+def warmup():
+    # Chạy thử một lượt generate ngắn cho mỗi ngôn ngữ: khởi tạo CUDA kernel và nạp sẵn prefix cache
+    for target_lang in ("en", "de"):
+        messages = worker_messages("text", "I goes to school yesterday.", target_lang)
+        adapter = resolve_adapter({}, target_lang)
+        # Preload stt / ocr có thể đã đẩy LLM ra: đưa lại lên GPU trước khi dựng prefix cache
+        with model_in_use("llm"):
+            for _ in llm.stream(messages, cache_key=(target_lang, "text"), adapter=adapter, max_new_tokens=8):
+                pass
+
+
+def model_version():
+    # Đổi model / adapter / file GGUF là đổi version: câu trả lời cũ trong response cache không còn khớp
+    if LLM_CONFIG.get("backend", "transformers") == "llamacpp":
+        return f"llamacpp:{adapter_version(LLM_CONFIG.get('gguf_path'))}"
+    if adapters is not None:
+        # Version từng adapter nằm trong khóa cache của mỗi job (xem cache_params)
+        return f"transformers:{adapter_version(BASE_MODEL_PATH)}"
+    return f"transformers:{adapter_version(MERGED_MODEL_PATH or LORA_MODEL_PATH)}"
+
+
+def prefix_cache_version():
+    if adapters is not None:
+        return f"{model_version()}|{adapters.fingerprint()}"
+    return model_version()
+
+
+def init_worker():
+    global tts_cache, tts_service, response_cache, metrics_registry
+
+    print("--- Đang khởi tạo Denglish AI Worker (Đa phương tiện) ---")
+    startup_start = time.perf_counter()
+
+    load_llm()
+
+    if RESPONSE_CACHE_CONFIG.get("enabled", True):
+        # Bài nộp trùng nhau (câu trong sách giáo khoa) trả thẳng kết quả cũ, không chạy lại LLM + TTS
+        response_cache = ResponseCache.from_config(RESPONSE_CACHE_CONFIG, model_version=model_version())
+
+    # Dịch vụ TTS (Edge TTS) sống suốt vòng đời worker: một event loop nền,
+    # tổng hợp song song nhiều câu (giới hạn bởi max_concurrency) thay vì mỗi job một thread + loop mới
+    with timed_phase("tts"):
+        synthesizer = build_synthesizer(TTS_CONFIG)
+        if TTS_CACHE_CONFIG.get("enabled", True):
+            # Câu sửa lỗi / lời giải thích lặp lại được lấy từ cache, không gọi lại edge-tts
+            tts_cache = TTSCache.from_config(TTS_CACHE_CONFIG)
+            synthesizer = CachedSynthesizer(synthesizer, tts_cache)
+
+        tts_service = TTSService(
+            synthesizer,
+            max_concurrency=TTS_CONFIG.get("max_concurrency", 4),
+            min_sentence_chars=TTS_CONFIG.get("min_sentence_chars", 20),
+        )
+
+    if METRICS_CONFIG.get("enabled", True):
+        # Histogram thời gian từng bước / số token, đọc qua endpoint /metrics hoặc file .prom
+        metrics_registry = MetricsRegistry.from_config(METRICS_CONFIG)
+        if METRICS_CONFIG.get("port"):
+            metrics_registry.serve(METRICS_CONFIG["port"])
+        if response_cache is not None:
+            response_cache.on_lookup = metrics_registry.observe_cache_lookup
+
+    if RESIDENCY_CONFIG.get("enabled", False):
+        init_residency()
+
+    # Worker biết trước sẽ nhận audio / ảnh thì có thể nạp sẵn thay vì đợi job đầu tiên
+    for name in STARTUP_CONFIG.get("preload", []):
+        with model_in_use(name):
+            pass
+
+    if STARTUP_CONFIG.get("warmup", True):
+        with timed_phase("warmup"):
+            warmup()
+
+    startup_timings["total"] = round(time.perf_counter() - startup_start, 3)
+    print(f"[startup] timings: {startup_timings}")
+    print("--- AI Worker Đã Sẵn Sàng ---")
+
+
+# ==========================================
+# CÁC BƯỚC XỬ LÝ (DÙNG CHUNG CHO HANDLER TUẦN TỰ VÀ HANDLER BATCH)
+# ==========================================
+def extract_user_text(job_input, timings=None):
+    """Trả về (input_type, user_extracted_text, error, target_lang).
+
+    Job audio không gửi `lang` thì target_lang lấy theo ngôn ngữ Whisper nhận diện được (en/de).
+    Thời gian giải mã input / STT / OCR được ghi vào `timings` (JobTimings) nếu có.
+    """
+    timings = timings or JobTimings()
     text_input = job_input.get("text")
     image_base64 = job_input.get("image_base64")
     audio_base64 = job_input.get("audio_base64")
-    target_lang = job_input.get("lang", "en")
-    
-    user_extracted_text = ""
-    input_type = "unknown"
-    temp_files = [] # Danh sách lưu file tạm để dọn rác
+    requested_lang = job_input.get("lang")
+    target_lang = requested_lang or "en"
+    prefetch_models(job_input)
+
+    if audio_base64:
+        input_type = "audio"
+        # Giải mã thẳng từ bytes sang mảng float32 16 kHz, không ghi file tạm
+        with timings.stage("input_decode"):
+            audio = decode_audio(b64decode(audio_base64))
+
+        with model_in_use("stt", timings) as stt, timings.stage("stt"):
+            transcription = stt.transcribe(audio, language=requested_lang)
+        user_extracted_text = transcription.text
+        if requested_lang is None and transcription.language in SUPPORTED_LANGS:
+            target_lang = transcription.language
+
+    elif image_base64:
+        input_type = "image"
+        with timings.stage("input_decode"):
+            image_bytes = b64decode(image_base64)
+
+        ocr_lang = "eng" if target_lang == "en" else "deu"
+        with model_in_use("ocr", timings) as ocr, timings.stage("ocr"):
+            ocr_result = ocr.recognize(image_bytes, lang=ocr_lang)
+        print(f"[ocr] {ocr_result.tiles} tiles: {ocr_result.timings}")
+        user_extracted_text = ocr_result.text
+
+    elif text_input:
+        input_type = "text"
+        user_extracted_text = text_input.strip()
+
+    else:
+        return None, "", "Vui lòng cung cấp ít nhất một trường: text, image_base64, hoặc audio_base64.", target_lang
+
+    if not user_extracted_text:
+        return input_type, "", f"Không thể trích xuất được văn bản từ dữ liệu đầu vào ({input_type}).", target_lang
+
+    return input_type, user_extracted_text, None, target_lang
+
+
+def resolve_adapter(job_input, target_lang):
+    """Adapter cho job: trường `adapter`, không có thì theo ngôn ngữ; None khi worker chỉ có một model."""
+    if adapters is None:
+        return None
+    return adapters.resolve(job_input.get("adapter"), target_lang)
+
+
+def generation_overrides():
+    return response_cache.generation_overrides() if response_cache is not None else {}
+
+
+def cache_params(adapter):
+    params = {**llm.generation_kwargs, **generation_overrides()}
+    if adapter is not None:
+        params["adapter"] = adapters.version(adapter)
+    return params
+
+
+def lookup_response(input_type, user_extracted_text, target_lang, adapter=None):
+    """Trả về ((ai_text, ai_audio), "exact" | "near") nếu đã có trong response cache, không thì (None, None)."""
+    if response_cache is None:
+        return None, None
+    return response_cache.get(user_extracted_text, target_lang, input_type, cache_params(adapter))
+
+
+def store_response(input_type, user_extracted_text, target_lang, ai_text, ai_audio, adapter=None):
+    if response_cache is None or not ai_text:
+        return
+    response_cache.put(user_extracted_text, target_lang, input_type, cache_params(adapter), (ai_text, ai_audio))
+
+
+def wants_timings(job_input):
+    # Khối `timings` trong response: bật cho mọi job trong config, hoặc từng job gửi "timings": true
+    return METRICS_CONFIG.get("response_timings", False) or bool(job_input.get("timings"))
+
+
+def finish_job(handler_name, job_input, input_type, timings, response):
+    """Ghi timings của job vào histogram và (nếu được yêu cầu) đính kèm vào response."""
+    if metrics_registry is not None:
+        status = "error" if "error" in response else "success"
+        metrics_registry.observe_job(handler_name, input_type, status, timings)
+    if wants_timings(job_input):
+        response["timings"] = timings.as_dict()
+    return response
+
+
+def generate_batch(items):
+    # Các hội thoại chạy đồng thời được sinh chung một lần (transformers: một batch có padding),
+    # kể cả khi mỗi hội thoại dùng một adapter khác nhau
+    conversations = [messages for messages, _ in items]
+    batch_adapters = [adapter for _, adapter in items] if adapters is not None else None
+    with model_in_use("llm"):
+        return llm.generate(conversations, adapters=batch_adapters, **generation_overrides())
+
+
+def voice_for_lang(target_lang):
+    return "en-US-EmmaNeural" if target_lang == "en" else "de-DE-KatjaNeural"
+
+
+def generate_with_tts(input_type, user_extracted_text, target_lang, timings=None, adapter=None):
+    # Mỗi câu vừa sinh xong được gửi sang TTS ngay trong lúc LLM vẫn đang sinh tiếp
+    timings = timings or JobTimings()
+    messages = worker_messages(input_type, user_extracted_text, target_lang)
+    pipeline = tts_service.pipeline(voice_for_lang(target_lang))
+
+    ai_text_parts = []
+    with model_in_use("llm", timings), timings.stage("llm"):
+        generation = llm.stream(messages, cache_key=(target_lang, input_type), adapter=adapter, **generation_overrides())
+        for delta in generation: # Nếu generate lỗi thì ném lỗi ra đây
+            ai_text_parts.append(delta)
+            pipeline.feed(delta)
+    timings.add_llm_stats(generation.stats)
+
+    # TTS chạy gối đầu với LLM: chỉ phần audio chưa xong khi LLM sinh hết được tính cho bước tts
+    with timings.stage("tts"):
+        ai_audio = pipeline.finish()
+    return "".join(ai_text_parts).strip(), ai_audio
+
+
+def handler(job):
+    job_input = job.get("input", {})
+    timings = JobTimings()
+    input_type = None
 
     try:
         # ==========================================
         # BƯỚC 1: TRÍCH XUẤT VĂN BẢN (STT / OCR)
         # ==========================================
-        if audio_base64:
-            input_type = "audio"
-            audio_bytes = base64.b64decode(audio_base64)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio:
-                temp_audio.write(audio_bytes)
-                temp_audio_path = temp_audio.name
-                temp_files.append(temp_audio_path)
-            
-            transcription = stt_model.transcribe(temp_audio_path)
-            user_extracted_text = transcription["text"].strip()
-            
-        elif image_base64:
-            input_type = "image"
-            image_bytes = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            ocr_lang = "eng" if target_lang == "en" else "deu"
-            user_extracted_text = pytesseract.image_to_string(image, lang=ocr_lang).strip()
-            
-        elif text_input:
-            input_type = "text"
-            user_extracted_text = text_input.strip()
-            
+        input_type, user_extracted_text, error, target_lang = extract_user_text(job_input, timings)
+        if error:
+            return finish_job("serial", job_input, input_type, timings, {"error": error})
+        adapter = resolve_adapter(job_input, target_lang)
+
+        # ==========================================
+        # BƯỚC 2 + 3: GIA SƯ AI SỬA LỖI (LLM) VÀ ĐỌC KẾT QUẢ (TTS) CHẠY GỐI ĐẦU THEO TỪNG CÂU
+        # ==========================================
+        with timings.stage("cache"):
+            cached, cache_hit = lookup_response(input_type, user_extracted_text, target_lang, adapter)
+        if cached is not None:
+            ai_response, ai_audio = cached
         else:
-            return {"error": "Vui lòng cung cấp ít nhất một trường: text, image_base64, hoặc audio_base64."}
+            ai_response, ai_audio = generate_with_tts(input_type, user_extracted_text, target_lang, timings, adapter)
+            store_response(input_type, user_extracted_text, target_lang, ai_response, ai_audio, adapter)
 
-        if not user_extracted_text:
-            return {"error": f"Không thể trích xuất được văn bản từ dữ liệu đầu vào ({input_type})."}
+        # Chuyển đổi âm thanh (đã nằm sẵn trong bộ nhớ) sang Base64
+        with timings.stage("encode"):
+            ai_audio_base64 = b64encode(ai_audio)
 
         # ==========================================
-        # BƯỚC 2: GIA SƯ AI SỬA LỖI (LLM)
+        # TRẢ KẾT QUẢ
         # ==========================================
-        lang_name = "English" if target_lang == "en" else "German"
-        
-        if input_type == "image":
-            context_msg = f"The user uploaded an image of their {lang_name} exercise. Here is the extracted text from OCR: '{user_extracted_text}'. Note that OCR might have some typos."
+        return finish_job("serial", job_input, input_type, timings, {
+            "status": "success",
+            "input_type": input_type,
+            "lang": target_lang,
+            "adapter": adapter,
+            "recognized_text": user_extracted_text,
+            "ai_text": ai_response,
+            "ai_audio_base64": ai_audio_base64,
+            "cache": cache_hit
+        })
+
+    except Exception as e:
+        return finish_job("serial", job_input, input_type, timings, {"error": f"Lỗi trong quá trình xử lý: {str(e)}"})
+
+
+# ==========================================
+# HANDLER BẤT ĐỒNG BỘ: GOM CÁC JOB CHẠY SONG SONG THÀNH BATCH CHO LLM
+# ==========================================
+scheduler = BatchScheduler(
+    generate_batch,
+    max_batch_size=BATCHING_CONFIG.get("max_batch_size", 8),
+    max_wait_ms=BATCHING_CONFIG.get("max_wait_ms", 20),
+)
+
+
+async def async_handler(job):
+    job_input = job.get("input", {})
+    timings = JobTimings()
+    input_type = None
+
+    try:
+        # STT / OCR chạy trong thread để các job khác vẫn vào được hàng đợi batch
+        input_type, user_extracted_text, error, target_lang = await asyncio.to_thread(
+            extract_user_text, job_input, timings
+        )
+        if error:
+            return finish_job("batch", job_input, input_type, timings, {"error": error})
+        adapter = resolve_adapter(job_input, target_lang)
+
+        with timings.stage("cache"):
+            cached, cache_hit = lookup_response(input_type, user_extracted_text, target_lang, adapter)
+        if cached is not None:
+            ai_response, ai_audio = cached
         else:
-            context_msg = f"The user provided a {lang_name} input: '{user_extracted_text}'."
-
-        system_prompt = (
-            f"You are a friendly and strict {lang_name} tutor for Vietnamese students. "
-            f"{context_msg} "
-            f"Task: 1. Correct any grammatical, spelling, or pronunciation mistakes. "
-            f"2. Explain the corrections clearly in Vietnamese. "
-            f"3. Provide the perfectly corrected sentence in {lang_name} at the very end."
+            # Batch có padding trái nên không dùng prefix cache; thời gian llm gồm cả lúc chờ gom batch
+            with timings.stage("llm"):
+                ai_response = await scheduler.submit(
+                    (worker_messages(input_type, user_extracted_text, target_lang), adapter))
+            timings.counts["generated_tokens"] = llm.count_tokens(ai_response)
+
+            # Batch trả về toàn bộ câu trả lời một lúc: các câu được tổng hợp song song trên dịch vụ TTS
+            with timings.stage("tts"):
+                ai_audio = await asyncio.to_thread(tts_service.synthesize, ai_response, voice_for_lang(target_lang))
+            store_response(input_type, user_extracted_text, target_lang, ai_response, ai_audio, adapter)
+        with timings.stage("encode"):
+            ai_audio_base64 = b64encode(ai_audio)
+
+        return finish_job("batch", job_input, input_type, timings, {
+            "status": "success",
+            "input_type": input_type,
+            "lang": target_lang,
+            "adapter": adapter,
+            "recognized_text": user_extracted_text,
+            "ai_text": ai_response,
+            "ai_audio_base64": ai_audio_base64,
+            "cache": cache_hit
+        })
+
+    except Exception as e:
+        return finish_job("batch", job_input, input_type, timings, {"error": f"Lỗi trong quá trình xử lý: {str(e)}"})
+
+
+# ==========================================
+# HANDLER STREAMING: TRẢ TEXT TỪNG ĐOẠN VÀ AUDIO TỪNG CÂU NGAY KHI CÓ
+# ==========================================
+async def stream_handler(job):
+    job_start = time.perf_counter()
+    job_input = job.get("input", {})
+    timings = JobTimings()
+    input_type = None
+    ttft = ttfa = None
+    llm_acquired = False
+
+    try:
+        input_type, user_extracted_text, error, target_lang = await asyncio.to_thread(
+            extract_user_text, job_input, timings
         )
+        if error:
+            yield finish_job("stream", job_input, input_type, timings, {"error": error})
+            return
+        voice_id = voice_for_lang(target_lang)
+        adapter = resolve_adapter(job_input, target_lang)
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "Hãy chấm bài và sửa lỗi cho tôi."}
-        ]
-        
-        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
-
-        outputs = model.generate(
-            **inputs, 
-            max_new_tokens=400, 
-            temperature=0.3,
-            pad_token_id=tokenizer.eos_token_id
+        with timings.stage("cache"):
+            cached, cache_hit = lookup_response(input_type, user_extracted_text, target_lang, adapter)
+        if cached is not None:
+            # Kết quả có sẵn: trả toàn bộ text và audio trong một lượt
+            ai_response, ai_audio = cached
+            yield {"type": "text", "delta": ai_response}
+            with timings.stage("encode"):
+                ai_audio_base64 = b64encode(ai_audio)
+            yield {"type": "audio", "index": 0, "text": ai_response, "audio_base64": ai_audio_base64}
+            yield finish_job("stream", job_input, input_type, timings, {
+                "type": "done",
+                "status": "success",
+                "input_type": input_type,
+                "lang": target_lang,
+                "adapter": adapter,
+                "recognized_text": user_extracted_text,
+                "ai_text": ai_response,
+                "metrics": {"cache": cache_hit, "total_ms": round((time.perf_counter() - job_start) * 1000, 1)}
+            })
+            return
+
+        messages = worker_messages(input_type, user_extracted_text, target_lang)
+        await asyncio.to_thread(acquire_model, "llm", timings)
+        llm_acquired = True
+        llm_start = time.perf_counter()
+        # Tokenize + dựng prefix cache có thể tốn vài ms GPU: không chạy trên event loop
+        generation = await asyncio.to_thread(
+            llm.stream, messages, cache_key=(target_lang, input_type), adapter=adapter, **generation_overrides()
         )
-        
-        ai_response = tokenizer.batch_decode(outputs[0][len(inputs.input_ids[0]):], skip_special_tokens=True)[0].strip()
 
-        # ==========================================
-        # BƯỚC 3: AI ĐỌC KẾT QUẢ (TTS BẰNG THREAD ĐỂ LÁCH LUẬT RUNPOD)
-        # ==========================================
-        voice_id = "en-US-EmmaNeural" if target_lang == "en" else "de-DE-KatjaNeural"
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_tts:
-            tts_output_path = temp_tts.name
-            temp_files.append(tts_output_path)
-        
-        # Hàm con chạy trong luồng riêng biệt
-        def run_async_tts_in_thread():
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            new_loop.run_until_complete(generate_speech(ai_response, voice_id, tts_output_path))
-            new_loop.close()
-
-        # Khởi động luồng để đọc file âm thanh
-        tts_thread = threading.Thread(target=run_async_tts_in_thread)
-        tts_thread.start()
-        tts_thread.join() # Chờ luồng đọc xong mới đi tiếp
-        
-        # Chuyển đổi file âm thanh sang Base64
-        with open(tts_output_path, "rb") as f:
-            ai_audio_base64 = base64.b64encode(f.read()).decode('utf-8')
+        ai_text_parts = []
+        audio_parts = []
+        events = stream_text_and_audio(
+            generation, # Nếu generate lỗi thì lỗi được ném ra trong vòng lặp này
+            lambda sentence: tts_service.synthesize_async(sentence, voice_id),
+            min_chars=tts_service.min_sentence_chars,
+        )
+        # Chỉ tính thời gian chờ generator, không tính lúc encode / gửi sự kiện cho client
+        generator_seconds = llm_seconds = time.perf_counter() - llm_start
+        while True:
+            step_start = time.perf_counter()
+            try:
+                event = await events.__anext__()
+            except StopAsyncIteration:
+                break
+            generator_seconds += time.perf_counter() - step_start
+            if event[0] == "text":
+                llm_seconds = generator_seconds
+                if ttft is None:
+                    ttft = time.perf_counter() - job_start
+                ai_text_parts.append(event[1])
+                yield {"type": "text", "delta": event[1]}
+            else:
+                _, index, sentence, audio_bytes = event
+                audio_parts.append(audio_bytes)
+                if ttfa is None:
+                    ttfa = time.perf_counter() - job_start
+                with timings.stage("encode"):
+                    audio_base64 = b64encode(audio_bytes)
+                yield {
+                    "type": "audio",
+                    "index": index,
+                    "text": sentence,
+                    "audio_base64": audio_base64
+                }
+        # LLM xong ở đoạn text cuối cùng; phần sau đó là chờ audio của các câu cuối
+        timings.add("llm", llm_seconds)
+        timings.add("tts", generator_seconds - llm_seconds)
+        timings.add_llm_stats(generation.stats)
 
-        # ==========================================
-        # TRẢ KẾT QUẢ
-        # ==========================================
-        return {
+        metrics = {
+            "cache": None,
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "ttfa_ms": round(ttfa * 1000, 1) if ttfa is not None else None,
+            **generation.stats,
+            "total_ms": round((time.perf_counter() - job_start) * 1000, 1),
+        }
+        print(f"[stream] job {job.get('id')}: {metrics}")
+        ai_response = "".join(ai_text_parts).strip()
+        store_response(input_type, user_extracted_text, target_lang, ai_response, b"".join(audio_parts), adapter)
+        yield finish_job("stream", job_input, input_type, timings, {
+            "type": "done",
             "status": "success",
             "input_type": input_type,
+            "lang": target_lang,
+            "adapter": adapter,
             "recognized_text": user_extracted_text,
             "ai_text": ai_response,
-            "ai_audio_base64": ai_audio_base64
-        }
+            "metrics": metrics
+        })
 
     except Exception as e:
-        return {"error": f"Lỗi trong quá trình xử lý: {str(e)}"}
-
+        yield finish_job("stream", job_input, input_type, timings, {"error": f"Lỗi trong quá trình xử lý: {str(e)}"})
     finally:
-        # DỌN RÁC: Xóa sạch file tạm để giải phóng ổ cứng 50GB
-        for file_path in temp_files:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
+        if llm_acquired:
+            release_model("llm")
+
+
+def concurrency_modifier(current_concurrency):
+    # Số job RunPod giao đồng thời cho worker = số request tối đa có thể gom vào hàng đợi batch
+    return BATCHING_CONFIG.get("max_concurrency", scheduler.max_batch_size)
+
 
 if __name__ == "__main__":
-    runpod.serverless.start({"handler": handler})
\ No newline at end of file
+    init_worker()
+    if STREAMING_CONFIG.get("enabled", False):
+        # Generator handler: /stream nhận từng sự kiện, /run nhận danh sách gộp
+        runpod.serverless.start({"handler": stream_handler, "return_aggregate_stream": True})
+    elif BATCHING_CONFIG.get("enabled", True):
+        runpod.serverless.start({"handler": async_handler, "concurrency_modifier": concurrency_modifier})
+    else:
+        runpod.serverless.start({"handler": handler})
@@ -0,0 +1,307 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import torch
+from transformers import LogitsProcessorList, TextIteratorStreamer
+
+from prefix_cache import PrefillTimer
+from session_store import common_prefix_length
+from tutor_prompts import render_with_static_prefix, template_hash
+
+_STREAM_END = object()
+
+
+def finish_stats(stats, generate_seconds, generated_tokens):
+    """Điền decode_ms và decode_tokens_per_s; token đầu tiên thuộc về prefill nên không tính vào decode."""
+    stats["generated_tokens"] = generated_tokens
+    if stats.get("prefill_ms") is None:
+        return
+    decode_seconds = max(generate_seconds - stats["prefill_ms"] / 1000, 0.0)
+    stats["decode_ms"] = round(decode_seconds * 1000, 1)
+    if generated_tokens > 1 and decode_seconds > 0:
+        stats["decode_tokens_per_s"] = round((generated_tokens - 1) / decode_seconds, 1)
+
+
+class GenerationStream:
+    """Iterator các đoạn text (delta) của một lần sinh; `stats` được điền khi sinh xong.
+
+    Nếu quá trình sinh bị lỗi, lỗi được ném ra ở lần `next()` cuối cùng.
+    """
+
+    def __init__(self, deltas, future, stats):
+        self._deltas = iter(deltas)
+        self._future = future
+        self.stats = stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._deltas)
+        except StopIteration:
+            self._future.result()
+            raise
+
+
+class LLMBackend:
+    """API chung cho handler.py và VoiceTutor, không phụ thuộc engine bên dưới.
+
+    - generate(conversations, adapters) -> list[str]: sinh trọn câu trả lời cho nhiều hội thoại (một batch);
+      adapters: tên LoRA adapter cho từng hội thoại (AdapterRegistry), None = adapter mặc định.
+    - stream(messages, cache_key, session, adapter) -> GenerationStream: trả text từng đoạn cho một hội thoại;
+      cache_key = (lang, input_type) để engine dùng lại phần prompt cố định nếu hỗ trợ,
+      session (session_store.Session) để dùng lại KV của các lượt trước trong cùng phiên.
+    """
+
+    name = "base"
+
+    def generate(self, conversations, adapters=None, **overrides):
+        raise NotImplementedError
+
+    def stream(self, messages, cache_key=None, session=None, adapter=None, **overrides):
+        raise NotImplementedError
+
+    def count_tokens(self, text):
+        raise NotImplementedError
+
+
+class TransformersBackend(LLMBackend):
+    name = "transformers"
+
+    def __init__(self, model, tokenizer, generation_kwargs, prefix_cache=None, speculative=None, adapters=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = generation_kwargs
+        self.prefix_cache = prefix_cache
+        # SpeculativeDecoding (prompt lookup / draft model), chỉ dùng cho stream(): transformers chỉ hỗ trợ batch 1
+        self.speculative = speculative
+        if speculative is not None:
+            speculative.attach(model)
+        # AdapterRegistry: nhiều LoRA trên cùng base, mỗi hội thoại chọn một adapter (None = một model duy nhất)
+        self.adapters = adapters
+        # Thread chạy model.generate khi cần đọc token qua streamer
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+
+    @contextmanager
+    def _adapter_kwargs(self, names, record=True):
+        """kwargs `adapter_names` cho PEFT; giữ khóa forward của AdapterRegistry trong suốt lượt chạy."""
+        if self.adapters is None:
+            yield {}
+            return
+        with self.adapters.activate(names, record) as adapter_names:
+            yield {"adapter_names": adapter_names}
+
+    def generate(self, conversations, adapters=None, **overrides):
+        prompts = [
+            self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in conversations
+        ]
+        # Các prompt được pad về cùng độ dài (padding trái) và sinh trong một lần gọi generate.
+        # Pad bằng tokenizer.pad thay vì padding=True: fast tokenizer lưu trạng thái padding dùng chung,
+        # count_tokens / stream gọi song song từ thread khác sẽ ghi đè nó giữa chừng
+        inputs = self.tokenizer.pad(self.tokenizer(prompts), padding=True, return_tensors="pt").to(self.model.device)
+
+        # Batch trộn adapter: PEFT áp LoRA riêng cho từng dòng trong cùng một lượt forward
+        with self._adapter_kwargs(adapters or [None] * len(prompts)) as adapter_kwargs, torch.inference_mode():
+            outputs = self.model.generate(**inputs, **{**self.generation_kwargs, **overrides}, **adapter_kwargs)
+
+        new_tokens = outputs[:, inputs.input_ids.shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def _prepare_inputs(self, messages, cache_key, adapter=None):
+        prompt, static_prefix = render_with_static_prefix(self.tokenizer, messages)
+        if self.prefix_cache is None or cache_key is None:
+            return dict(self.tokenizer([prompt], return_tensors="pt").to(self.model.device)), 0
+        # Chỉ prefill phần sau prefix, phần prefix lấy KV từ cache (KV khác nhau theo adapter)
+        lang, input_type = cache_key
+        with self._adapter_kwargs([adapter], record=False):
+            return self.prefix_cache.generate_inputs(
+                prompt, static_prefix, lang, input_type, template_hash(static_prefix), adapter)
+
+    def _session_inputs(self, messages, cache_key, session, reuse, adapter=None):
+        """Dùng lại KV của phiên cho phần token đầu trùng với prompt mới, chỉ prefill phần còn lại."""
+        past_key_values, cached_ids = session.checkout()
+        if past_key_values is None or not reuse:
+            return self._prepare_inputs(messages, cache_key, adapter)
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        input_ids = self.tokenizer([prompt], return_tensors="pt").input_ids.to(self.model.device)
+        # Luôn để lại ít nhất một token cho lượt forward đầu
+        n = min(common_prefix_length(cached_ids, input_ids[0]), input_ids.shape[1] - 1)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        if n == 0:
+            return inputs, 0
+        # Phần sau prefix chung (câu trả lời được render lại khác chút, hoặc system prompt đổi khi tóm tắt) bị cắt bỏ
+        if past_key_values.get_seq_length() > n:
+            past_key_values.crop(n - past_key_values.get_seq_length())
+        inputs["past_key_values"] = past_key_values
+        return inputs, n
+
+    def _generate_stream(self, inputs, streamer, stats, overrides, speculative=False, session=None, adapter=None):
+        extra_kwargs = self.speculative.generate_kwargs(self.tokenizer) if speculative else {}
+        if session is not None:
+            # Cần past_key_values sau khi sinh để giữ lại cho lượt sau của phiên
+            extra_kwargs["return_dict_in_generate"] = True
+        prefill_timer = PrefillTimer()
+        try:
+            with self.speculative.tracking(speculative) if self.speculative is not None else nullcontext() as counts:
+                with self._adapter_kwargs([adapter]) as adapter_kwargs, torch.inference_mode():
+                    outputs = self.model.generate(
+                        **inputs,
+                        **{**self.generation_kwargs, **overrides},
+                        **extra_kwargs,
+                        **adapter_kwargs,
+                        streamer=streamer,
+                        logits_processor=LogitsProcessorList([prefill_timer])
+                    )
+        except Exception:
+            streamer.end() # Không để vòng đọc streamer bị treo khi generate lỗi
+            raise
+
+        if session is not None:
+            outputs, past_key_values = outputs.sequences, outputs.past_key_values
+            # KV có cho mọi token trừ token sinh cuối cùng (chưa được đưa qua model)
+            cached = past_key_values.get_seq_length() if past_key_values is not None else 0
+            if 0 < cached < outputs.shape[1]:
+                session.checkin(outputs[0, :cached].tolist(), past_key_values)
+
+        prefill_seconds = prefill_timer.prefill_seconds
+        if counts is not None and counts["first_step_at"] is not None:
+            # Bộ đoán token cũng gọi logits processor trước lượt forward đầu: lấy lúc bước kiểm tra đầu tiên xong
+            prefill_seconds = counts["first_step_at"] - prefill_timer.start
+        if self.prefix_cache is not None:
+            self.prefix_cache.record_prefill(prefill_seconds)
+        if prefill_seconds is not None:
+            stats["prefill_ms"] = round(prefill_seconds * 1000, 1)
+        finish_stats(stats, time.perf_counter() - prefill_timer.start, outputs.shape[1] - inputs["input_ids"].shape[1])
+        if self.speculative is not None:
+            self.speculative.record(stats, counts, speculative)
+
+    def stream(self, messages, cache_key=None, session=None, adapter=None, **overrides):
+        if self.adapters is not None:
+            adapter = adapter or self.adapters.default
+        speculative = self.speculative is not None and self.speculative.use_for_next()
+        # Assisted generation của transformers nạp lại cả prompt ở lượt forward đầu dù đã có KV dựng sẵn,
+        # nên lượt speculative không dùng prefix cache / KV của phiên
+        if session is not None:
+            inputs, prefix_tokens_reused = self._session_inputs(
+                messages, None if speculative else cache_key, session, reuse=not speculative, adapter=adapter)
+        else:
+            inputs, prefix_tokens_reused = self._prepare_inputs(messages, None if speculative else cache_key, adapter)
+        stats = {
+            "prefill_ms": None,
+            "prefix_tokens_reused": prefix_tokens_reused,
+            "prompt_tokens": inputs["input_ids"].shape[1],
+        }
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        future = self._executor.submit(
+            self._generate_stream, inputs, streamer, stats, overrides, speculative, session, adapter)
+        return GenerationStream(streamer, future, stats)
+
+
+class LlamaCppBackend(LLMBackend):
+    """Chạy file GGUF (vd: Q4_K_M từ build_and_push_gguf.py) bằng llama.cpp, dùng được trên CPU.
+
+    llama.cpp tự giữ lại KV của phần prompt trùng với lần gọi trước; thêm LlamaRAMCache
+    để nhớ nhiều prefix (en/de, text/image) cùng lúc.
+    """
+
+    name = "llamacpp"
+
+    def __init__(self, model_path, generation_kwargs, n_ctx=4096, n_threads=None, n_gpu_layers=0, prompt_cache_mb=0,
+                 speculative=None):
+        from llama_cpp import Llama, LlamaRAMCache
+
+        # llama-cpp-python chỉ có sẵn bộ đoán prompt lookup; không có tỉ lệ chấp nhận, chỉ có speedup
+        self.speculative = speculative
+        self._draft = None
+        if speculative is not None:
+            if speculative.method != "prompt_lookup":
+                raise ValueError("llm.backend = llamacpp chỉ hỗ trợ speculative.method = prompt_lookup")
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+            self._draft = LlamaPromptLookupDecoding(
+                num_pred_tokens=speculative.num_tokens, max_ngram_size=speculative.max_ngram)
+
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads or os.cpu_count(),
+            n_gpu_layers=n_gpu_layers,
+            draft_model=self._draft,
+            verbose=False,
+        )
+        if prompt_cache_mb:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=prompt_cache_mb * 1024 * 1024))
+        self.generation_kwargs = generation_kwargs
+        # Một đối tượng Llama không an toàn khi gọi song song: mọi lượt sinh đi qua một thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llamacpp")
+
+    @classmethod
+    def from_config(cls, llm_config, generation_kwargs, speculative=None):
+        return cls(
+            llm_config["gguf_path"],
+            generation_kwargs,
+            n_ctx=llm_config.get("n_ctx", 4096),
+            n_threads=llm_config.get("n_threads") or None,
+            n_gpu_layers=llm_config.get("n_gpu_layers", 0),
+            prompt_cache_mb=llm_config.get("prompt_cache_mb", 0),
+            speculative=speculative,
+        )
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _completion_kwargs(self, overrides):
+        params = {**self.generation_kwargs, **overrides}
+        # Như transformers với generation_config của Llama-3-Instruct: mặc định lấy mẫu theo worker.temperature,
+        # chỉ giải mã greedy khi được yêu cầu rõ (do_sample=False, vd response_cache.deterministic)
+        temperature = 0.0 if params.get("do_sample") is False else params.get("temperature", 0.3)
+        return {"max_tokens": params.get("max_new_tokens", 400), "temperature": temperature}
+
+    def _run_stream(self, messages, output, stats, overrides):
+        speculative = self.speculative is not None and self.speculative.use_for_next()
+        # Lượt baseline sinh không có bộ đoán; Llama đọc draft_model ở mỗi lần generate
+        self.llm.draft_model = self._draft if speculative else None
+        start = time.perf_counter()
+        generated = 0
+        try:
+            for chunk in self.llm.create_chat_completion(messages, stream=True, **self._completion_kwargs(overrides)):
+                delta = chunk["choices"][0]["delta"].get("content")
+                if delta:
+                    # Khi stream, llama.cpp trả mỗi token một chunk
+                    generated += 1
+                    if stats["prefill_ms"] is None:
+                        stats["prefill_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    output.put(delta)
+            finish_stats(stats, time.perf_counter() - start, generated)
+            # Ngữ cảnh sau khi sinh = prompt + các token đã sinh
+            stats["prompt_tokens"] = max(self.llm.n_tokens - generated, 0)
+            if self.speculative is not None:
+                self.speculative.record(stats, None, speculative)
+        finally:
+            self.llm.draft_model = self._draft
+            output.put(_STREAM_END)
+
+    def stream(self, messages, cache_key=None, session=None, adapter=None, **overrides):
+        # llama.cpp tự giữ KV của phần prompt trùng lần gọi trước, phiên chỉ cần gửi đủ lịch sử
+        output = queue.Queue()
+        stats = {"prefill_ms": None, "prefix_tokens_reused": None}
+        future = self._executor.submit(self._run_stream, messages, output, stats, overrides)
+        return GenerationStream(iter(output.get, _STREAM_END), future, stats)
+
+    def _generate_one(self, messages, overrides):
+        result = self.llm.create_chat_completion(messages, **self._completion_kwargs(overrides))
+        return result["choices"][0]["message"]["content"].strip()
+
+    def generate(self, conversations, adapters=None, **overrides):
+        # llama.cpp xử lý lần lượt từng hội thoại; gọi trong thread riêng để dùng chung hàng đợi với stream()
+        return self._executor.submit(
+            lambda: [self._generate_one(messages, overrides) for messages in conversations]
+        ).result()
@@ -0,0 +1,229 @@
+"""Gộp LoRA vào base model kiểu streaming: đọc từng tensor của các shard safetensors (mmap), cộng delta LoRA
+cho đúng các projection được train rồi ghi thẳng ra shard mới, không bao giờ nạp cả model vào RAM.
+
+Kết quả trùng từng bit với `PeftModel.from_pretrained(...).merge_and_unload()` trên CPU: adapter bf16/fp16
+được nâng lên fp32 như PEFT (autocast_adapter_dtype), delta = (B @ A) * scaling tính bằng fp32 rồi cộng
+tại chỗ vào trọng số đã ép về `dtype`. RAM đỉnh ~ tensor lớn nhất (embed_tokens / lm_head) + adapter.
+
+    python lora_merge.py --base unsloth/llama-3-8b-Instruct --adapter ./tutor_model_output --output ./merged_model
+"""
+import argparse
+import json
+import math
+import os
+import re
+import resource
+import shutil
+import time
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file
+
+ADAPTER_CONFIG = "adapter_config.json"
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+INDEX_FILE = "model.safetensors.index.json"
+PEFT_PREFIX = "base_model.model."
+# Config, generation config, tokenizer, chat template: chép nguyên từ base sang model đã gộp
+COPY_SUFFIXES = (".json", ".jinja", ".model", ".txt")
+DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16, "float32": torch.float32}
+SAFETENSORS_DTYPES = {
+    torch.bfloat16: "BF16", torch.float16: "F16", torch.float32: "F32", torch.float64: "F64",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8", torch.uint8: "U8", torch.bool: "BOOL",
+}
+_TORCH_DTYPES = {name: dtype for dtype, name in SAFETENSORS_DTYPES.items()}
+_FLOAT_NAMES = ("BF16", "F16", "F32", "F64")
+
+
+class LoraWeights:
+    """Các cặp (A, B) và scaling theo tên tensor base, cùng các tensor thay thế nguyên khối (modules_to_save)."""
+
+    def __init__(self, adapter_dir):
+        with open(os.path.join(adapter_dir, ADAPTER_CONFIG)) as f:
+            self.config = json.load(f)
+        if self.config.get("peft_type", "LORA") != "LORA":
+            raise ValueError(f"Chỉ hỗ trợ adapter LoRA, không phải {self.config['peft_type']}")
+        for option in ("use_dora", "lora_bias", "trainable_token_indices", "layer_replication"):
+            if self.config.get(option):
+                raise ValueError(f"lora_merge chưa hỗ trợ `{option}`; dùng merge_and_push.py với merge.streaming: False")
+
+        self.pairs = {}  # tên trọng số base -> [A, B, là lora_embedding]
+        self.replacements = {}  # tên trọng số base -> tensor đầy đủ
+        for key, tensor in load_file(os.path.join(adapter_dir, ADAPTER_WEIGHTS)).items():
+            name = key[len(PEFT_PREFIX):] if key.startswith(PEFT_PREFIX) else key
+            match = re.fullmatch(r"(.+)\.lora_(embedding_)?([AB])(\.weight)?", name)
+            if match is None:
+                # modules_to_save / base_layer của embedding được lưu nguyên khối, PEFT nạp đè lên base
+                self.replacements[name.replace(".base_layer.", ".")] = tensor
+                continue
+            module, embedding, side = match.group(1), match.group(2), match.group(3)
+            # Như autocast_adapter_dtype của PEFT: adapter bf16 / fp16 được nâng lên fp32 khi nạp
+            if tensor.dtype in (torch.float16, torch.bfloat16):
+                tensor = tensor.float()
+            pair = self.pairs.setdefault(f"{module}.weight", [None, None, bool(embedding)])
+            pair[0 if side == "A" else 1] = tensor
+
+        for name, (lora_a, lora_b, _) in self.pairs.items():
+            if lora_a is None or lora_b is None:
+                raise ValueError(f"Adapter thiếu lora_A hoặc lora_B cho {name}")
+
+    def scaling(self, name):
+        module = name[: -len(".weight")]
+        rank = self.pairs[name][0].shape[0]
+        alpha = _pattern_value(self.config.get("alpha_pattern") or {}, module, self.config["lora_alpha"])
+        if self.config.get("use_rslora"):
+            return alpha / math.sqrt(rank)
+        return alpha / rank
+
+    def apply(self, name, weight):
+        """Trả về `weight` (đã ép dtype) sau khi thay thế / cộng delta; sửa tại chỗ nếu có thể."""
+        if name in self.replacements:
+            weight = self.replacements[name].to(weight.dtype)
+        if name in self.pairs:
+            lora_a, lora_b, embedding = self.pairs[name]
+            # Cùng thứ tự phép tính với LoraLayer.get_delta_weight + merge(safe_merge=False) của PEFT
+            delta = lora_b @ lora_a
+            if embedding or self.config.get("fan_in_fan_out"):
+                delta = delta.T
+            delta = delta * self.scaling(name)
+            if embedding:
+                # lora.Embedding.merge ép delta về dtype của trọng số trước khi cộng, lora.Linear thì không
+                delta = delta.to(weight.dtype)
+            weight += delta
+        return weight
+
+
+def _pattern_value(patterns, module, default):
+    # Giống peft.utils.other.get_pattern_key: khóa pattern khớp với phần cuối tên module
+    for pattern, value in patterns.items():
+        if re.match(rf"(.*\.)?({pattern})$", module):
+            return value
+    return default
+
+
+def resolve_base(base):
+    """Thư mục local giữ nguyên; repo id trên Hub thì tải safetensors + config + tokenizer (không tải .bin)."""
+    if os.path.isdir(base):
+        return base
+    from huggingface_hub import snapshot_download
+    return snapshot_download(base, allow_patterns=["*.safetensors", *(f"*{suffix}" for suffix in COPY_SUFFIXES)])
+
+
+def _base_shards(base_dir):
+    index_path = os.path.join(base_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        return sorted(set(index["weight_map"].values())), index
+    if os.path.exists(os.path.join(base_dir, "model.safetensors")):
+        return ["model.safetensors"], None
+    raise FileNotFoundError(f"Không thấy model.safetensors hoặc {INDEX_FILE} trong {base_dir}")
+
+
+def _output_dtype(dtype_name, dtype):
+    # from_pretrained(torch_dtype=...) chỉ ép các tensor số thực
+    if dtype is not None and dtype_name in _FLOAT_NAMES:
+        return dtype
+    return _TORCH_DTYPES[dtype_name]
+
+
+def _merge_shard(src_path, dst_path, lora, dtype):
+    """Ghi header trước (dtype / shape đã biết từ header của base), sau đó từng tensor một."""
+    with safe_open(src_path, framework="pt") as src:
+        names = list(src.keys())
+        header = {"__metadata__": src.metadata() or {"format": "pt"}}
+        out_dtypes = {}
+        offset = 0
+        for name in names:
+            tensor_slice = src.get_slice(name)
+            shape = tensor_slice.get_shape()
+            out_dtypes[name] = _output_dtype(tensor_slice.get_dtype(), dtype)
+            nbytes = math.prod(shape) * out_dtypes[name].itemsize
+            header[name] = {"dtype": SAFETENSORS_DTYPES[out_dtypes[name]], "shape": shape, "data_offsets": [offset, offset + nbytes]}
+            offset += nbytes
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        # Header được đệm bằng dấu cách cho dữ liệu bắt đầu ở bội số của 8 byte, như safetensors.save_file
+        header_bytes += b" " * (-len(header_bytes) % 8)
+
+        merged = []
+        tmp_path = f"{dst_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name in names:
+                weight = src.get_tensor(name).to(out_dtypes[name])
+                if name in lora.pairs or name in lora.replacements:
+                    weight = lora.apply(name, weight)
+                    merged.append(name)
+                f.write(weight.contiguous().reshape(-1).view(torch.uint8).numpy())
+                del weight
+    os.replace(tmp_path, dst_path)
+    return merged, offset
+
+
+def merge_lora_streaming(base, adapter_dir, output_dir, dtype="bfloat16"):
+    """Gộp adapter ở `adapter_dir` vào base (thư mục hoặc repo id) và ghi model đầy đủ vào `output_dir`.
+
+    Giữ nguyên cách chia shard của base. Trả về dict thống kê (số tensor đã gộp, kích thước, RAM đỉnh).
+    """
+    start = time.perf_counter()
+    dtype = DTYPES[dtype] if isinstance(dtype, str) else dtype
+    base_dir = resolve_base(base)
+    lora = LoraWeights(adapter_dir)
+    shards, index = _base_shards(base_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    merged = []
+    total_size = 0
+    for i, shard in enumerate(shards, 1):
+        shard_start = time.perf_counter()
+        shard_merged, shard_size = _merge_shard(
+            os.path.join(base_dir, shard), os.path.join(output_dir, shard), lora, dtype)
+        merged.extend(shard_merged)
+        total_size += shard_size
+        print(f"[lora_merge] {i}/{len(shards)} {shard}: gộp {len(shard_merged)} tensor, "
+              f"{shard_size / 2**30:.2f} GB, {time.perf_counter() - shard_start:.1f}s")
+
+    missing = sorted((set(lora.pairs) | set(lora.replacements)) - set(merged))
+    if missing:
+        raise ValueError(f"Không tìm thấy trong base model các tensor của adapter: {missing[:5]}")
+
+    if index is not None:
+        index = {**index, "metadata": {**index.get("metadata", {}), "total_size": total_size}}
+        with open(os.path.join(output_dir, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+    for name in os.listdir(base_dir):
+        if name.endswith(COPY_SUFFIXES) and name != INDEX_FILE:
+            shutil.copy(os.path.join(base_dir, name), os.path.join(output_dir, name))
+    if dtype is not None:
+        # Như save_pretrained sau from_pretrained(torch_dtype=...): config ghi dtype mới
+        config_path = os.path.join(output_dir, "config.json")
+        with open(config_path) as f:
+            model_config = json.load(f)
+        model_config["dtype"] = str(dtype).replace("torch.", "")
+        model_config.pop("torch_dtype", None)
+        with open(config_path, "w") as f:
+            json.dump(model_config, f, indent=2)
+
+    return {
+        "merged_tensors": len(merged),
+        "shards": len(shards),
+        "total_gb": round(total_size / 2**30, 3),
+        "seconds": round(time.perf_counter() - start, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gộp LoRA vào base model từng tensor một (RAM thấp)")
+    parser.add_argument("--base", required=True, help="Thư mục hoặc repo id của base model 16-bit (không phải bnb-4bit)")
+    parser.add_argument("--adapter", required=True, help="Thư mục adapter (adapter_config.json + adapter_model.safetensors)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--dtype", default="bfloat16", choices=sorted(DTYPES))
+    args = parser.parse_args()
+    stats = merge_lora_streaming(args.base, args.adapter, args.output, args.dtype)
+    print(f"[lora_merge] Xong: {stats}")
+
+
+if __name__ == "__main__":
+    main()
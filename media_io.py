@@ -0,0 +1,64 @@
+import binascii
+import io
+import os
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisper / faster-whisper đều làm việc ở 16 kHz mono
+
+
+def b64decode(data):
+    # a2b_base64 đọc thẳng chuỗi ASCII, không cần .encode() tạo thêm một bản sao như base64.b64decode
+    return binascii.a2b_base64(data)
+
+
+def b64encode(data):
+    return binascii.b2a_base64(data, newline=False).decode("ascii")
+
+
+def _decode_pcm_wav(audio_bytes, sample_rate):
+    # Đường nhanh: WAV PCM 16-bit đúng sample rate thì đọc thẳng bằng NumPy, không cần ffmpeg
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as wav:
+            if wav.getsampwidth() != 2 or wav.getframerate() != sample_rate:
+                return None
+            channels = wav.getnchannels()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    audio = np.frombuffer(frames, dtype=np.int16)
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return audio.astype(np.float32) / 32768.0
+
+
+def _ffmpeg_decode(source, sample_rate, input_bytes=None):
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", source,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-",
+    ]
+    result = subprocess.run(cmd, input=input_bytes, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio(audio_bytes, sample_rate=SAMPLE_RATE):
+    """Giải mã bytes âm thanh (wav/mp3/ogg/webm/...) thành mảng float32 mono, không qua file tạm."""
+    audio = _decode_pcm_wav(audio_bytes, sample_rate)
+    if audio is not None:
+        return audio
+
+    try:
+        return _ffmpeg_decode("pipe:0", sample_rate, input_bytes=audio_bytes)
+    except subprocess.CalledProcessError:
+        # Một số container (mp4/m4a có moov atom ở cuối file) bắt buộc phải seek được,
+        # không đọc được qua pipe: chỉ riêng trường hợp này mới ghi ra file tạm.
+        with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as temp_audio:
+            temp_audio.write(audio_bytes)
+        try:
+            return _ffmpeg_decode(temp_audio.name, sample_rate)
+        finally:
+            os.remove(temp_audio.name)
@@ -14,28 +14,44 @@ hf_repo_id = "phgrouptechs/Denglish-8B-Instruct"
 # BƯỚC QUAN TRỌNG NHẤT: ĐIỀN BASE MODEL 16-BIT
 # ==========================================
 # Nếu lúc train bạn dùng mô hình 4-bit (vd: "unsloth/llama-3-8b-Instruct-bnb-4bit")
-# Thì ở đây bạn BẮT BUỘC phải đổi tên thành bản gốc (chưa nén) của nó.
+# Thì ở `merge.base_model_id` (config.yaml) bạn BẮT BUỘC phải đặt bản gốc (chưa nén) của nó.
 # Ví dụ: "meta-llama/Meta-Llama-3-8B-Instruct" hoặc "NousResearch/Meta-Llama-3-8B-Instruct"
 
-base_model_16bit_id = "unsloth/llama-3-8b-Instruct" 
-
-print(f"1. Đang tải Bản gốc 16-bit: {base_model_16bit_id}...")
-tokenizer = AutoTokenizer.from_pretrained(base_model_16bit_id)
-
-# Tải bản 16-bit lên CPU để gộp (không bị lỗi 4-bit nữa)
-base_model = AutoModelForCausalLM.from_pretrained(
-    base_model_16bit_id,
-    torch_dtype=torch.bfloat16,
-    device_map="cpu", 
-)
-
-print(f"2. Đang đọc LoRA từ {outdir_path} và Gộp (Merge)...")
-# Đắp LoRA lên bản 16-bit
-model = PeftModel.from_pretrained(base_model, outdir_path)
-merged_model = model.merge_and_unload()
-
-print(f"3. Đang đẩy mô hình HOÀN CHỈNH lên {hf_repo_id}...")
-merged_model.push_to_hub(hf_repo_id)
-tokenizer.push_to_hub(hf_repo_id)
-
-print("--- Hoàn tất việc gộp và đẩy model! ---")
\ No newline at end of file
+merge_config = config.get("merge", {})
+base_model_16bit_id = merge_config.get("base_model_id", "unsloth/llama-3-8b-Instruct")
+
+if merge_config.get("streaming", True):
+    # Gộp từng tensor một từ các shard safetensors: không cần nạp cả model 16 GB vào RAM
+    from huggingface_hub import HfApi
+    from lora_merge import merge_lora_streaming
+
+    merged_dir = merge_config.get("output_dir", "./merged_model")
+    print(f"1-2. Đang gộp LoRA từ {outdir_path} vào {base_model_16bit_id} (streaming) -> {merged_dir}...")
+    stats = merge_lora_streaming(base_model_16bit_id, outdir_path, merged_dir, merge_config.get("dtype", "bfloat16"))
+    print(f"   {stats}")
+
+    print(f"3. Đang đẩy mô hình HOÀN CHỈNH lên {hf_repo_id}...")
+    api = HfApi()
+    api.create_repo(hf_repo_id, exist_ok=True)
+    api.upload_folder(folder_path=merged_dir, repo_id=hf_repo_id, commit_message="Upload merged model")
+else:
+    print(f"1. Đang tải Bản gốc 16-bit: {base_model_16bit_id}...")
+    tokenizer = AutoTokenizer.from_pretrained(base_model_16bit_id)
+
+    # Tải bản 16-bit lên CPU để gộp (không bị lỗi 4-bit nữa)
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_16bit_id,
+        torch_dtype=torch.bfloat16,
+        device_map="cpu", 
+    )
+
+    print(f"2. Đang đọc LoRA từ {outdir_path} và Gộp (Merge)...")
+    # Đắp LoRA lên bản 16-bit
+    model = PeftModel.from_pretrained(base_model, outdir_path)
+    merged_model = model.merge_and_unload()
+
+    print(f"3. Đang đẩy mô hình HOÀN CHỈNH lên {hf_repo_id}...")
+    merged_model.push_to_hub(hf_repo_id)
+    tokenizer.push_to_hub(hf_repo_id)
+
+print("--- Hoàn tất việc gộp và đẩy model! ---")
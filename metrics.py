@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Khoảng bucket (giây) cho từng bước: từ base64 (vài ms) tới LLM / Whisper trên bản ghi dài
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2.5, 5, 10, 20, 40, 60, 80, 120, 200)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+# Các số đếm trong khối timings của response (không phải thời gian)
+LLM_COUNTS = ("prompt_tokens", "generated_tokens", "prefix_tokens_reused", "decode_tokens_per_s",
+              "draft_tokens", "accepted_tokens", "acceptance_rate")
+
+
+class JobTimings:
+    """Thời gian (ms) từng bước và số token của một job, đo bằng time.perf_counter."""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def add_llm_stats(self, stats):
+        # stats của GenerationStream: prefill_ms / decode_ms là thời gian, còn lại là số đếm
+        for name in ("prefill", "decode"):
+            if stats.get(f"{name}_ms") is not None:
+                self.stages[name] = stats[f"{name}_ms"]
+        for name in LLM_COUNTS:
+            if stats.get(name) is not None:
+                self.counts[name] = stats[name]
+
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def as_dict(self):
+        result = {f"{name}_ms": round(ms, 1) for name, ms in self.stages.items()}
+        result.update(self.counts)
+        result["total_ms"] = round(self.total_ms(), 1)
+        return result
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}  # labels -> [counts theo bucket..., +Inf], sum
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self._series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items()))
+        return lines
+
+
+class MetricsRegistry:
+    """Gom khối timings của các job thành histogram dạng Prometheus text (không cần prometheus_client).
+
+    Đọc qua endpoint HTTP (`serve`) hoặc file .prom ghi định kỳ (`textfile`, cho node_exporter / log sink).
+    """
+
+    def __init__(self, prefix="denglish", textfile=None, flush_every=50):
+        self.textfile = textfile
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._observed = 0
+        self.stage_seconds = Histogram(
+            f"{prefix}_stage_duration_seconds", "Thời gian từng bước của job", STAGE_BUCKETS, ("stage", "input_type"))
+        self.job_seconds = Histogram(
+            f"{prefix}_job_duration_seconds", "Thời gian xử lý cả job", STAGE_BUCKETS, ("handler", "input_type"))
+        self.prompt_tokens = Histogram(
+            f"{prefix}_prompt_tokens", "Số token prompt mỗi lần sinh", TOKEN_BUCKETS, ("input_type",))
+        self.generated_tokens = Histogram(
+            f"{prefix}_generated_tokens", "Số token sinh ra mỗi lần sinh", TOKEN_BUCKETS, ("input_type",))
+        self.decode_rate = Histogram(
+            f"{prefix}_decode_tokens_per_second", "Tốc độ decode (không tính prefill)", RATE_BUCKETS, ("input_type",))
+        self.acceptance = Histogram(
+            f"{prefix}_speculative_acceptance_ratio", "Tỉ lệ token đoán trước được chấp nhận", RATIO_BUCKETS, ("input_type",))
+        self.residency_seconds = Histogram(
+            f"{prefix}_model_residency_seconds", "Thời gian nạp / đẩy ra / đưa lại model trên GPU", STAGE_BUCKETS,
+            ("model", "action"))
+        self.jobs = Counter(f"{prefix}_jobs_total", "Số job theo kết quả", ("handler", "input_type", "status"))
+        self.cache_lookups = Counter(
+            f"{prefix}_response_cache_lookups_total", "Số lần tra response cache theo kết quả", ("result",))
+        self._metrics = (
+            self.stage_seconds, self.job_seconds, self.prompt_tokens, self.generated_tokens, self.decode_rate,
+            self.acceptance, self.residency_seconds, self.jobs, self.cache_lookups)
+
+    @classmethod
+    def from_config(cls, metrics_config):
+        return cls(
+            textfile=metrics_config.get("textfile") or None,
+            flush_every=metrics_config.get("flush_every", 50),
+        )
+
+    def observe_job(self, handler, input_type, status, timings):
+        input_type = input_type or "unknown"
+        with self._lock:
+            for stage, ms in timings.stages.items():
+                self.stage_seconds.observe(ms / 1000, stage=stage, input_type=input_type)
+            self.job_seconds.observe(timings.total_ms() / 1000, handler=handler, input_type=input_type)
+            counts = timings.counts
+            if counts.get("prompt_tokens") is not None:
+                self.prompt_tokens.observe(counts["prompt_tokens"], input_type=input_type)
+            if counts.get("generated_tokens") is not None:
+                self.generated_tokens.observe(counts["generated_tokens"], input_type=input_type)
+            if counts.get("decode_tokens_per_s") is not None:
+                self.decode_rate.observe(counts["decode_tokens_per_s"], input_type=input_type)
+            if counts.get("acceptance_rate") is not None:
+                self.acceptance.observe(counts["acceptance_rate"], input_type=input_type)
+            self.jobs.inc(handler=handler, input_type=input_type, status=status)
+            self._observed += 1
+            flush = self.textfile and self.flush_every and self._observed % self.flush_every == 0
+        if flush:
+            self.write_textfile()
+
+    def observe_residency(self, model, action, seconds):
+        """Dùng làm `on_event` của ResidencyManager."""
+        with self._lock:
+            self.residency_seconds.observe(seconds, model=model, action=action)
+
+    def observe_cache_lookup(self, result):
+        """Dùng làm `on_lookup` của ResponseCache: result là "exact", "near" hoặc "miss"."""
+        with self._lock:
+            self.cache_lookups.inc(result=result)
+
+    def render(self):
+        with self._lock:
+            lines = [line for metric in self._metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        # Ghi file tạm rồi đổi tên: bên đọc không bao giờ thấy file ghi dở
+        tmp_path = f"{self.textfile}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.textfile)
+
+    def serve(self, port, host="0.0.0.0"):
+        """Mở endpoint /metrics trong thread nền; trả về server (gọi shutdown() để dừng)."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[metrics] Prometheus endpoint: http://{host}:{server.server_port}/metrics")
+        return server
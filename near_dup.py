@@ -0,0 +1,104 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+# Số nguyên tố Mersenne 2^61 - 1: a * x + b với x, a, b < 2^32 không tràn uint64
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def canonical_text(text):
+    """Dạng so khớp gần đúng: bỏ dấu câu, không phân biệt hoa thường, gộp khoảng trắng."""
+    text = unicodedata.normalize("NFC", text).casefold()
+    return re.sub(r"\s+", " ", _PUNCTUATION.sub(" ", text)).strip()
+
+
+def shingle_hashes(text, n=3):
+    """Hash 32 bit của mọi n-gram ký tự (sau canonical_text), tính cuốn chiếu bằng NumPy."""
+    codes = np.frombuffer(canonical_text(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    n = min(n, len(codes))
+    count = len(codes) - n + 1
+    # FNV-1a trên các code point của n-gram; phép nhân uint64 tự tràn (mod 2^64)
+    hashes = np.full(count, 0xCBF29CE484222325, dtype=np.uint64)
+    for k in range(n):
+        hashes ^= codes[k:k + count]
+        hashes *= np.uint64(0x100000001B3)
+    return (hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+
+
+class MinHasher:
+    """MinHash trên tập n-gram ký tự: xác suất hai chữ ký trùng ở một vị trí = độ tương đồng Jaccard."""
+
+    def __init__(self, num_perm=64, ngram=3, seed=1):
+        self.num_perm = num_perm
+        self.ngram = ngram
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.unique(shingle_hashes(text, self.ngram))
+        if not len(hashes):
+            return np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+        # Ma trận (num_perm, số n-gram): mọi hoán vị được tính cùng lúc
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def jaccard_estimate(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """Chia chữ ký thành `bands` dải; hai văn bản trùng trọn một dải là ứng viên gần trùng."""
+
+    def __init__(self, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) phải chia hết cho bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = [defaultdict(set) for _ in range(bands)]
+        self._signatures = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key):
+        return key in self._signatures
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, signature):
+        if key in self._signatures:
+            self.remove(key)
+        self._signatures[key] = signature
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket[band_key].add(key)
+
+    def remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            members = bucket.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del bucket[band_key]
+
+    def query(self, signature, threshold=0.0):
+        """Trả về list (key, độ tương đồng ước lượng) của các ứng viên >= threshold, giống nhất đứng đầu."""
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        if not candidates:
+            return []
+        keys = list(candidates)
+        # So sánh mọi ứng viên trong một phép toán: tỉ lệ vị trí trùng của từng cặp chữ ký
+        scores = (np.stack([self._signatures[key] for key in keys]) == signature).mean(axis=1)
+        order = np.argsort(-scores, kind="stable")
+        return [(keys[i], float(scores[i])) for i in order if scores[i] >= threshold]
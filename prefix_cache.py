@@ -0,0 +1,137 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers import LogitsProcessor
+
+
+def adapter_version(adapter_path):
+    """Dấu vân tay của adapter/checkpoint: đổi file cấu hình hoặc trọng số là đổi version."""
+    if adapter_path and os.path.isfile(adapter_path):
+        # Checkpoint một file (vd: GGUF)
+        stat = os.stat(adapter_path)
+        return hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+    if not adapter_path or not os.path.isdir(adapter_path):
+        return str(adapter_path)
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(adapter_path)):
+        if name.endswith((".json", ".safetensors", ".bin")):
+            stat = os.stat(os.path.join(adapter_path, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+class PrefillTimer(LogitsProcessor):
+    """Được gọi ngay sau mỗi bước forward; lần gọi đầu tiên đánh dấu lúc prefill xong."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.prefill_seconds = None
+
+    def __call__(self, input_ids, scores):
+        if self.prefill_seconds is None:
+            self.prefill_seconds = time.perf_counter() - self.start
+        return scores
+
+
+class PrefixCache:
+    """Lưu KV cache của phần đầu prompt cố định (persona + yêu cầu), dùng lại giữa các request.
+
+    Khóa gồm (lang, input_type, template_hash, adapter); adapter version được giữ riêng,
+    `set_adapter_version` với version khác thì toàn bộ cache bị xóa (handler gọi khi AdapterRegistry
+    nạp lại adapter từ file đã đổi). `adapter` là tên LoRA khi chạy nhiều adapter trên một base
+    (AdapterRegistry): KV của cùng prefix khác nhau theo adapter.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=16, adapter_version=None, log_every=0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.adapter_version = adapter_version
+        self.log_every = log_every
+
+        self._entries = OrderedDict()  # key -> (prefix_ids, past_key_values)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.tokens_saved = 0
+        self.prefix_build_seconds = 0.0
+        self.prefill_seconds = 0.0
+        self.prefill_count = 0
+
+    def set_adapter_version(self, version):
+        if version != self.adapter_version:
+            self.invalidate()
+            self.adapter_version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _build(self, static_prefix, adapter=None):
+        prefix_ids = self.tokenizer(static_prefix, return_tensors="pt").input_ids
+        # Bỏ token cuối: token ở ranh giới có thể bị BPE gộp với phần nội dung phía sau
+        prefix_ids = prefix_ids[:, :-1].to(self.model.device)
+        adapter_kwargs = {"adapter_names": [adapter]} if adapter is not None else {}
+        start = time.perf_counter()
+        with torch.inference_mode():
+            outputs = self.model(input_ids=prefix_ids, use_cache=True, **adapter_kwargs)
+        self.prefix_build_seconds += time.perf_counter() - start
+        self.builds += 1
+        return prefix_ids[0].tolist(), outputs.past_key_values
+
+    def _lookup(self, key, static_prefix, adapter=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._build(static_prefix, adapter)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def generate_inputs(self, prompt, static_prefix, lang, input_type, template_hash, adapter=None):
+        """Trả về kwargs cho model.generate, kèm past_key_values của prefix nếu khớp."""
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.model.device)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+        prefix_ids, past_key_values = self._lookup((lang, input_type, template_hash, adapter), static_prefix, adapter)
+        n = len(prefix_ids)
+        if n == 0 or n >= input_ids.shape[1] or input_ids[0, :n].tolist() != prefix_ids:
+            self.misses += 1
+            return inputs, 0
+
+        self.hits += 1
+        self.tokens_saved += n
+        # generate ghi thêm vào cache, nên mỗi request dùng một bản sao của KV prefix
+        inputs["past_key_values"] = copy.deepcopy(past_key_values)
+        return inputs, n
+
+    def record_prefill(self, seconds):
+        if seconds is None:
+            return
+        self.prefill_seconds += seconds
+        self.prefill_count += 1
+        if self.log_every and self.prefill_count % self.log_every == 0:
+            print(f"[prefix-cache] {self.stats()}")
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "builds": self.builds,
+            "tokens_saved": self.tokens_saved,
+            "prefix_build_ms": round(self.prefix_build_seconds * 1000, 1),
+            "avg_prefill_ms": round(self.prefill_seconds / self.prefill_count * 1000, 1) if self.prefill_count else None,
+        }
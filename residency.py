@@ -0,0 +1,334 @@
+"""Quản lý model nằm trên GPU của worker (LLM, Whisper, OCR) theo một ngân sách bộ nhớ.
+
+Mỗi model có dung lượng trên device (đo khi nạp hoặc khai báo `footprint_mb`). Cần chỗ cho model khác thì
+model rảnh dùng lâu nhất bị đẩy ra theo `policy`:
+- offload: trọng số chuyển sang RAM (pinned memory khi có CUDA), đưa lại GPU nhanh hơn nạp từ ổ cứng.
+- unload: giải phóng hẳn, lần sau nạp lại từ đầu.
+- keep: không bao giờ bị đẩy ra.
+Model đang được job dùng (`acquire` / `use`) không bao giờ bị đẩy ra. Biết loại job (audio / ảnh / text) là
+gọi `prefetch` để đưa model cần dùng lên GPU trên thread nền trong lúc job còn giải mã input.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import torch
+
+RESIDENCY_POLICIES = ("offload", "unload", "keep")
+
+MB = 1024 * 1024
+
+
+def _device_free_bytes(device):
+    if device.startswith("cuda") and torch.cuda.is_available():
+        return torch.cuda.mem_get_info()[0]
+    return None
+
+
+class Resident:
+    """Một model do ResidencyManager quản lý. Lớp con cài _load / _offload / _restore / _unload."""
+
+    def __init__(self, name, device="cuda", policy="offload", footprint_bytes=0):
+        if policy not in RESIDENCY_POLICIES:
+            raise ValueError(f"residency.models.{name}.policy phải là một trong {RESIDENCY_POLICIES}, không phải {policy!r}")
+        self.name = name
+        self.device = device
+        self.policy = policy
+        self.footprint_bytes = footprint_bytes
+        self.state = "unloaded"  # unloaded | offloaded | resident
+        self.obj = None
+        self.in_use = 0
+        self.last_used = 0.0
+
+    def bring_in(self):
+        """Đưa model lên device; trả về tên hành động để ghi log."""
+        if self.state == "offloaded":
+            self._restore()
+            action = "swap_in"
+        else:
+            free_before = _device_free_bytes(self.device)
+            self.obj = self._load()
+            action = "load"
+            if not self.footprint_bytes and free_before is not None:
+                # Không đọc được kích thước từ model (vd: CTranslate2): đo bằng bộ nhớ GPU còn trống
+                self.footprint_bytes = max(free_before - _device_free_bytes(self.device), 0)
+        self.state = "resident"
+        return action
+
+    def evict(self):
+        if self.policy == "offload":
+            self._offload()
+            self.state = "offloaded"
+        else:
+            self._unload()
+            self.obj = None
+            self.state = "unloaded"
+        return self.state
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _offload(self):
+        # Model không có cách đẩy sang RAM riêng thì giải phóng hẳn
+        self._unload()
+
+    def _restore(self):
+        self.obj = self._load()
+
+    def _unload(self):
+        pass
+
+
+class TorchResident(Resident):
+    """Model PyTorch đã nạp sẵn (LLM). Offload: chép tham số / buffer sang RAM pinned, giải phóng VRAM."""
+
+    def __init__(self, name, model, policy="offload"):
+        if policy == "unload":
+            raise ValueError(f"residency.models.{name}.policy = unload không dùng được cho model nạp sẵn, dùng offload")
+        super().__init__(name, device=str(model.device), policy=policy,
+                         footprint_bytes=sum(t.numel() * t.element_size() for t in self._tensors(model)))
+        self.obj = model
+        self.state = "resident"
+        self._host = {}  # tensor -> bản sao trên RAM, giữ lại giữa các lần offload để khỏi cấp phát lại
+
+    @staticmethod
+    def _tensors(model):
+        # Trọng số dùng chung (embedding / lm_head) chỉ tính một lần
+        return list(dict.fromkeys([*model.parameters(), *model.buffers()]))
+
+    def _offload(self):
+        pin = torch.cuda.is_available()
+        tensors = self._tensors(self.obj)
+        # Adapter LoRA có thể được nạp / xóa giữa hai lần offload: bỏ bản sao của tensor không còn trong model
+        self._host = {t: self._host[t] for t in tensors if t in self._host and self._host[t].shape == t.shape}
+        for tensor in tensors:
+            host = self._host.get(tensor)
+            if host is None:
+                host = self._host[tensor] = torch.empty(
+                    tensor.shape, dtype=tensor.dtype, device="cpu", pin_memory=pin)
+            host.copy_(tensor.data, non_blocking=pin)
+        if pin:
+            torch.cuda.synchronize()
+        for tensor in tensors:
+            tensor.data = self._host[tensor]
+        if pin:
+            torch.cuda.empty_cache()
+
+    def _restore(self):
+        for tensor in self._tensors(self.obj):
+            host = self._host.get(tensor)
+            tensor.data = (host if host is not None else tensor.data).to(self.device, non_blocking=True)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+
+class LazyResident(Resident):
+    """Model nạp bằng hàm `load`; `offload` / `restore` (nếu có) nhận object đã nạp, `unload` để đóng nó."""
+
+    def __init__(self, name, load, device="cuda", policy="offload", footprint_bytes=0,
+                 offload=None, restore=None, unload=None):
+        super().__init__(name, device=device, policy=policy, footprint_bytes=footprint_bytes)
+        self._load_fn = load
+        self._offload_fn = offload
+        self._restore_fn = restore
+        self._unload_fn = unload
+
+    def _load(self):
+        obj = self._load_fn()
+        self.device = str(getattr(obj, "device", self.device))
+        return obj
+
+    def _offload(self):
+        if self._offload_fn is None:
+            return self._unload()
+        self._offload_fn(self.obj)
+
+    def _restore(self):
+        if self._restore_fn is None:
+            self.obj = self._load()
+            return
+        self._restore_fn(self.obj)
+
+    def _unload(self):
+        if self._unload_fn is not None:
+            self._unload_fn(self.obj)
+
+
+class ResidencyManager:
+    """Giữ tổng dung lượng model trên GPU dưới `budget_bytes`, đẩy model rảnh ra theo LRU.
+
+    Mọi lần nạp / đẩy ra / đưa lại chạy tuần tự trên một thread riêng, nên không có hai thao tác cùng giành
+    bộ nhớ. Không đủ chỗ vì model khác đang được dùng thì `acquire` chờ tối đa `wait_timeout` giây, quá hạn
+    thì nạp vượt ngân sách (có cảnh báo) thay vì để job treo.
+    """
+
+    def __init__(self, budget_bytes, idle_seconds=0, wait_timeout=30, on_event=None, log=True, budget_device="cuda"):
+        self.budget_bytes = budget_bytes
+        self.budget_device = budget_device  # chỉ model nằm trên loại device này bị tính vào ngân sách
+        self.idle_seconds = idle_seconds
+        self.wait_timeout = wait_timeout
+        self.on_event = on_event  # on_event(model, action, seconds), vd: ghi histogram Prometheus
+        self.log = log
+
+        self._models = {}
+        self._lock = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="residency")
+        self.events = {}  # (model, action) -> [số lần, tổng giây]
+        if idle_seconds:
+            threading.Thread(target=self._idle_loop, name="residency-idle", daemon=True).start()
+
+    @classmethod
+    def from_config(cls, residency_config, on_event=None):
+        return cls(
+            budget_bytes=int(residency_config.get("device_budget_mb", 20000) * MB),
+            idle_seconds=residency_config.get("idle_seconds", 0),
+            wait_timeout=residency_config.get("wait_timeout_seconds", 30),
+            on_event=on_event,
+            log=residency_config.get("log", True),
+        )
+
+    def register(self, resident):
+        self._models[resident.name] = resident
+        resident.last_used = time.monotonic()
+        return resident
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def _counted(self, resident):
+        return resident.device.startswith(self.budget_device)
+
+    def _device_used(self):
+        return sum(r.footprint_bytes for r in self._models.values() if r.state == "resident" and self._counted(r))
+
+    def _record(self, name, action, seconds):
+        with self._lock:
+            event = self.events.setdefault((name, action), [0, 0.0])
+            event[0] += 1
+            event[1] += seconds
+        if self.log:
+            print(f"[residency] {action} {name}: {seconds * 1000:.0f} ms "
+                  f"({self.budget_device} {self._device_used() / MB:.0f}/{self.budget_bytes / MB:.0f} MB)")
+        if self.on_event is not None:
+            self.on_event(name, action, seconds)
+
+    def _evict(self, resident):
+        start = time.perf_counter()
+        state = resident.evict()
+        self._record(resident.name, "offload" if state == "offloaded" else "unload", time.perf_counter() - start)
+
+    def _make_room(self, needed, keep=()):
+        """Đẩy model rảnh (dùng lâu nhất trước) ra tới khi đủ `needed` byte; False nếu không đủ chỗ."""
+        with self._lock:
+            candidates = sorted(
+                (r for r in self._models.values()
+                 if r.state == "resident" and self._counted(r) and r.policy != "keep"
+                 and not r.in_use and r.name not in keep),
+                key=lambda r: r.last_used)
+        for victim in candidates:
+            if self._device_used() + needed <= self.budget_bytes:
+                break
+            with self._lock:
+                if victim.in_use:  # vừa được acquire trong lúc đang duyệt
+                    continue
+            self._evict(victim)
+        return self._device_used() + needed <= self.budget_bytes
+
+    def _ensure(self, name, keep=(), force=False):
+        # Chỉ chạy trên thread residency
+        resident = self._models[name]
+        if resident.state == "resident":
+            # Lần trước phải nạp vượt ngân sách: đẩy bớt model đã rảnh
+            self._make_room(0, keep={name, *keep})
+            return True
+        needed = resident.footprint_bytes if self._counted(resident) else 0
+        if not self._make_room(needed, keep={name, *keep}) and not force:
+            return False
+        if self._device_used() + needed > self.budget_bytes:
+            print(f"[residency] Cảnh báo: nạp {name} vượt ngân sách {self.budget_device}")
+        start = time.perf_counter()
+        action = resident.bring_in()
+        self._record(name, action, time.perf_counter() - start)
+        # Lần nạp đầu mới biết dung lượng thật: đẩy bớt model khác nếu giờ mới vượt
+        self._make_room(0, keep={name, *keep})
+        return True
+
+    def _prefetch(self, names):
+        for i, name in enumerate(names):
+            if not self._ensure(name, keep=names[:i]):
+                if self.log:
+                    print(f"[residency] Bỏ qua prefetch {name}: chưa đủ chỗ trên GPU")
+                return
+
+    def prefetch(self, *names):
+        """Đưa các model lên GPU trên thread nền (theo thứ tự, model trước không bị model sau đẩy ra)."""
+        names = [name for name in names if name in self._models]
+        if not names:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            for name in names:
+                self._models[name].last_used = now
+        return self._executor.submit(self._prefetch, names)
+
+    def acquire(self, name):
+        """Chờ model lên GPU rồi giữ nó (không bị đẩy ra) tới khi release; trả về object model."""
+        resident = self._models[name]
+        with self._lock:
+            resident.in_use += 1
+            resident.last_used = time.monotonic()
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while not self._executor.submit(self._ensure, name, (), time.monotonic() >= deadline).result():
+                with self._lock:
+                    self._lock.wait(timeout=max(min(deadline - time.monotonic(), 1.0), 0))
+            return resident.obj
+        except BaseException:
+            self.release(name)
+            raise
+
+    def release(self, name):
+        resident = self._models[name]
+        with self._lock:
+            resident.in_use -= 1
+            resident.last_used = time.monotonic()
+            self._lock.notify_all()
+
+    @contextmanager
+    def use(self, name):
+        obj = self.acquire(name)
+        try:
+            yield obj
+        finally:
+            self.release(name)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            # Model trên CPU chỉ bị đẩy ra khi policy = unload (vd: process pool OCR): offload sang RAM không lợi gì
+            idle = [r for r in self._models.values()
+                    if r.state == "resident" and r.policy != "keep" and not r.in_use and r.last_used < cutoff
+                    and (self._counted(r) or r.policy == "unload")]
+        for resident in idle:
+            with self._lock:
+                if resident.in_use or resident.last_used >= cutoff:
+                    continue
+            self._evict(resident)
+
+    def _idle_loop(self):
+        while True:
+            time.sleep(max(self.idle_seconds / 2, 1))
+            self._executor.submit(self._evict_idle).result()
+
+    def stats(self):
+        with self._lock:
+            models = {
+                name: {"state": r.state, "device": r.device, "footprint_mb": round(r.footprint_bytes / MB, 1),
+                       "in_use": r.in_use}
+                for name, r in self._models.items()
+            }
+            events = {f"{name}:{action}": {"count": count, "avg_ms": round(seconds / count * 1000, 1)}
+                      for (name, action), (count, seconds) in self.events.items()}
+        return {"device_used_mb": round(self._device_used() / MB, 1), "budget_mb": round(self.budget_bytes / MB, 1),
+                "models": models, "events": events}
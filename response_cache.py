@@ -0,0 +1,152 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from near_dup import LSHIndex, MinHasher
+from tts_cache import normalize_text
+
+
+class ResponseCache:
+    """Cache kết quả cuối (ai_text + audio) cho các bài nộp trùng nhau, LRU + TTL, nằm trong RAM.
+
+    Khóa chính xác gồm văn bản đã chuẩn hóa, lang, input_type, version model/adapter và tham số sinh.
+    Tùy chọn `near_duplicate`: khi không trùng chính xác, tìm bài gần giống (MinHash n-gram ký tự,
+    bỏ qua hoa thường / dấu câu / khoảng trắng) trong cùng ngữ cảnh (lang, input_type, version, tham số).
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, deterministic=False, model_version=None,
+                 near_duplicate=False, near_threshold=0.9, ngram=3, num_perm=64, bands=16, log_every=0,
+                 on_lookup=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.deterministic = deterministic
+        self.model_version = model_version
+        self.near_threshold = near_threshold
+        self.log_every = log_every
+        self.on_lookup = on_lookup  # on_lookup(result): "exact" | "near" | "miss", vd MetricsRegistry.observe_cache_lookup
+
+        self._entries = OrderedDict()  # key -> (expires_at, context, value)
+        self._lock = threading.Lock()
+        self._hasher = MinHasher(num_perm=num_perm, ngram=ngram) if near_duplicate else None
+        self._bands = bands
+        self._indexes = {}  # context -> LSHIndex
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, cache_config, model_version=None):
+        near_config = cache_config.get("near_duplicate", {})
+        return cls(
+            max_entries=cache_config.get("max_entries", 1024),
+            ttl_seconds=cache_config.get("ttl_seconds", 24 * 3600),
+            deterministic=cache_config.get("deterministic", False),
+            model_version=model_version,
+            near_duplicate=near_config.get("enabled", False),
+            near_threshold=near_config.get("threshold", 0.9),
+            ngram=near_config.get("ngram", 3),
+            num_perm=near_config.get("num_perm", 64),
+            bands=near_config.get("bands", 16),
+            log_every=cache_config.get("log_every", 0),
+        )
+
+    def generation_overrides(self):
+        # Câu trả lời được cache thì phải tái lập được: tắt sampling, giải mã greedy
+        return {"do_sample": False} if self.deterministic else {}
+
+    def _context(self, lang, input_type, generation_params):
+        params = json.dumps(generation_params, sort_keys=True, default=str)
+        payload = f"{self.model_version}\0{lang}\0{input_type}\0{params}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _key(self, context, text):
+        return f"{context}:{hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()}"
+
+    def _remove(self, key):
+        _, context, _ = self._entries.pop(key)
+        index = self._indexes.get(context)
+        if index is not None:
+            index.remove(key)
+            if not len(index):
+                del self._indexes[context]
+
+    def _live_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self._remove(key)
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, text, lang, input_type, generation_params):
+        """Trả về (value, "exact" | "near") hoặc (None, None)."""
+        context = self._context(lang, input_type, generation_params)
+        key = self._key(context, text)
+        signature = self._hasher.signature(text) if self._hasher is not None else None
+        now = time.monotonic()
+
+        value, kind = None, None
+        with self._lock:
+            entry = self._live_entry(key, now)
+            if entry is not None:
+                value, kind = entry[2], "exact"
+                self.hits += 1
+            elif signature is not None and context in self._indexes:
+                for candidate, _ in self._indexes[context].query(signature, self.near_threshold):
+                    entry = self._live_entry(candidate, now)
+                    if entry is not None:
+                        value, kind = entry[2], "near"
+                        self.near_hits += 1
+                        break
+            if kind is None:
+                self.misses += 1
+
+        if self.on_lookup is not None:
+            self.on_lookup(kind or "miss")
+        self._maybe_log()
+        return value, kind
+
+    def put(self, text, lang, input_type, generation_params, value):
+        context = self._context(lang, input_type, generation_params)
+        key = self._key(context, text)
+        signature = self._hasher.signature(text) if self._hasher is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, context, value)
+            if signature is not None:
+                self._indexes.setdefault(context, LSHIndex(len(signature), self._bands)).add(key, signature)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def _maybe_log(self):
+        lookups = self.hits + self.near_hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            print(f"[response-cache] {self.stats()}")
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,290 @@
+"""Phiên hội thoại nhiều lượt: lịch sử tin nhắn + KV cache giữ lại giữa các lượt.
+
+Mỗi lượt mới, backend so token của prompt mới với token đã có trong KV của phiên và chỉ prefill phần
+khác nhau (thường chỉ là tin nhắn mới của học viên). Bộ nhớ bị chặn bởi:
+- LRU trên số phiên (`max_sessions`) và TTL tính từ lượt cuối (`ttl_seconds`);
+- chỉ `max_resident` phiên dùng gần nhất giữ KV trên device; phiên khác (hoặc rảnh quá `offload_idle_seconds`)
+  được chuyển KV sang RAM (`offload: cpu`), ra đĩa (`disk`) hoặc bỏ KV (`none`, lượt sau prefill lại);
+- khi lịch sử vượt `max_context_tokens`, các lượt cũ được model tóm tắt rồi đưa vào system prompt,
+  chỉ giữ nguyên `keep_recent_turns` lượt gần nhất.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+from tutor_prompts import session_system_prompt, summary_messages
+
+SESSION_OFFLOAD_MODES = ("cpu", "disk", "none")
+# Token của template chat cho mỗi tin nhắn (header role, token kết thúc), dùng khi ước lượng độ dài
+_MESSAGE_OVERHEAD_TOKENS = 8
+
+
+def _cache_layers(past_key_values):
+    return [(layer.keys, layer.values) for layer in past_key_values.layers]
+
+
+def _cache_bytes(layers):
+    return sum(keys.numel() * keys.element_size() + values.numel() * values.element_size() for keys, values in layers)
+
+
+def _rebuild_cache(layers, device):
+    from transformers import DynamicCache
+
+    past_key_values = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        past_key_values.update(keys.to(device), values.to(device), layer_idx)
+    return past_key_values
+
+
+def common_prefix_length(cached_ids, input_ids):
+    """Số token đầu giống nhau giữa `cached_ids` (list) và `input_ids` (tensor 1 chiều)."""
+    n = min(len(cached_ids), input_ids.shape[0])
+    if n == 0:
+        return 0
+    cached = torch.tensor(cached_ids[:n], device=input_ids.device)
+    mismatch = (cached != input_ids[:n]).nonzero()
+    return int(mismatch[0, 0]) if mismatch.numel() else n
+
+
+class Session:
+    """Một buổi học: tin nhắn user/assistant (không gồm system), bản tóm tắt và KV của các token đã xử lý."""
+
+    def __init__(self, session_id, store):
+        self.id = session_id
+        self.store = store
+        self.messages = []
+        self.summary = None
+        self.turns = 0
+        self.created_at = self.last_used = time.time()
+
+        # token_ids: các token đã có KV. KV nằm ở đúng một chỗ: device, RAM (list (keys, values)) hoặc file
+        self.token_ids = []
+        self.past_key_values = None
+        self.offloaded = None
+        self.offload_path = None
+
+    def checkout(self):
+        """Lấy KV (trên device) và token tương ứng để sinh lượt mới; trong lúc sinh phiên không giữ KV."""
+        return self.store.checkout(self)
+
+    def checkin(self, token_ids, past_key_values):
+        self.store.checkin(self, token_ids, past_key_values)
+
+
+class SessionStore:
+    def __init__(self, model=None, max_sessions=256, ttl_seconds=1800, max_resident=8, offload_idle_seconds=120,
+                 offload="cpu", offload_dir="/tmp/denglish-sessions", max_context_tokens=3072, keep_recent_turns=2,
+                 summarize=True, summary_max_new_tokens=160, log_every=0):
+        if offload not in SESSION_OFFLOAD_MODES:
+            raise ValueError(f"sessions.offload phải là một trong {SESSION_OFFLOAD_MODES}, không phải {offload!r}")
+        # model = None (llama.cpp): chỉ giữ lịch sử, llama.cpp tự dùng lại KV của phần prompt trùng lần gọi trước
+        self.model = model
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_resident = max_resident
+        self.offload_idle_seconds = offload_idle_seconds
+        self.offload = offload
+        self.offload_dir = offload_dir
+        self.max_context_tokens = max_context_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summarize = summarize
+        self.summary_max_new_tokens = summary_max_new_tokens
+        self.log_every = log_every
+
+        self._sessions = OrderedDict()  # session_id -> Session, dùng gần nhất ở cuối
+        self._lock = threading.RLock()
+        if offload == "disk":
+            os.makedirs(offload_dir, exist_ok=True)
+
+        self.turns = 0
+        self.tokens_reused = 0
+        self.tokens_prefilled = 0
+        self.compactions = 0
+        self.expired = 0
+        self.evictions = 0
+        self.offloads = 0
+        self.restores = 0
+
+    @classmethod
+    def from_config(cls, sessions_config, model=None):
+        return cls(
+            model=model,
+            max_sessions=sessions_config.get("max_sessions", 256),
+            ttl_seconds=sessions_config.get("ttl_seconds", 1800),
+            max_resident=sessions_config.get("max_resident", 8),
+            offload_idle_seconds=sessions_config.get("offload_idle_seconds", 120),
+            offload=sessions_config.get("offload", "cpu"),
+            offload_dir=sessions_config.get("offload_dir", "/tmp/denglish-sessions"),
+            max_context_tokens=sessions_config.get("max_context_tokens", 3072),
+            keep_recent_turns=sessions_config.get("keep_recent_turns", 2),
+            summarize=sessions_config.get("summarize", True),
+            summary_max_new_tokens=sessions_config.get("summary_max_new_tokens", 160),
+            log_every=sessions_config.get("log_every", 0),
+        )
+
+    # --- vòng đời phiên ---
+
+    def open(self, session_id):
+        """Lấy phiên (tạo mới nếu chưa có hoặc đã hết hạn) và dọn các phiên khác theo TTL / LRU / residency."""
+        with self._lock:
+            now = time.time()
+            session = self._sessions.get(session_id)
+            if session is not None and self.ttl_seconds and now - session.last_used > self.ttl_seconds:
+                self._drop(session_id)
+                self.expired += 1
+                session = None
+            if session is None:
+                session = self._sessions[session_id] = Session(session_id, self)
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._maintain(now)
+            return session
+
+    def close(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._release(session)
+
+    def _release(self, session):
+        session.past_key_values = session.offloaded = None
+        if session.offload_path is not None:
+            try:
+                os.remove(session.offload_path)
+            except FileNotFoundError:
+                pass
+            session.offload_path = None
+        session.token_ids = []
+
+    def _maintain(self, now):
+        if self.ttl_seconds:
+            for session_id in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl_seconds]:
+                self._drop(session_id)
+                self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+        # Từ phiên dùng gần nhất trở về trước: quá max_resident hoặc rảnh quá lâu thì đẩy KV khỏi device
+        resident = 0
+        for session in reversed(self._sessions.values()):
+            if session.past_key_values is None:
+                continue
+            resident += 1
+            idle = self.offload_idle_seconds and now - session.last_used > self.offload_idle_seconds
+            if resident > self.max_resident or idle:
+                self._offload(session)
+
+    # --- KV cache ---
+
+    def _offload(self, session):
+        past_key_values, session.past_key_values = session.past_key_values, None
+        self.offloads += 1
+        if self.offload == "none":
+            session.token_ids = []
+            return
+        layers = [(keys.to("cpu"), values.to("cpu")) for keys, values in _cache_layers(past_key_values)]
+        if self.offload == "cpu":
+            session.offloaded = layers
+            return
+        path = os.path.join(self.offload_dir, hashlib.sha256(str(session.id).encode("utf-8")).hexdigest()[:24] + ".pt")
+        torch.save(layers, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        session.offload_path = path
+
+    def checkout(self, session):
+        with self._lock:
+            past_key_values, token_ids = session.past_key_values, session.token_ids
+            if past_key_values is None and (session.offloaded is not None or session.offload_path is not None):
+                if session.offloaded is not None:
+                    layers = session.offloaded
+                else:
+                    layers = torch.load(session.offload_path, weights_only=True)
+                past_key_values = _rebuild_cache(layers, self.model.device)
+                self._release(session)
+                self.restores += 1
+            session.past_key_values, session.token_ids = None, []
+            return past_key_values, token_ids
+
+    def checkin(self, session, token_ids, past_key_values):
+        with self._lock:
+            if session.id not in self._sessions:
+                return  # phiên đã bị đóng / hết hạn trong lúc sinh
+            self._release(session)
+            session.token_ids, session.past_key_values = token_ids, past_key_values
+            self._maintain(time.time())
+
+    # --- lịch sử tin nhắn ---
+
+    def _estimate_tokens(self, llm, messages):
+        return sum(llm.count_tokens(message["content"]) + _MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def build_messages(self, session, system_prompt, user_content, llm, reserve_tokens=0):
+        """Tin nhắn cho lượt mới; tóm tắt / cắt lịch sử trước nếu vượt giới hạn ngữ cảnh."""
+        messages = self._messages(session, system_prompt, user_content)
+        limit = self.max_context_tokens - reserve_tokens
+        if self.max_context_tokens and session.messages and self._estimate_tokens(llm, messages) > limit:
+            self._compact(session, llm)
+            messages = self._messages(session, system_prompt, user_content)
+        return messages
+
+    def _messages(self, session, system_prompt, user_content):
+        return ([{"role": "system", "content": session_system_prompt(system_prompt, session.summary)}]
+                + session.messages + [{"role": "user", "content": user_content}])
+
+    def _compact(self, session, llm):
+        keep = 2 * self.keep_recent_turns
+        old, recent = (session.messages[:-keep], session.messages[-keep:]) if keep else (session.messages, [])
+        if not old:
+            old, recent = session.messages, []
+        summary = session.summary
+        if self.summarize:
+            try:
+                summary = llm.generate([summary_messages(session.summary, old)],
+                                       max_new_tokens=self.summary_max_new_tokens)[0]
+            except Exception as e:
+                # Không tóm tắt được thì chỉ cắt bỏ các lượt cũ
+                print(f"[sessions] Lỗi khi tóm tắt phiên {session.id}: {e}")
+        # System prompt đổi nên KV chỉ còn đúng tới đầu system prompt; lượt sau tự cắt theo prefix chung
+        session.summary = summary
+        session.messages = recent
+        self.compactions += 1
+
+    def add_turn(self, session, user_content, response, stats=None):
+        with self._lock:
+            session.messages += [{"role": "user", "content": user_content},
+                                 {"role": "assistant", "content": response}]
+            session.turns += 1
+            session.last_used = time.time()
+            self.turns += 1
+            if stats and stats.get("prefix_tokens_reused") is not None and stats.get("prompt_tokens"):
+                self.tokens_reused += stats["prefix_tokens_reused"]
+                self.tokens_prefilled += stats["prompt_tokens"] - stats["prefix_tokens_reused"]
+            log = self.log_every and self.turns % self.log_every == 0
+        if log:
+            print(f"[sessions] {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            resident = [s for s in self._sessions.values() if s.past_key_values is not None]
+            return {
+                "sessions": len(self._sessions),
+                "resident": len(resident),
+                "resident_kv_mb": round(sum(_cache_bytes(_cache_layers(s.past_key_values)) for s in resident) / 2**20, 1),
+                "offloaded_cpu": sum(s.offloaded is not None for s in self._sessions.values()),
+                "offloaded_disk": sum(s.offload_path is not None for s in self._sessions.values()),
+                "turns": self.turns,
+                "tokens_reused": self.tokens_reused,
+                "tokens_prefilled": self.tokens_prefilled,
+                "compactions": self.compactions,
+                "offloads": self.offloads,
+                "restores": self.restores,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
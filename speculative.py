@@ -0,0 +1,169 @@
+"""Speculative / assisted decoding: đoán trước vài token rồi để model 8B kiểm tra cả cụm trong một lượt forward.
+
+- prompt_lookup: lấy token đoán từ n-gram trong chính prompt. Câu sửa lỗi thường chép lại gần nguyên câu
+  của học viên, nên phần lớn token đoán được chấp nhận mà không tốn thêm model nào.
+- draft_model: một model nhỏ cùng họ (vd: Llama-3.2-1B-Instruct) sinh bản nháp.
+
+Với greedy decoding, kết quả giống hệt khi sinh bình thường; chỉ số lượt forward của model lớn giảm.
+Tỉ lệ chấp nhận được đếm bằng cách bọc CandidateGenerator của transformers. Speedup thực tế được đo bằng
+cách cứ `baseline_every` lượt thì một lượt sinh bình thường, rồi so tốc độ decode hai nhóm.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+SPECULATIVE_METHODS = ("none", "prompt_lookup", "draft_model")
+
+
+class _CountingCandidateGenerator:
+    """Bọc CandidateGenerator: đếm token draft đề xuất / được chấp nhận và lúc lượt forward đầu (prefill) xong."""
+
+    def __init__(self, generator, counts):
+        self._generator = generator
+        self._counts = counts
+
+    def __getattr__(self, name):
+        return getattr(self._generator, name)
+
+    def get_candidates(self, input_ids, **kwargs):
+        candidate_ids, candidate_logits = self._generator.get_candidates(input_ids, **kwargs)
+        self._counts["draft_tokens"] += candidate_ids.shape[1] - input_ids.shape[1]
+        return candidate_ids, candidate_logits
+
+    def update_candidate_strategy(self, input_ids, scores, num_matches):
+        if self._counts["first_step_at"] is None:
+            self._counts["first_step_at"] = time.perf_counter()
+        self._counts["steps"] += 1
+        self._counts["accepted_tokens"] += int(num_matches)
+        return self._generator.update_candidate_strategy(input_ids, scores, num_matches)
+
+
+class SpeculativeDecoding:
+    """Cấu hình speculative decoding dùng chung cho các lượt stream() của một backend, kèm thống kê cộng dồn."""
+
+    def __init__(self, method="prompt_lookup", num_tokens=10, max_ngram=2, draft_model=None, draft_tokenizer=None,
+                 num_assistant_tokens=None, baseline_every=0, log_every=0):
+        if method not in SPECULATIVE_METHODS[1:]:
+            raise ValueError(f"speculative.method phải là một trong {SPECULATIVE_METHODS}, không phải {method!r}")
+        if method == "draft_model" and draft_model is None:
+            raise ValueError("speculative.method = draft_model cần speculative.draft_model_path")
+        self.method = method
+        self.num_tokens = num_tokens
+        self.max_ngram = max_ngram
+        self.draft_model = draft_model
+        self.draft_tokenizer = draft_tokenizer
+        self.num_assistant_tokens = num_assistant_tokens
+        self.baseline_every = baseline_every
+        self.log_every = log_every
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._recorded = 0
+        self.draft_tokens = 0
+        self.accepted_tokens = 0
+        # tốc độ decode cộng dồn: [số token, giây] của lượt có / không speculative
+        self._decode = {True: [0, 0.0], False: [0, 0.0]}
+
+    @classmethod
+    def from_config(cls, speculative_config, model=None):
+        """None nếu method = none. Với draft_model, model nháp được nạp cùng dtype / device với `model`."""
+        method = speculative_config.get("method", "none")
+        if method == "none":
+            return None
+        draft_model = draft_tokenizer = None
+        if method == "draft_model" and model is not None:
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            draft_path = speculative_config["draft_model_path"]
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_path)
+            draft_model = AutoModelForCausalLM.from_pretrained(draft_path, torch_dtype=model.dtype).to(model.device)
+            draft_model.eval()
+        return cls(
+            method,
+            num_tokens=speculative_config.get("num_tokens", 10),
+            max_ngram=speculative_config.get("max_ngram", 2),
+            draft_model=draft_model,
+            draft_tokenizer=draft_tokenizer,
+            num_assistant_tokens=speculative_config.get("num_assistant_tokens") or None,
+            baseline_every=speculative_config.get("baseline_every", 0),
+            log_every=speculative_config.get("log_every", 0),
+        )
+
+    def use_for_next(self):
+        """False cho một lượt trong mỗi `baseline_every` lượt: lượt đó sinh bình thường để làm mốc so sánh."""
+        with self._lock:
+            self._requests += 1
+            return not (self.baseline_every and self._requests % self.baseline_every == 0)
+
+    def attach(self, model):
+        """Bọc `_get_candidate_generator` của riêng instance `model` để đếm token draft / được chấp nhận."""
+        # PeftModel.generate gọi generate của model gốc bên trong: phải bọc trên model gốc
+        if hasattr(model, "get_base_model"):
+            model = model.get_base_model()
+        original = model._get_candidate_generator
+        local = self._local
+
+        def _get_candidate_generator(*args, **kwargs):
+            generator = original(*args, **kwargs)
+            counts = getattr(local, "counts", None)
+            return generator if counts is None else _CountingCandidateGenerator(generator, counts)
+
+        model._get_candidate_generator = _get_candidate_generator
+
+    def generate_kwargs(self, tokenizer):
+        """kwargs thêm vào model.generate (transformers)."""
+        if self.method == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.num_tokens, "max_matching_ngram_size": self.max_ngram}
+        kwargs = {"assistant_model": self.draft_model}
+        if self.num_assistant_tokens:
+            kwargs["num_assistant_tokens"] = self.num_assistant_tokens
+        if self.draft_tokenizer is not None and self.draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            # Khác tokenizer: transformers dịch token qua text (universal assisted decoding)
+            kwargs.update(tokenizer=tokenizer, assistant_tokenizer=self.draft_tokenizer)
+        return kwargs
+
+    @contextmanager
+    def tracking(self, enabled):
+        """Trong khối này, model.generate trên thread hiện tại đếm token vào dict được yield (None nếu tắt)."""
+        counts = {"draft_tokens": 0, "accepted_tokens": 0, "steps": 0, "first_step_at": None} if enabled else None
+        self._local.counts = counts
+        try:
+            yield counts
+        finally:
+            self._local.counts = None
+
+    def record(self, stats, counts, speculative):
+        """Ghi tỉ lệ chấp nhận vào `stats` của lượt sinh và cộng dồn tốc độ decode theo nhóm."""
+        stats["speculative"] = self.method if speculative else "off"
+        if counts is not None:
+            stats["draft_tokens"] = counts["draft_tokens"]
+            stats["accepted_tokens"] = counts["accepted_tokens"]
+            if counts["draft_tokens"]:
+                stats["acceptance_rate"] = round(counts["accepted_tokens"] / counts["draft_tokens"], 3)
+        with self._lock:
+            if counts is not None:
+                self.draft_tokens += counts["draft_tokens"]
+                self.accepted_tokens += counts["accepted_tokens"]
+            if stats.get("decode_ms") and stats.get("generated_tokens", 0) > 1:
+                decode = self._decode[speculative]
+                decode[0] += stats["generated_tokens"] - 1
+                decode[1] += stats["decode_ms"] / 1000
+            self._recorded += 1
+            log = self.log_every and self._recorded % self.log_every == 0
+        if log:
+            print(f"[speculative] {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            rates = {speculative: tokens / seconds if seconds else None
+                     for speculative, (tokens, seconds) in self._decode.items()}
+            return {
+                "method": self.method,
+                "draft_tokens": self.draft_tokens,
+                "accepted_tokens": self.accepted_tokens,
+                "acceptance_rate": round(self.accepted_tokens / self.draft_tokens, 3) if self.draft_tokens else None,
+                "decode_tokens_per_s": round(rates[True], 1) if rates[True] else None,
+                "baseline_decode_tokens_per_s": round(rates[False], 1) if rates[False] else None,
+                "speedup": round(rates[True] / rates[False], 2) if rates[True] and rates[False] else None,
+            }
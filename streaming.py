@@ -0,0 +1,75 @@
+import asyncio
+import re
+
+# Kết thúc câu: dấu câu + khoảng trắng, hoặc xuống dòng
+SENTENCE_END = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+
+
+class SentenceBuffer:
+    """Nhận từng đoạn text (delta) từ LLM và trả ra các câu đã hoàn chỉnh để đưa sang TTS."""
+
+    def __init__(self, min_chars=20):
+        # Câu quá ngắn ("1.", "OK.") được gộp với câu sau để tránh gọi TTS cho từng mảnh vụn
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta):
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.start()].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+async def stream_text_and_audio(deltas, synthesize, min_chars=20):
+    """Phát lần lượt các sự kiện ("text", delta) và ("audio", index, sentence, audio_bytes).
+
+    `deltas` là iterator đồng bộ (vd: TextIteratorStreamer), được đọc trong thread;
+    `synthesize(sentence)` là coroutine trả về bytes âm thanh. Audio của mỗi câu được
+    tổng hợp ngay khi câu đó kết thúc và trả ra đúng thứ tự câu.
+    """
+    sentence_buffer = SentenceBuffer(min_chars)
+    pending_audio = []  # [(index, sentence, task)] theo thứ tự câu
+    sentence_count = 0
+
+    def schedule(sentences):
+        nonlocal sentence_count
+        for sentence in sentences:
+            task = asyncio.ensure_future(synthesize(sentence))
+            pending_audio.append((sentence_count, sentence, task))
+            sentence_count += 1
+
+    next_delta = asyncio.ensure_future(asyncio.to_thread(next, deltas, None))
+    try:
+        while next_delta is not None or pending_audio:
+            waiting = {next_delta} if next_delta is not None else set()
+            if pending_audio:
+                waiting.add(pending_audio[0][2])
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            while pending_audio and pending_audio[0][2].done():
+                index, sentence, task = pending_audio.pop(0)
+                yield ("audio", index, sentence, task.result())
+
+            if next_delta is not None and next_delta.done():
+                delta = next_delta.result()
+                if delta is None:
+                    next_delta = None
+                    schedule(sentence_buffer.flush())
+                else:
+                    next_delta = asyncio.ensure_future(asyncio.to_thread(next, deltas, None))
+                    if delta:
+                        yield ("text", delta)
+                        schedule(sentence_buffer.feed(delta))
+    finally:
+        for _, _, task in pending_audio:
+            task.cancel()
@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+import ctranslate2
+import numpy as np
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.audio import decode_audio
+
+SAMPLE_RATE = 16000
+
+STTResult = namedtuple("STTResult", ["text", "language", "language_probability", "duration", "speech_duration"])
+
+
+class STTEngine:
+    """STT dùng chung cho handler.py và VoiceTutor, chạy trên faster-whisper (CTranslate2).
+
+    - GPU: float16, CPU: int8.
+    - VAD (Silero) cắt bỏ khoảng lặng trước khi giải mã.
+    - Bản ghi dài (>= batch_min_seconds) được chia thành các đoạn theo VAD và giải mã theo batch.
+    """
+
+    def __init__(self, model_size="small", device="auto", compute_type=None, vad_filter=True,
+                 batch_size=8, batch_min_seconds=30, beam_size=5, cpu_threads=0, num_workers=1):
+        if device == "auto":
+            device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        if not compute_type:
+            compute_type = "float16" if device == "cuda" else "int8"
+
+        self.device = device
+        self.compute_type = compute_type
+        self.vad_filter = vad_filter
+        self.batch_size = batch_size
+        self.batch_min_seconds = batch_min_seconds
+        self.beam_size = beam_size
+
+        # num_workers > 1: nhiều thread gọi transcribe cùng lúc được giải mã song song thay vì xếp hàng
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads,
+                                  num_workers=num_workers)
+        self.batched_model = BatchedInferencePipeline(model=self.model)
+
+    @classmethod
+    def from_config(cls, voice_config):
+        return cls(
+            model_size=voice_config.get("stt_model", "small"),
+            device=voice_config.get("stt_device", "auto"),
+            compute_type=voice_config.get("stt_compute_type"),
+            vad_filter=voice_config.get("stt_vad_filter", True),
+            batch_size=voice_config.get("stt_batch_size", 8),
+            batch_min_seconds=voice_config.get("stt_batch_min_seconds", 30),
+            beam_size=voice_config.get("stt_beam_size", 5),
+            cpu_threads=voice_config.get("stt_cpu_threads", 0),
+            num_workers=voice_config.get("stt_num_workers", 1),
+        )
+
+    def transcribe(self, audio, language=None):
+        """`audio`: đường dẫn file, file-like hoặc mảng float32 16 kHz. `language=None` để tự nhận diện."""
+        if not isinstance(audio, np.ndarray):
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+
+        duration = len(audio) / SAMPLE_RATE
+        if duration >= self.batch_min_seconds:
+            # Pipeline batch luôn dùng VAD để chia đoạn, các đoạn được giải mã song song
+            segments, info = self.batched_model.transcribe(
+                audio, language=language, beam_size=self.beam_size, batch_size=self.batch_size
+            )
+        else:
+            segments, info = self.model.transcribe(
+                audio, language=language, beam_size=self.beam_size, vad_filter=self.vad_filter
+            )
+
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        return STTResult(text, info.language, info.language_probability, info.duration, info.duration_after_vad)
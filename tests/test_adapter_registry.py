@@ -0,0 +1,106 @@
+"""AdapterRegistry: chọn adapter, xóa adapter dùng lâu nhất khi đầy, tính lại version khi nạp lại.
+
+PeftModel được thay bằng model giả ghi lại các lần load_adapter / delete_adapter:
+    python -m pytest -q tests
+"""
+import os
+
+import pytest
+
+from adapter_registry import BASE_ADAPTER, AdapterRegistry
+
+
+class FakePeftModel:
+    def __init__(self, default):
+        self.peft_config = {default: None}
+        self.calls = []
+
+    def load_adapter(self, path, adapter_name):
+        self.peft_config[adapter_name] = path
+        self.calls.append(("load", adapter_name))
+
+    def delete_adapter(self, name):
+        del self.peft_config[name]
+        self.calls.append(("delete", name))
+
+    def eval(self):
+        return self
+
+
+@pytest.fixture
+def paths(tmp_path):
+    result = {}
+    for name in ("en", "de", "exam"):
+        path = tmp_path / name
+        path.mkdir()
+        (path / "adapter_config.json").write_text("{}")
+        result[name] = str(path)
+    return result
+
+
+def make_registry(paths, **kwargs):
+    return AdapterRegistry(FakePeftModel("en"), paths, "en", routes={"de": "de"}, **kwargs)
+
+
+def test_resolve_prefers_job_adapter_then_lang_route_then_default(paths):
+    registry = make_registry(paths)
+
+    assert registry.resolve("exam", "de") == "exam"
+    assert registry.resolve(None, "de") == "de"
+    assert registry.resolve(None, "fr") == "en"
+    with pytest.raises(ValueError):
+        registry.resolve("missing")
+
+
+def test_invalid_default_or_route_is_rejected(paths):
+    with pytest.raises(ValueError):
+        AdapterRegistry(FakePeftModel("en"), paths, "fr")
+    with pytest.raises(ValueError):
+        AdapterRegistry(FakePeftModel("en"), paths, "en", routes={"de": "missing"})
+
+
+def test_least_recently_used_adapter_is_evicted_but_not_the_default(paths):
+    registry = make_registry(paths, max_loaded=2)
+    model = registry.model
+
+    with registry.activate(["de"]):
+        pass
+    with registry.activate(["exam"]):
+        pass
+    # en là default (luôn giữ), nên de bị xóa để nạp exam
+    assert model.calls == [("load", "de"), ("delete", "de"), ("load", "exam")]
+    assert set(model.peft_config) == {"en", "exam"}
+    assert registry.stats()["evictions"] == 1
+
+
+def test_adapters_needed_by_the_same_batch_are_not_evicted(paths):
+    registry = make_registry(paths, max_loaded=2)
+
+    with registry.activate(["de", "exam", None, BASE_ADAPTER]) as names:
+        assert names == ["de", "exam", "en", BASE_ADAPTER]
+        # Batch cần 3 adapter: tạm vượt max_loaded thay vì xóa adapter đang dùng
+        assert set(registry.model.peft_config) == {"en", "de", "exam"}
+    assert registry.stats()["requests"] == {"en": 1, "de": 1, "exam": 1}
+
+
+def test_version_is_recomputed_when_a_changed_adapter_is_reloaded(paths):
+    reloaded = []
+    registry = make_registry(paths, max_loaded=2, on_reload=reloaded.append)
+    with registry.activate(["de"]):
+        pass
+    version, fingerprint = registry.version("de"), registry.fingerprint()
+    assert reloaded == []  # nạp lần đầu, file không đổi
+
+    with registry.activate(["exam"]):  # đẩy de ra
+        pass
+    config = os.path.join(paths["de"], "adapter_config.json")
+    with open(config, "w") as f:
+        f.write('{"r": 8}')
+    stat = os.stat(config)
+    os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    with registry.activate(["de"]):
+        pass
+
+    assert reloaded == ["de"]
+    assert registry.version("de") != version
+    assert registry.fingerprint() != fingerprint
@@ -0,0 +1,74 @@
+"""BatchScheduler: kết quả về đúng request, lỗi của batch tới mọi request thay vì để chúng treo.
+
+Chạy từ thư mục gốc repo: python -m pytest -q tests
+"""
+import asyncio
+
+import pytest
+
+from batching import BatchScheduler
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=5))
+
+
+def test_requests_are_batched_and_get_their_own_result():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(i) for i in range(6)))
+
+    assert run(main()) == [0, 10, 20, 30, 40, 50]
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert scheduler.stats()["items"] == 6
+    assert scheduler.stats()["batches"] == 2
+
+
+def test_batch_error_reaches_every_request():
+    def batch_fn(items):
+        raise RuntimeError("CUDA out of memory")
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=20)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_short_result_list_fails_the_batch_instead_of_hanging():
+    scheduler = BatchScheduler(lambda items: items[:-1], max_batch_size=4, max_wait_ms=20)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = run(main())
+    assert len(results) == 3
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_scheduler_keeps_serving_after_a_failed_batch():
+    calls = {"n": 0}
+
+    def batch_fn(items):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise RuntimeError("lỗi lần đầu")
+        return items
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=2, max_wait_ms=10)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await scheduler.submit("a")
+        return await scheduler.submit("b")
+
+    assert run(main()) == "b"
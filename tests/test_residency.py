@@ -0,0 +1,168 @@
+"""ResidencyManager: giữ tổng dung lượng model dưới ngân sách, đẩy model rảnh ra theo LRU và policy.
+
+Ngân sách tính trên CPU (budget_device="cpu") với model giả khai báo sẵn footprint:
+    python -m pytest -q tests
+"""
+import torch
+
+from residency import LazyResident, ResidencyManager, TorchResident
+
+
+class FakeModel:
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+        self.on_device = True
+
+
+def lazy(name, log, policy="offload", footprint=60):
+    def load():
+        log.append(("load", name))
+        return FakeModel(name, log)
+
+    def offload(model):
+        log.append(("offload", name))
+        model.on_device = False
+
+    def restore(model):
+        log.append(("restore", name))
+        model.on_device = True
+
+    return LazyResident(name, load, device="cpu", policy=policy, footprint_bytes=footprint,
+                        offload=offload, restore=restore, unload=lambda model: log.append(("unload", name)))
+
+
+def make_manager(budget=100, **kwargs):
+    events = []
+    manager = ResidencyManager(budget, log=False, budget_device="cpu", on_event=lambda *event: events.append(event),
+                               **kwargs)
+    return manager, events
+
+
+def test_models_are_loaded_lazily_and_swapped_within_budget():
+    log = []
+    manager, events = make_manager()
+    manager.register(lazy("stt", log))
+    manager.register(lazy("llm", log))
+
+    with manager.use("stt") as stt:
+        assert stt.name == "stt"
+    with manager.use("llm"):
+        pass
+    # Chỉ đủ chỗ cho một model: stt bị offload trước khi nạp llm, rồi được đưa lại thay vì nạp từ đầu
+    with manager.use("stt"):
+        pass
+
+    assert log == [("load", "stt"), ("offload", "stt"), ("load", "llm"), ("offload", "llm"), ("restore", "stt")]
+    assert [(name, action) for name, action, _ in events] == [
+        ("stt", "load"), ("stt", "offload"), ("llm", "load"), ("llm", "offload"), ("stt", "swap_in")]
+    stats = manager.stats()
+    assert stats["device_used_mb"] <= stats["budget_mb"]
+    assert stats["models"]["stt"]["state"] == "resident"
+    assert stats["models"]["llm"]["state"] == "offloaded"
+
+
+def test_least_recently_used_idle_model_is_evicted_first():
+    log = []
+    manager, _ = make_manager(budget=130)
+    for name in ("a", "b", "c"):
+        manager.register(lazy(name, log))
+
+    with manager.use("a"):
+        pass
+    with manager.use("b"):
+        pass
+    with manager.use("a"):  # a mới dùng lại: b là model dùng lâu nhất
+        pass
+    with manager.use("c"):
+        pass
+
+    assert ("offload", "b") in log
+    assert ("offload", "a") not in log
+
+
+def test_unload_policy_frees_the_model_and_reloads_it():
+    log = []
+    manager, _ = make_manager()
+    manager.register(lazy("ocr", log, policy="unload"))
+    manager.register(lazy("llm", log))
+
+    with manager.use("ocr"):
+        pass
+    with manager.use("llm"):
+        pass
+    with manager.use("ocr"):
+        pass
+
+    assert log[:3] == [("load", "ocr"), ("unload", "ocr"), ("load", "llm")]
+    assert log[-1] == ("load", "ocr")
+
+
+def test_model_in_use_or_kept_is_never_evicted():
+    log = []
+    manager, _ = make_manager(wait_timeout=0.2)
+    manager.register(lazy("llm", log, policy="keep"))
+    manager.register(lazy("stt", log))
+
+    with manager.use("llm"):
+        pass
+    # llm không bao giờ bị đẩy ra: hết wait_timeout thì stt được nạp vượt ngân sách thay vì treo
+    with manager.use("stt"):
+        pass
+    assert ("offload", "llm") not in log
+    assert manager.stats()["models"]["stt"]["state"] == "resident"
+
+
+def test_acquire_waits_for_a_busy_model_then_goes_over_budget():
+    log = []
+    manager, _ = make_manager(wait_timeout=0.2)
+    manager.register(lazy("stt", log))
+    manager.register(lazy("llm", log))
+
+    manager.acquire("stt")
+    try:
+        with manager.use("llm"):
+            assert manager.stats()["models"]["stt"]["state"] == "resident"
+    finally:
+        manager.release("stt")
+    assert ("offload", "stt") not in log
+
+    # Lần dùng sau khi đã rảnh: đẩy bớt model để về lại trong ngân sách
+    with manager.use("llm"):
+        pass
+    assert ("offload", "stt") in log
+    assert manager.stats()["device_used_mb"] <= manager.stats()["budget_mb"]
+
+
+def test_prefetch_loads_in_order_without_evicting_earlier_models():
+    log = []
+    manager, _ = make_manager()
+    for name in ("stt", "llm"):
+        manager.register(lazy(name, log))
+
+    # Job audio cần stt trước: không đủ chỗ cho llm thì bỏ qua prefetch llm, không đẩy stt ra
+    manager.prefetch("stt", "llm", "unknown").result(timeout=5)
+
+    assert log == [("load", "stt")]
+    assert manager.stats()["models"]["llm"]["state"] == "unloaded"
+    assert manager.prefetch("unknown") is None
+
+
+class TinyLM(torch.nn.Sequential):
+    # Như model transformers: có thuộc tính device
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+
+def test_torch_resident_offload_and_restore_keep_weights():
+    torch.manual_seed(0)
+    model = TinyLM(torch.nn.Linear(4, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+    x = torch.randn(3, 4)
+    expected = model(x)
+    resident = TorchResident("llm", model)
+    assert resident.footprint_bytes == sum(p.numel() * p.element_size() for p in model.parameters())
+
+    assert resident.evict() == "offloaded"
+    assert resident.bring_in() == "swap_in"
+    assert torch.equal(model(x), expected)
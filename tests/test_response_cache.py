@@ -0,0 +1,98 @@
+"""ResponseCache: khóa chính xác / gần giống, TTL, LRU và chế độ deterministic.
+
+Chạy từ thư mục gốc repo: python -m pytest -q tests
+"""
+import types
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+PARAMS = {"max_new_tokens": 400, "temperature": 0.3}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 1000.0}
+    monkeypatch.setattr(response_cache, "time", types.SimpleNamespace(monotonic=lambda: now["t"]))
+    return now
+
+
+def test_exact_hit_ignores_whitespace_but_not_context():
+    cache = ResponseCache(model_version="m1")
+    cache.put("I goes to school.", "en", "text", PARAMS, ("answer", b"mp3"))
+
+    assert cache.get("  I goes\n to school. ", "en", "text", PARAMS) == (("answer", b"mp3"), "exact")
+    # Khớp chính xác phân biệt hoa thường; bỏ qua hoa thường là việc của near_duplicate
+    assert cache.get("i goes to school.", "en", "text", PARAMS) == (None, None)
+    # Khác ngôn ngữ, loại input, tham số sinh hay version model là khác khóa
+    assert cache.get("I goes to school.", "de", "text", PARAMS) == (None, None)
+    assert cache.get("I goes to school.", "en", "audio", PARAMS) == (None, None)
+    assert cache.get("I goes to school.", "en", "text", {**PARAMS, "temperature": 0.7}) == (None, None)
+    other_model = ResponseCache(model_version="m2")
+    assert other_model.get("I goes to school.", "en", "text", PARAMS) == (None, None)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 4
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put("She have two cat.", "en", "text", PARAMS, ("answer", b""))
+
+    clock["t"] += 59
+    assert cache.get("She have two cat.", "en", "text", PARAMS)[1] == "exact"
+    clock["t"] += 2
+    assert cache.get("She have two cat.", "en", "text", PARAMS) == (None, None)
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "en", "text", PARAMS, "A")
+    cache.put("b", "en", "text", PARAMS, "B")
+    cache.get("a", "en", "text", PARAMS)  # a mới được dùng, b là cũ nhất
+    cache.put("c", "en", "text", PARAMS, "C")
+
+    assert cache.get("b", "en", "text", PARAMS) == (None, None)
+    assert cache.get("a", "en", "text", PARAMS) == ("A", "exact")
+    assert cache.get("c", "en", "text", PARAMS) == ("C", "exact")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_near_duplicate_matches_only_within_the_same_context():
+    cache = ResponseCache(near_duplicate=True, near_threshold=0.7)
+    cache.put("He don't like playing football on the weekend.", "en", "text", PARAMS, "answer")
+
+    assert cache.get("He dont like playing football on the weekend!!", "en", "text", PARAMS) == ("answer", "near")
+    assert cache.get("He dont like playing football on the weekend!!", "de", "text", PARAMS) == (None, None)
+    assert cache.get("Ich bin gestern in die Schule gehen.", "en", "text", PARAMS) == (None, None)
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_deterministic_forces_greedy_decoding_only_when_enabled():
+    assert ResponseCache().generation_overrides() == {}
+    assert ResponseCache(deterministic=True).generation_overrides() == {"do_sample": False}
+    assert ResponseCache.from_config({}).deterministic is False
+    assert ResponseCache.from_config({"deterministic": True}).deterministic is True
+
+
+def test_deterministic_answers_are_keyed_apart_from_sampled_ones():
+    # Handler đưa generation_overrides vào tham số sinh của khóa: câu trả lời greedy không trộn với bản lấy mẫu
+    cache = ResponseCache()
+    greedy = {**PARAMS, **ResponseCache(deterministic=True).generation_overrides()}
+    cache.put("They was happy.", "en", "text", greedy, "greedy answer")
+
+    assert cache.get("They was happy.", "en", "text", greedy) == ("greedy answer", "exact")
+    assert cache.get("They was happy.", "en", "text", PARAMS) == (None, None)
+
+
+def test_every_lookup_is_reported():
+    results = []
+    cache = ResponseCache(on_lookup=results.append)
+    cache.get("x", "en", "text", PARAMS)
+    cache.put("x", "en", "text", PARAMS, "X")
+    cache.get("x", "en", "text", PARAMS)
+
+    assert results == ["miss", "exact"]
@@ -0,0 +1,155 @@
+"""SessionStore: đẩy KV của phiên ra RAM / đĩa rồi đưa lại, TTL / LRU, và cắt KV về phần prefix chung.
+
+KV là DynamicCache dựng tay trên CPU, không cần model thật:
+    python -m pytest -q tests
+"""
+import types
+
+import pytest
+import torch
+from transformers import BatchEncoding, DynamicCache
+
+from llm_backend import TransformersBackend
+from session_store import SessionStore, common_prefix_length
+
+CPU = types.SimpleNamespace(device=torch.device("cpu"))
+
+
+def make_cache(seq_len, layers=2, heads=2, head_dim=4):
+    torch.manual_seed(seq_len)
+    cache = DynamicCache()
+    for layer_idx in range(layers):
+        cache.update(torch.randn(1, heads, seq_len, head_dim), torch.randn(1, heads, seq_len, head_dim), layer_idx)
+    return cache
+
+
+def layer_tensors(cache):
+    return [(layer.keys.clone(), layer.values.clone()) for layer in cache.layers]
+
+
+def test_common_prefix_length():
+    assert common_prefix_length([1, 2, 3, 4], torch.tensor([1, 2, 9, 4, 5])) == 2
+    assert common_prefix_length([1, 2], torch.tensor([1, 2, 3])) == 2
+    assert common_prefix_length([], torch.tensor([1])) == 0
+    assert common_prefix_length([7], torch.tensor([1, 2])) == 0
+
+
+@pytest.mark.parametrize("offload", ["cpu", "disk"])
+def test_offloaded_kv_is_restored_unchanged(offload, tmp_path):
+    store = SessionStore(model=CPU, max_resident=1, offload=offload, offload_dir=str(tmp_path))
+    first = store.open("a")
+    cache = make_cache(5)
+    expected = layer_tensors(cache)
+    first.checkin([1, 2, 3, 4, 5], cache)
+
+    # Phiên thứ hai thành phiên dùng gần nhất: KV của phiên đầu bị đẩy khỏi device
+    store.open("b").checkin([9], make_cache(1))
+    assert first.past_key_values is None
+    assert store.stats()["offloads"] == 1
+    assert store.stats()[f"offloaded_{offload}"] == 1
+
+    past_key_values, token_ids = store.open("a").checkout()
+    assert token_ids == [1, 2, 3, 4, 5]
+    for (keys, values), layer in zip(expected, past_key_values.layers):
+        assert torch.equal(keys, layer.keys)
+        assert torch.equal(values, layer.values)
+    assert store.stats()["restores"] == 1
+    assert not list(tmp_path.iterdir())  # file KV trên đĩa được xóa sau khi đưa lại
+
+
+def test_offload_none_drops_kv_and_tokens():
+    store = SessionStore(model=CPU, max_resident=1, offload="none")
+    first = store.open("a")
+    first.checkin([1, 2, 3], make_cache(3))
+    store.open("b").checkin([4], make_cache(1))
+
+    assert store.open("a").checkout() == (None, [])
+
+
+def test_sessions_expire_and_are_evicted_by_lru(monkeypatch):
+    import session_store
+
+    now = {"t": 1000.0}
+    monkeypatch.setattr(session_store, "time", types.SimpleNamespace(time=lambda: now["t"]))
+    store = SessionStore(model=CPU, max_sessions=2, ttl_seconds=60)
+    store.open("a").messages.append({"role": "user", "content": "hi"})
+    store.open("b")
+    store.open("c")  # quá max_sessions: phiên dùng lâu nhất (a) bị bỏ
+    assert store.stats()["evictions"] == 1
+    assert store.open("a").messages == []
+
+    now["t"] += 61
+    store.open("c")
+    assert store.stats()["sessions"] == 1
+    assert store.stats()["expired"] >= 1
+
+
+def test_checkin_after_close_is_ignored():
+    store = SessionStore(model=CPU)
+    session = store.open("a")
+    store.close("a")
+    session.checkin([1, 2], make_cache(2))
+
+    assert session.past_key_values is None
+    assert store.stats()["sessions"] == 0
+
+
+class CharTokenizer:
+    """Mỗi ký tự là một token: prompt mới chỉ khác phần cuối thì prefix chung dễ đoán."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+    def __call__(self, texts, return_tensors="pt"):
+        return BatchEncoding({"input_ids": torch.tensor([[ord(c) for c in text] for text in texts])})
+
+
+def test_session_inputs_crop_kv_to_the_common_prefix():
+    backend = TransformersBackend(CPU, CharTokenizer(), {})
+    store = SessionStore(model=CPU)
+    session = store.open("a")
+    old = [{"role": "user", "content": "Hallo"}, {"role": "assistant", "content": "Hi!"}]
+    cached_ids = [ord(c) for c in CharTokenizer().apply_chat_template(old)]
+    session.checkin(cached_ids, make_cache(len(cached_ids)))
+
+    # Câu trả lời cũ được render lại khác: KV phần sau chỗ khác nhau bị cắt bỏ
+    messages = [{"role": "user", "content": "Hallo"}, {"role": "assistant", "content": "Hey"},
+                {"role": "user", "content": "Wie geht's?"}]
+    inputs, reused = backend._session_inputs(messages, None, session, reuse=True)
+
+    prompt_ids = [ord(c) for c in CharTokenizer().apply_chat_template(messages)]
+    shared = common_prefix_length(cached_ids, torch.tensor(prompt_ids))
+    assert 0 < reused == shared < len(cached_ids)
+    assert inputs["past_key_values"].get_seq_length() == shared
+    assert inputs["input_ids"][0].tolist() == prompt_ids
+
+
+def test_session_inputs_without_reuse_prefill_everything():
+    backend = TransformersBackend(CPU, CharTokenizer(), {})
+    store = SessionStore(model=CPU)
+    session = store.open("a")
+    session.checkin([ord("<")], make_cache(1))
+
+    inputs, reused = backend._session_inputs([{"role": "user", "content": "x"}], None, session, reuse=False)
+    assert reused == 0
+    assert "past_key_values" not in inputs
+
+
+def test_long_history_is_summarized_into_the_system_prompt():
+    class CountingLLM:
+        def count_tokens(self, text):
+            return len(text.split())
+
+        def generate(self, conversations, **kwargs):
+            return ["Học viên hay chia sai động từ."]
+
+    store = SessionStore(model=None, max_context_tokens=60, keep_recent_turns=1)
+    session = store.open("a")
+    for i in range(4):
+        store.add_turn(session, f"câu số {i} " * 5, f"trả lời {i} " * 5)
+
+    messages = store.build_messages(session, "SYSTEM", "câu mới", CountingLLM())
+    assert store.stats()["compactions"] == 1
+    assert "Học viên hay chia sai động từ." in messages[0]["content"]
+    # Chỉ giữ nguyên keep_recent_turns lượt gần nhất + tin nhắn mới
+    assert [m["role"] for m in messages[1:]] == ["user", "assistant", "user"]
@@ -0,0 +1,137 @@
+"""Packing / collator của train_data.py: ranh giới mẫu phải nằm đúng trong position_ids và labels.
+
+Chạy từ thư mục gốc repo: python -m pytest -q tests
+"""
+import pytest
+import torch
+from datasets import Dataset
+
+from train_data import SFTCollator, pack_dataset, resolve_batching, sampler_args
+
+PAD = 0
+
+
+def sequences(*lengths):
+    # Token khác 0 (0 là pad) và khác nhau giữa các mẫu để dễ lần ra mẫu gốc
+    return [[100 * (i + 1) + t for t in range(n)] for i, n in enumerate(lengths)]
+
+
+def test_pack_dataset_resets_position_ids_per_sample():
+    samples = sequences(7, 3, 5, 2, 6, 1)
+    dataset = Dataset.from_dict({"input_ids": samples, "length": [len(ids) for ids in samples]})
+
+    packed = pack_dataset(dataset, max_length=8)
+
+    assert all(length <= 8 for length in packed["length"])
+    unpacked = []
+    for input_ids, position_ids in zip(packed["input_ids"], packed["position_ids"]):
+        assert len(input_ids) == len(position_ids)
+        assert position_ids[0] == 0
+        # Mỗi lần position_ids về 0 là bắt đầu một mẫu, và mẫu đó được đếm 0, 1, 2, ...
+        starts = [i for i, p in enumerate(position_ids) if p == 0] + [len(position_ids)]
+        for start, end in zip(starts, starts[1:]):
+            assert position_ids[start:end] == list(range(end - start))
+            unpacked.append(input_ids[start:end])
+    assert sorted(unpacked) == sorted(samples)
+
+
+def test_padding_free_collator_concatenates_with_per_sequence_positions():
+    features = [
+        {"input_ids": [11, 12, 13, 21, 22], "position_ids": [0, 1, 2, 0, 1]},
+        {"input_ids": [31, 32, 33]},
+    ]
+
+    batch = SFTCollator(PAD, padding_free=True)(features)
+
+    assert "attention_mask" not in batch
+    assert batch["input_ids"].tolist() == [[11, 12, 13, 21, 22, 31, 32, 33]]
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1, 0, 1, 2]]
+    # Token đầu của mỗi mẫu không được dự đoán từ mẫu đứng trước
+    assert batch["labels"].tolist() == [[-100, 12, 13, -100, 22, -100, 32, 33]]
+
+
+def test_padded_collator_keeps_packed_positions_and_masks_padding():
+    features = [
+        {"input_ids": [11, 12, 21, 22, 23], "position_ids": [0, 1, 0, 1, 2]},
+        {"input_ids": [31, 32]},
+    ]
+
+    batch = SFTCollator(PAD, pad_to_multiple_of=8)(features)
+
+    assert batch["input_ids"].shape == (2, 8)
+    assert batch["position_ids"].tolist() == [[0, 1, 0, 1, 2, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0, 0]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 1, 1, 0, 0, 0], [1, 1, 0, 0, 0, 0, 0, 0]]
+    assert batch["labels"].tolist() == [
+        [11, 12, -100, 22, 23, -100, -100, -100],
+        [31, 32, -100, -100, -100, -100, -100, -100],
+    ]
+
+
+def test_packing_falls_back_to_padding_without_flash_attention(capsys):
+    assert resolve_batching("packing", "flash_attention_2") == "packing"
+    assert resolve_batching("packing", "sdpa") == "padding"
+    assert "Warning" in capsys.readouterr().out
+    assert resolve_batching("group_by_length", "sdpa") == "group_by_length"
+    with pytest.raises(ValueError):
+        resolve_batching("pack", "flash_attention_2")
+
+
+@pytest.mark.parametrize("mode", ["padding", "group_by_length", "packing"])
+def test_sft_config_accepts_train_arguments(mode, tmp_path):
+    trl = pytest.importorskip("trl")
+
+    # Các tham số train.py truyền cho SFTConfig: dataset đã tokenize sẵn, collator tự gom batch
+    config = trl.SFTConfig(
+        output_dir=str(tmp_path),
+        packing=False,
+        dataset_kwargs={"skip_prepare_dataset": True},
+        remove_unused_columns=False,
+        report_to=[],
+        bf16=False,
+        use_cpu=True,
+        **sampler_args(trl.SFTConfig, mode),
+    )
+    assert config.remove_unused_columns is False
+    if mode == "group_by_length":
+        assert config.length_column_name == "length"
+
+
+def test_sft_trainer_passes_packed_positions_to_the_model(tmp_path):
+    trl = pytest.importorskip("trl")
+    from tokenizers import Tokenizer, models
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(LlamaConfig(
+        vocab_size=1024, hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+        num_key_value_heads=4, max_position_embeddings=64))
+    samples = sequences(7, 3, 5, 2, 6, 1)
+    dataset = pack_dataset(Dataset.from_dict({"input_ids": samples, "length": [len(ids) for ids in samples]}), 8)
+    # Dataset đã là token IDs: tokenizer chỉ để SFTTrainer không đi tải theo tên model
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=Tokenizer(models.WordLevel({"<pad>": PAD, "<unk>": 1}, unk_token="<unk>")),
+        pad_token="<pad>", eos_token="<pad>")
+    trainer = trl.SFTTrainer(
+        model=model,
+        processing_class=tokenizer,
+        train_dataset=dataset,
+        data_collator=SFTCollator(PAD, pad_to_multiple_of=8),
+        args=trl.SFTConfig(
+            output_dir=str(tmp_path),
+            per_device_train_batch_size=2,
+            max_steps=1,
+            packing=False,
+            dataset_kwargs={"skip_prepare_dataset": True},
+            remove_unused_columns=False,
+            report_to=[],
+            bf16=False,
+            use_cpu=True,
+        ),
+    )
+    # position_ids của khối packed phải tới được collator (remove_unused_columns=False)
+    batch = next(iter(trainer.get_train_dataloader()))
+    assert (batch["position_ids"] == 0).sum() > batch["input_ids"].shape[0]
+    # Đầu mỗi mẫu (trừ đầu hàng) và padding không có loss
+    assert (batch["labels"][:, 1:][batch["position_ids"][:, 1:] == 0] == -100).all()
+    loss = model(**batch).loss
+    assert torch.isfinite(loss)
@@ -1,5 +1,4 @@
 import torch
-from datasets import load_from_disk
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
@@ -9,6 +8,17 @@ from trl import SFTTrainer, SFTConfig
 import yaml
 import os
 import wandb
+from dataset_build import load_built_dataset
+from train_metrics import ThroughputCallback
+from train_data import (
+    SFTCollator,
+    batching_stats,
+    dataset_fingerprint,
+    pack_dataset,
+    pretokenize,
+    resolve_batching,
+    sampler_args,
+)
 
 def train():
     # Load configuration from config.yaml
@@ -56,30 +66,38 @@ def train():
     )
 
     # 4. Load Dataset
-    dataset = load_from_disk(dataset_path)
+    # Thư mục save_to_disk hoặc shard Arrow + manifest.json (data_preparation.py --streaming)
+    dataset = load_built_dataset(dataset_path)
 
-    def formatting_prompts_func(example):
-        instruction = example['instruction']
-        # Dùng .get() để tránh lỗi nếu key 'input' không tồn tại trong một số dòng data
-        input_text = example.get('input', '') 
-        output = example['output']
-        
-        # Construct Llama 3 format
-        user_content = instruction
-        if input_text:
-            user_content += f"\nInput:\n{input_text}"
-        
-        messages = [
-            {"role": "system", "content": "You are a helpful AI assistant for learning English and German grammar and pronunciation."},
-            {"role": "user", "content": user_content},
-            {"role": "assistant", "content": output}
-        ]
-        
-        # The SFTTrainer expects a field named "text"
-        return {"text": tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)}
+    # Chat template + tokenize một lần, cache token IDs theo (dataset, tokenizer, template)
+    training_config = config["training"]
+    max_seq_length = training_config.get("max_seq_length", 2048)
+    pretokenize_config = training_config.get("pretokenize", {})
+    dataset = pretokenize(
+        dataset,
+        tokenizer,
+        max_seq_length,
+        cache_dir=pretokenize_config.get("cache_dir", "./tokenized_cache"),
+        source_fingerprint=dataset_fingerprint(dataset_path),
+        num_proc=pretokenize_config.get("num_proc", 0),
+    )
+
+    batching = resolve_batching(training_config.get("batching", "padding"), model.config._attn_implementation)
+    if batching == "packing":
+        dataset = pack_dataset(dataset, max_seq_length)
+    # flash_attention_2 tách các mẫu trong một hàng theo position_ids nên packing không cần padding
+    padding_free = batching == "packing"
+    collator = SFTCollator(tokenizer.pad_token_id, padding_free=padding_free, pad_to_multiple_of=8)
 
-    # Format and pre-process the dataset
-    dataset = dataset.map(formatting_prompts_func)
+    stats = batching_stats(
+        dataset["length"],
+        training_config["per_device_train_batch_size"],
+        training_config["gradient_accumulation_steps"],
+        batching,
+        padding_free=padding_free,
+    )
+    print(f"--- Batching: {stats} ---")
+    wandb.config.update({"data_" + key: value for key, value in stats.items()})
 
     # 5. SFTConfig (Thay thế TrainingArguments để tương thích tốt nhất với trl mới)
     training_args = SFTConfig(
@@ -101,22 +119,30 @@ def train():
         # Tối ưu bộ nhớ và cảnh báo
         gradient_checkpointing=True, 
         gradient_checkpointing_kwargs={'use_reentrant': False}, 
-        packing=False,
+        packing=False, # Packing / group_by_length làm ở train_data.py trên token đã cache
         
         # Tăng tốc nạp dữ liệu cho GPU
         dataloader_num_workers=4, 
         dataloader_pin_memory=True, 
         
-        # Các tham số đặc thù của SFTConfig
-        dataset_text_field="text", 
+        # Dataset đã tokenize sẵn: SFTTrainer không xử lý lại, giữ cột length / position_ids cho collator
+        dataset_kwargs={"skip_prepare_dataset": True},
+        remove_unused_columns=False,
+        **sampler_args(SFTConfig, batching),
     )
 
     # 6. Trainer
+    callbacks = []
+    instrumentation_config = training_config.get("instrumentation", {})
+    if instrumentation_config.get("enabled", True):
+        callbacks.append(ThroughputCallback.from_config(instrumentation_config, output_dir))
     trainer = SFTTrainer(
         model=model,
         train_dataset=dataset,
+        data_collator=collator,
         peft_config=lora_config,
         args=training_args,
+        callbacks=callbacks,
     )
 
     # 7. Start Training
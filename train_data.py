@@ -0,0 +1,234 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+
+SYSTEM_PROMPT = "You are a helpful AI assistant for learning English and German grammar and pronunciation."
+# Tăng khi đổi cách dựng messages / tokenize để bỏ cache cũ
+PRETOKENIZE_VERSION = 1
+BATCHING_MODES = ("padding", "group_by_length", "packing")
+
+
+def build_messages(instruction, input_text, output):
+    # Construct Llama 3 format
+    user_content = instruction
+    if input_text:
+        user_content += f"\nInput:\n{input_text}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+        {"role": "assistant", "content": output},
+    ]
+
+
+def dataset_fingerprint(dataset_path):
+    """Dấu vân tay thư mục dataset (manifest / state.json / shard Arrow): build lại là đổi."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(dataset_path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith((".json", ".arrow")) and not name.startswith("cache-"):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, dataset_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def tokenizer_fingerprint(tokenizer, max_length):
+    """Hash của vocab/merges, chat template, system prompt và max_length: đổi bất kỳ thứ gì là tokenize lại."""
+    digest = hashlib.sha256()
+    if getattr(tokenizer, "is_fast", False):
+        # Bỏ trạng thái truncation/padding: tokenizer tự bật chúng khi được gọi, không làm đổi token
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        digest.update(json.dumps(state, sort_keys=True).encode("utf-8"))
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+    parts = [tokenizer.chat_template, SYSTEM_PROMPT, max_length, tokenizer.eos_token_id, PRETOKENIZE_VERSION]
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _tokenize_batch(batch, tokenizer, max_length):
+    # Một số dataset cũ không có cột input
+    inputs = batch.get("input") or [""] * len(batch["instruction"])
+    texts = [
+        tokenizer.apply_chat_template(build_messages(instruction, input_text or "", output), tokenize=False)
+        for instruction, input_text, output in zip(batch["instruction"], inputs, batch["output"])
+    ]
+    # Chat template đã có BOS, không để tokenizer thêm lần nữa
+    input_ids = tokenizer(texts, add_special_tokens=False, truncation=True, max_length=max_length)["input_ids"]
+    return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+
+def pretokenize(dataset, tokenizer, max_length, cache_dir, source_fingerprint, num_proc=None):
+    """Áp chat template + tokenize một lần, lưu token IDs ra đĩa theo khóa (dataset, tokenizer, template).
+
+    Trả về Dataset có cột input_ids và length (số token, dùng cho group_by_length / thống kê).
+    """
+    from datasets import load_from_disk
+
+    key = f"{source_fingerprint}-{tokenizer_fingerprint(tokenizer, max_length)}"
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, "state.json")):
+        print(f"[pretokenize] Dùng cache {path}")
+        return load_from_disk(path)
+
+    print(f"[pretokenize] Tokenize {len(dataset)} mẫu -> {path}")
+    tokenized = dataset.map(
+        _tokenize_batch,
+        batched=True,
+        fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+        remove_columns=dataset.column_names,
+        num_proc=num_proc or None,
+        desc="Tokenizing",
+    )
+    # Ghi vào thư mục tạm rồi đổi tên: lần chạy bị ngắt giữa chừng không để lại cache hỏng
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tokenized.save_to_disk(tmp_path)
+    os.replace(tmp_path, path)
+    return load_from_disk(path)
+
+
+def _pack_batch(batch, max_length):
+    lengths = [len(ids) for ids in batch["input_ids"]]
+    # Best-fit decreasing: mẫu dài trước, mỗi mẫu vào khối còn chỗ trống nhỏ nhất mà vẫn vừa
+    free = []  # (chỗ trống, số thứ tự khối), luôn được sắp xếp
+    bins = []
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        pos = bisect.bisect_left(free, (lengths[i], -1))
+        if pos < len(free):
+            space, b = free.pop(pos)
+        else:
+            space, b = max_length, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        if space - lengths[i] > 0:
+            bisect.insort(free, (space - lengths[i], b))
+
+    packed = {"input_ids": [], "position_ids": [], "length": []}
+    for members in bins:
+        input_ids, position_ids = [], []
+        for i in members:
+            input_ids.extend(batch["input_ids"][i])
+            position_ids.extend(range(lengths[i]))
+        packed["input_ids"].append(input_ids)
+        packed["position_ids"].append(position_ids)
+        packed["length"].append(len(input_ids))
+    return packed
+
+
+def pack_dataset(dataset, max_length, window=10_000):
+    """Ghép nhiều mẫu vào khối <= max_length (trong từng cửa sổ `window` mẫu).
+
+    position_ids đếm lại từ 0 ở đầu mỗi mẫu để model (flash_attention_2, padding-free) biết ranh giới.
+    """
+    return dataset.map(
+        _pack_batch,
+        batched=True,
+        batch_size=window,
+        fn_kwargs={"max_length": max_length},
+        remove_columns=dataset.column_names,
+        desc="Packing",
+    )
+
+
+class SFTCollator:
+    """Gom batch cho causal LM: labels = input_ids, bỏ loss ở padding và ở token đầu mỗi mẫu trong khối packed.
+
+    padding_free=True: nối cả batch thành một hàng, không padding, không attention_mask; ranh giới mẫu nằm
+    trong position_ids (chỉ đúng với flash_attention_2). Ngược lại pad phải tới mẫu dài nhất của batch.
+    """
+
+    def __init__(self, pad_token_id, padding_free=False, pad_to_multiple_of=None):
+        self.pad_token_id = pad_token_id
+        self.padding_free = padding_free
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        sequences = [feature["input_ids"] for feature in features]
+        positions = [feature.get("position_ids") or list(range(len(ids))) for feature, ids in zip(features, sequences)]
+        if self.padding_free:
+            input_ids = torch.tensor([[token for ids in sequences for token in ids]])
+            position_ids = torch.tensor([[p for pos in positions for p in pos]])
+            labels = input_ids.clone()
+            labels[position_ids == 0] = -100
+            return {"input_ids": input_ids, "position_ids": position_ids, "labels": labels}
+
+        width = max(len(ids) for ids in sequences)
+        if self.pad_to_multiple_of:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        input_ids = torch.full((len(sequences), width), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((len(sequences), width), dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+        for row, (ids, pos) in enumerate(zip(sequences, positions)):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            position_ids[row, :len(pos)] = torch.tensor(pos)
+            attention_mask[row, :len(ids)] = 1
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        # Token đầu của mẫu thứ 2 trở đi trong khối packed: không học dự đoán nó từ mẫu trước
+        labels[:, 1:][position_ids[:, 1:] == 0] = -100
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids, "labels": labels}
+
+
+def resolve_batching(mode, attn_implementation):
+    """Kiểm tra training.batching; packing mà không có flash_attention_2 thì quay về padding.
+
+    Chỉ flash_attention_2 tách các mẫu trong một khối packed theo position_ids. Với sdpa / eager,
+    mẫu trong cùng khối sẽ attend sang token của nhau.
+    """
+    if mode not in BATCHING_MODES:
+        raise ValueError(f"training.batching phải là một trong {BATCHING_MODES}, nhận được: {mode}")
+    if mode == "packing" and attn_implementation != "flash_attention_2":
+        print(f"Warning: training.batching = packing cần flash_attention_2 (đang dùng {attn_implementation}), "
+              f"chuyển sang padding.")
+        return "padding"
+    return mode
+
+
+def batch_order(lengths, batch_size, gradient_accumulation_steps, mode, seed=0):
+    """Thứ tự mẫu giống sampler của Trainer: ngẫu nhiên, hoặc LengthGroupedSampler khi group_by_length."""
+    if mode == "group_by_length":
+        from transformers.trainer_pt_utils import get_length_grouped_indices
+
+        generator = torch.Generator().manual_seed(seed)
+        return np.asarray(get_length_grouped_indices(
+            list(lengths), batch_size * gradient_accumulation_steps, generator=generator))
+    return np.random.default_rng(seed).permutation(len(lengths))
+
+
+def batching_stats(lengths, batch_size, gradient_accumulation_steps, mode, padding_free=False, seed=0):
+    """Ước lượng trên một epoch: tỉ lệ token thật / token model phải tính, số token thật mỗi optimizer step."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = batch_order(lengths, batch_size, gradient_accumulation_steps, mode, seed)
+    ordered = lengths[order]
+    starts = np.arange(0, len(ordered), batch_size)
+    real = np.add.reduceat(ordered, starts)
+    if padding_free:
+        computed = real
+    else:
+        computed = np.maximum.reduceat(ordered, starts) * np.diff(np.append(starts, len(ordered)))
+    steps = -(-len(starts) // gradient_accumulation_steps)
+    return {
+        "batching": mode,
+        "rows": int(len(lengths)),
+        "mean_row_tokens": round(float(lengths.mean()), 1),
+        "padding_efficiency": round(float(real.sum() / computed.sum()), 4),
+        "tokens_per_step": round(float(real.sum() / steps), 1),
+        "steps_per_epoch": int(steps),
+    }
+
+
+def sampler_args(config_cls, mode):
+    """Tham số bật LengthGroupedSampler: transformers mới dùng train_sampling_strategy, bản cũ dùng group_by_length."""
+    if mode != "group_by_length":
+        return {}
+    if "train_sampling_strategy" in getattr(config_cls, "__dataclass_fields__", {}):
+        return {"train_sampling_strategy": "group_by_length", "length_column_name": "length"}
+    return {"group_by_length": True, "length_column_name": "length"}
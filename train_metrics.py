@@ -0,0 +1,164 @@
+import json
+import os
+import resource
+import time
+
+import torch
+from transformers import TrainerCallback
+
+
+class ThroughputCallback(TrainerCallback):
+    """Đo tokens/s, samples/s, thời gian chờ dataloader so với tính toán, bộ nhớ đỉnh và tỉ lệ padding mỗi step.
+
+    Token được đếm bằng forward pre-hook trên model (input_ids / attention_mask / position_ids của từng
+    micro-batch). Bộ nhớ đỉnh: torch.cuda.max_memory_allocated của từng step, trên CPU là RSS đỉnh của
+    tiến trình. Chờ dữ liệu = khoảng từ cuối step trước (sau log / save / evaluate) tới đầu step sau.
+    Ghi lên wandb nếu có run đang mở, không thì ghi từng dòng JSON vào `jsonl_path`.
+    Tùy chọn ghi trace torch.profiler cho `profile_num_steps` step bắt đầu từ `profile_start_step`.
+    """
+
+    def __init__(self, log_every=0, jsonl_path="throughput.jsonl", profile_start_step=0, profile_num_steps=3,
+                 profile_dir="./profiler_traces"):
+        self.log_every = log_every
+        self.jsonl_path = jsonl_path
+        self.profile_start_step = profile_start_step
+        self.profile_num_steps = profile_num_steps
+        self.profile_dir = profile_dir
+
+        self._hook = None
+        self._profiler = None
+        self._last_end = None
+        self._step_start = None
+        self._reset_window()
+
+    @classmethod
+    def from_config(cls, instrumentation_config, output_dir):
+        return cls(
+            log_every=instrumentation_config.get("log_every", 0),
+            jsonl_path=instrumentation_config.get("jsonl_path") or os.path.join(output_dir, "throughput.jsonl"),
+            profile_start_step=instrumentation_config.get("profile_start_step", 0),
+            profile_num_steps=instrumentation_config.get("profile_num_steps", 3),
+            profile_dir=instrumentation_config.get("profile_dir", "./profiler_traces"),
+        )
+
+    def _reset_window(self):
+        self._steps = 0
+        self._samples = 0
+        self._tokens = 0
+        self._real_tokens = 0
+        self._compute_s = 0.0
+        self._wait_s = 0.0
+        self._peak_mem_mb = 0.0
+
+    def _count_batch(self, module, args, kwargs):
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        attention_mask = kwargs.get("attention_mask")
+        position_ids = kwargs.get("position_ids")
+        self._tokens += input_ids.numel()
+        self._real_tokens += int(attention_mask.sum()) if attention_mask is not None else input_ids.numel()
+        if position_ids is not None:
+            # Khối packed / padding-free: mỗi mẫu bắt đầu ở position 0 (bỏ các vị trí padding)
+            starts = position_ids == 0
+            if attention_mask is not None:
+                starts &= attention_mask.bool()
+            self._samples += int(starts.sum())
+        else:
+            self._samples += input_ids.shape[0]
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if model is not None and self._hook is None:
+            self._hook = model.register_forward_pre_hook(self._count_batch, with_kwargs=True)
+        self._last_end = time.perf_counter()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._stop_profiler(state)
+        if self._steps:
+            self._emit(state)
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self.profile_start_step and state.global_step == self.profile_start_step and self._profiler is None:
+            self._start_profiler()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._step_start = time.perf_counter()
+        if self._last_end is not None:
+            self._wait_s += self._step_start - self._last_end
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if torch.cuda.is_available():
+            # Chờ GPU xong step để thời gian tính toán không bị lẫn sang step sau
+            torch.cuda.synchronize()
+            peak_mb = torch.cuda.max_memory_allocated() / 2**20
+        else:
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self._compute_s += time.perf_counter() - self._step_start
+        self._peak_mem_mb = max(self._peak_mem_mb, peak_mb)
+        self._steps += 1
+
+        if self._profiler is not None and state.global_step >= self.profile_start_step + self.profile_num_steps:
+            self._stop_profiler(state)
+        log_every = self.log_every or args.logging_steps
+        if state.global_step % log_every == 0:
+            self._emit(state)
+        # Xuất trace / ghi log không tính vào thời gian chờ dữ liệu của step sau
+        self._last_end = time.perf_counter()
+
+    def _mark_busy(self, *args, **kwargs):
+        # log / save / evaluate chạy giữa hai step: không tính là chờ dataloader
+        self._last_end = time.perf_counter()
+
+    on_log = on_save = on_evaluate = _mark_busy
+
+    def _start_profiler(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._profiler.start()
+
+    def _stop_profiler(self, state):
+        if self._profiler is None:
+            return
+        self._profiler.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"trace_step{self.profile_start_step}-{state.global_step}.json")
+        self._profiler.export_chrome_trace(path)
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        print(self._profiler.key_averages().table(sort_by=sort_by, row_limit=15))
+        print(f"[throughput] Đã ghi profiler trace: {path}")
+        self._profiler = None
+
+    def _emit(self, state):
+        if not state.is_world_process_zero:
+            self._reset_window()
+            return
+        elapsed = self._compute_s + self._wait_s
+        metrics = {
+            "perf/tokens_per_s": round(self._real_tokens / elapsed, 1) if elapsed else None,
+            "perf/samples_per_s": round(self._samples / elapsed, 2) if elapsed else None,
+            "perf/step_ms": round(self._compute_s / self._steps * 1000, 1),
+            "perf/data_wait_ms": round(self._wait_s / self._steps * 1000, 1),
+            "perf/data_wait_fraction": round(self._wait_s / elapsed, 4) if elapsed else None,
+            "perf/padding_ratio": round(1 - self._real_tokens / self._tokens, 4) if self._tokens else None,
+            "perf/peak_mem_mb": round(self._peak_mem_mb, 1),
+            "perf/tokens_per_step": round(self._real_tokens / self._steps, 1),
+        }
+        self._reset_window()
+
+        try:
+            import wandb
+        except ImportError:
+            wandb = None
+        if wandb is not None and wandb.run is not None:
+            wandb.log({**metrics, "train/global_step": state.global_step})
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+        with open(self.jsonl_path, "a") as f:
+            f.write(json.dumps({"step": state.global_step, "time": time.time(), **metrics}) + "\n")
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    # Cùng nội dung nhưng khác khoảng trắng / dạng Unicode (NFC vs NFD của tiếng Việt) dùng chung audio
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text, voice, audio_format):
+    payload = f"{audio_format}\0{voice}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Cache audio TTS theo nội dung: tầng LRU trong RAM đứng trước tầng đĩa, mỗi tầng có giới hạn byte."""
+
+    def __init__(self, memory_bytes=64 * 1024 * 1024, disk_dir=None, disk_bytes=1024 * 1024 * 1024, log_every=0):
+        self.memory_budget = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_bytes
+        self.log_every = log_every
+
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> kích thước file, cũ nhất ở đầu
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_config(cls, cache_config):
+        return cls(
+            memory_bytes=int(cache_config.get("memory_mb", 64) * 1024 * 1024),
+            disk_dir=cache_config.get("disk_dir"),
+            disk_bytes=int(cache_config.get("disk_mb", 1024) * 1024 * 1024),
+            log_every=cache_config.get("log_every", 0),
+        )
+
+    def _load_disk_index(self):
+        # Khôi phục thứ tự LRU của tầng đĩa theo mtime (mtime được cập nhật mỗi lần hit)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_budget:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.memory_evictions += 1
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_budget and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            elif key in self._disk:
+                try:
+                    with open(self._disk_path(key), "rb") as f:
+                        data = f.read()
+                    os.utime(self._disk_path(key))
+                    self._disk.move_to_end(key)
+                    self._put_memory(key, data)
+                    self.disk_hits += 1
+                except OSError:
+                    # File bị xóa từ bên ngoài: coi như miss
+                    self._disk_bytes -= self._disk.pop(key)
+            if data is None:
+                self.misses += 1
+            self._maybe_log()
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._put_memory(key, data)
+            if not self.disk_dir or key in self._disk or len(data) > self.disk_budget:
+                return
+            # Ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file dở dang
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._disk_path(key))
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def _maybe_log(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            print(f"[tts-cache] {self.stats()}")
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "memory_evictions": self.memory_evictions,
+            "disk_evictions": self.disk_evictions,
+        }
+
+
+class CachedSynthesizer:
+    """Bọc một synthesizer: cache hit trả audio ngay, không gọi mạng tới dịch vụ TTS."""
+
+    def __init__(self, synthesizer, cache):
+        self.synthesizer = synthesizer
+        self.cache = cache
+        self.audio_format = synthesizer.audio_format
+
+    async def synthesize(self, text, voice):
+        key = cache_key(text, voice, self.audio_format)
+        data = self.cache.get(key)
+        if data is None:
+            data = await self.synthesizer.synthesize(text, voice)
+            self.cache.put(key, data)
+        return data
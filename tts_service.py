@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+import edge_tts
+
+from streaming import SentenceBuffer
+
+
+class EdgeTTSSynthesizer:
+    """Gọi edge-tts và gom audio (mp3) thẳng vào bộ nhớ, không ghi file tạm."""
+
+    audio_format = "mp3"
+
+    async def synthesize(self, text, voice):
+        communicate = edge_tts.Communicate(text, voice)
+        audio = bytearray()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                audio.extend(chunk["data"])
+        return bytes(audio)
+
+
+class LocalSynthesizer:
+    """Bộ tổng hợp giả lập chạy offline: độ trễ = base + số ký tự * per_char.
+
+    Trả về bytes xác định theo (voice, text) nên có thể kiểm tra thứ tự ghép câu.
+    """
+
+    audio_format = "txt"
+
+    def __init__(self, base_latency_ms=150, per_char_ms=2):
+        self.base_latency = base_latency_ms / 1000.0
+        self.per_char = per_char_ms / 1000.0
+
+    async def synthesize(self, text, voice):
+        await asyncio.sleep(self.base_latency + self.per_char * len(text))
+        return f"[{voice}] {text}\n".encode("utf-8")
+
+
+def build_synthesizer(tts_config):
+    engine = tts_config.get("engine", "edge")
+    if engine == "edge":
+        return EdgeTTSSynthesizer()
+    if engine == "local":
+        return LocalSynthesizer(
+            base_latency_ms=tts_config.get("local_base_latency_ms", 150),
+            per_char_ms=tts_config.get("local_per_char_ms", 2),
+        )
+    raise ValueError(f"Unknown TTS engine: {engine}")
+
+
+class TTSService:
+    """Một event loop chạy nền suốt vòng đời worker, giới hạn số phiên TTS đồng thời.
+
+    Có thể gọi từ thread bất kỳ (`submit` trả về concurrent.futures.Future)
+    hoặc từ một event loop khác (`synthesize_async`).
+    """
+
+    def __init__(self, synthesizer=None, max_concurrency=4, min_sentence_chars=20):
+        self.synthesizer = synthesizer or EdgeTTSSynthesizer()
+        self.max_concurrency = max_concurrency
+        self.min_sentence_chars = min_sentence_chars
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="tts-loop", daemon=True)
+        self._thread.start()
+        # Semaphore gắn với loop ở lần dùng đầu tiên, tức là loop nền ở trên
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _synthesize(self, text, voice):
+        async with self._semaphore:
+            return await self.synthesizer.synthesize(text, voice)
+
+    def submit(self, text, voice):
+        return asyncio.run_coroutine_threadsafe(self._synthesize(text, voice), self.loop)
+
+    async def synthesize_async(self, text, voice):
+        return await asyncio.wrap_future(self.submit(text, voice))
+
+    def pipeline(self, voice):
+        return SentencePipeline(self, voice, self.min_sentence_chars)
+
+    def synthesize(self, text, voice):
+        # Văn bản có sẵn toàn bộ: tách câu rồi tổng hợp song song, ghép lại theo thứ tự
+        pipeline = self.pipeline(voice)
+        pipeline.feed(text)
+        return pipeline.finish()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class SentencePipeline:
+    """Nhận text từng đoạn trong lúc LLM đang sinh, gửi mỗi câu hoàn chỉnh sang TTS ngay."""
+
+    def __init__(self, service, voice, min_sentence_chars=20):
+        self.service = service
+        self.voice = voice
+        self.sentences = []
+        self._buffer = SentenceBuffer(min_sentence_chars)
+        self._futures = []
+
+    def _submit(self, sentences):
+        for sentence in sentences:
+            self.sentences.append(sentence)
+            self._futures.append(self.service.submit(sentence, self.voice))
+
+    def feed(self, delta):
+        self._submit(self._buffer.feed(delta))
+
+    def finish(self):
+        self._submit(self._buffer.flush())
+        return b"".join(future.result() for future in self._futures)
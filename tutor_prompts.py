@@ -0,0 +1,74 @@
+import hashlib
+
+# Phần tĩnh (persona + yêu cầu) đứng trước, phần thay đổi theo từng request (văn bản của học viên)
+# nằm ở tin nhắn cuối cùng, để toàn bộ phần đầu prompt có thể dùng chung KV cache.
+WORKER_SYSTEM_TEMPLATE = (
+    "You are a friendly and strict {lang_name} tutor for Vietnamese students. "
+    "{input_note} "
+    "Task: 1. Correct any grammatical, spelling, or pronunciation mistakes. "
+    "2. Explain the corrections clearly in Vietnamese. "
+    "3. Provide the perfectly corrected sentence in {lang_name} at the very end."
+)
+
+INPUT_NOTES = {
+    "image": "The user uploaded an image of their {lang_name} exercise. The text was extracted with OCR and might have some typos.",
+    "text": "The user provided a {lang_name} input.",
+}
+
+VOICE_TUTOR_SYSTEM_PROMPT = (
+    "You are a helpful English and German tutor. "
+    "If the user makes a mistake in grammar or pronunciation, explain it kindly in Vietnamese. "
+    "Always encourage the user to practice more. "
+)
+
+# Hội thoại nhiều lượt vượt giới hạn ngữ cảnh: các lượt cũ được tóm tắt rồi đưa vào system prompt
+SESSION_SUMMARY_PROMPT = (
+    "Summarize the tutoring conversation below in at most 120 words. "
+    "Keep the student's recurring mistakes, the corrections already given and the topic being practised. "
+    "Write the summary in Vietnamese."
+)
+
+SESSION_SUMMARY_NOTE = "Summary of the earlier part of this lesson: {summary}"
+
+_DYNAMIC_MARKER = "\x00DENGLISH_USER_CONTENT\x00"
+
+
+def lang_name_for(target_lang):
+    return "English" if target_lang == "en" else "German"
+
+
+def worker_messages(input_type, user_extracted_text, target_lang):
+    lang_name = lang_name_for(target_lang)
+    input_note = INPUT_NOTES.get(input_type, INPUT_NOTES["text"]).format(lang_name=lang_name)
+    system_prompt = WORKER_SYSTEM_TEMPLATE.format(lang_name=lang_name, input_note=input_note)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"'{user_extracted_text}'\n\nHãy chấm bài và sửa lỗi cho tôi."}
+    ]
+
+
+def render_with_static_prefix(tokenizer, messages):
+    """Trả về (prompt, static_prefix): static_prefix là phần prompt đứng trước nội dung tin nhắn cuối."""
+    prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    probe = messages[:-1] + [{**messages[-1], "content": _DYNAMIC_MARKER}]
+    rendered = tokenizer.apply_chat_template(probe, tokenize=False, add_generation_prompt=True)
+    return prompt, rendered[:rendered.index(_DYNAMIC_MARKER)]
+
+
+def template_hash(static_prefix):
+    # Prefix đã render gồm cả system prompt lẫn chat template: đổi một trong hai là đổi hash
+    return hashlib.sha256(static_prefix.encode("utf-8")).hexdigest()[:16]
+
+
+def session_system_prompt(system_prompt, summary=None):
+    return f"{system_prompt}\n\n{SESSION_SUMMARY_NOTE.format(summary=summary)}" if summary else system_prompt
+
+
+def summary_messages(summary, turns):
+    """Tin nhắn yêu cầu model tóm tắt `turns` (kèm bản tóm tắt cũ nếu có)."""
+    lines = [f"(Earlier summary) {summary}"] if summary else []
+    lines += [f"{message['role'].capitalize()}: {message['content']}" for message in turns]
+    return [
+        {"role": "system", "content": SESSION_SUMMARY_PROMPT},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
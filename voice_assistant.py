@@ -1,23 +1,41 @@
 import asyncio
-import edge_tts
-from faster_whisper import WhisperModel
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import time
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import os
 import yaml
-from PIL import Image, ImageOps, ImageFilter
-import pytesseract
 import numpy as np
+from tts_service import EdgeTTSSynthesizer
+from stt_engine import STTEngine
+from ocr_pipeline import OCRPipeline
+from tts_cache import CachedSynthesizer, TTSCache
+from prefix_cache import PrefixCache, adapter_version
+from tutor_prompts import VOICE_TUTOR_SYSTEM_PROMPT
+from llm_backend import LlamaCppBackend, TransformersBackend
+from metrics import JobTimings
+from speculative import SpeculativeDecoding
+from session_store import SessionStore
+from streaming import stream_text_and_audio
 
 # Cấu hình pytesseract (đảm bảo Tesseract OCR đã được cài đặt trên hệ thống)
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe' # Windows example
 
+# Kết quả một lượt hỏi của VoiceTutor.respond
+TutorTurn = namedtuple("TutorTurn", ["user_text", "lang", "image_text", "response", "audio", "timings"])
+
+
 class VoiceTutor:
     def __init__(self):
         # Load configuration from config.yaml
         with open("config.yaml", "r") as f:
             self.config = yaml.safe_load(f)
 
+        # Thời gian từng bước (STT / OCR / LLM / TTS) và số token của lượt hỏi hiện tại
+        self.timings = JobTimings()
+
         self.model_path = self.config["model"]["output_dir"]
         self.stt_model_name = self.config["voice"]["stt_model"]
         self.voice_en = self.config["voice"]["voice_en"]
@@ -27,16 +45,45 @@ class VoiceTutor:
         # Vision settings
         self.ocr_enabled = self.config["vision"]["ocr_enabled"]
         self.ocr_lang = self.config["vision"]["ocr_lang"]
-        self.vision_preprocessing = self.config["vision"].get("preprocessing", {})
+        # Tiền xử lý (NumPy) + nhận dạng song song theo tile, xem ocr_pipeline.py
+        self.ocr_pipeline = OCRPipeline.from_config(self.config["vision"])
         self.analysis_prompt_template = self.config["vision"].get("analysis_prompt", "Analyze this text: {text}")
 
+        # TTS settings: audio của các câu lặp lại được lấy từ cache thay vì gọi lại edge-tts
+        self.synthesizer = EdgeTTSSynthesizer()
+        self.tts_cache = None
+        tts_cache_config = self.config.get("tts_cache", {})
+        if tts_cache_config.get("enabled", True):
+            self.tts_cache = TTSCache.from_config(tts_cache_config)
+            self.synthesizer = CachedSynthesizer(self.synthesizer, self.tts_cache)
+        self.min_sentence_chars = self.config["voice"].get("tts_min_sentence_chars", 20)
+
+        # API bất đồng bộ (respond): STT / OCR / chuẩn bị prompt chạy trên thread, event loop chỉ điều phối
+        # nên một process phục vụ được nhiều phiên cùng lúc
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config["voice"].get("async_workers", 4), thread_name_prefix="tutor")
+
         print("Loading STT Model...")
         try:
-            self.stt_model = WhisperModel(self.stt_model_name, device="cuda" if torch.cuda.is_available() else "cpu", compute_type="float16" if torch.cuda.is_available() else "int8")
+            self.stt_engine = STTEngine.from_config(self.config["voice"])
         except Exception as e:
              print(f"Error loading Whisper: {e}. Falling back to CPU/int8")
-             self.stt_model = WhisperModel(self.stt_model_name, device="cpu", compute_type="int8")
+             self.stt_engine = STTEngine.from_config({**self.config["voice"], "stt_device": "cpu", "stt_compute_type": "int8"})
         
+        # LLM backend: transformers (mặc định) hoặc file GGUF chạy bằng llama.cpp trên CPU
+        llm_config = self.config.get("llm", {})
+        self.generation_kwargs = generation_kwargs = {"max_new_tokens": 512}
+        # Hội thoại nhiều lượt (generate_response với session_id): lịch sử + KV của từng phiên
+        self.sessions_config = self.config.get("sessions", {})
+        self.sessions = None
+        if llm_config.get("backend", "transformers") == "llamacpp":
+            print("Loading LLM Model (GGUF / llama.cpp)...")
+            self.llm = LlamaCppBackend.from_config(
+                llm_config, generation_kwargs, SpeculativeDecoding.from_config(self.config.get("speculative", {})))
+            if self.sessions_config.get("enabled", True):
+                self.sessions = SessionStore.from_config(self.sessions_config)
+            return
+
         print("Loading LLM Model...")
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
@@ -55,46 +102,53 @@ class VoiceTutor:
                 torch_dtype=torch.float16,
                 device_map="auto"
             )
+
+        # KV cache của system prompt cố định, dùng lại giữa các lượt hỏi
+        self.prefix_cache = None
+        prefix_cache_config = self.config.get("prefix_cache", {})
+        if prefix_cache_config.get("enabled", True):
+            self.prefix_cache = PrefixCache(
+                self.model,
+                self.tokenizer,
+                max_entries=prefix_cache_config.get("max_entries", 16),
+                adapter_version=adapter_version(self.model.name_or_path),
+                log_every=prefix_cache_config.get("log_every", 0),
+            )
+
+        # Câu sửa lỗi chép lại phần lớn câu của học viên: prompt lookup / draft model giảm số lượt decode
+        self.speculative = SpeculativeDecoding.from_config(self.config.get("speculative", {}), self.model)
+        self.llm = TransformersBackend(self.model, self.tokenizer, generation_kwargs, self.prefix_cache, self.speculative)
+        if self.sessions_config.get("enabled", True):
+            self.sessions = SessionStore.from_config(self.sessions_config, self.model)
         
-    def transcribe(self, audio_path):
-        segments, info = self.stt_model.transcribe(audio_path, beam_size=5)
-        text = " ".join([segment.text for segment in segments])
-        return text, info.language
-
-    def preprocess_image(self, img):
-        # Apply preprocessing based on config
-        if self.vision_preprocessing.get("grayscale", False):
-            img = ImageOps.grayscale(img)
-        
-        if self.vision_preprocessing.get("threshold", False):
-            # Simple thresholding
-            img = img.point(lambda p: 255 if p > 128 else 0)
-            
-        return img
+    def reset_timings(self):
+        self.timings = JobTimings()
 
-    def process_image(self, image_path):
+    def transcribe(self, audio_path, timings=None):
+        timings = timings or self.timings
+        with timings.stage("stt"):
+            result = self.stt_engine.transcribe(audio_path)
+        return result.text, result.language
+
+    def process_image(self, image_path, timings=None):
         if not self.ocr_enabled:
             return ""
+        timings = timings or self.timings
         try:
-            img = Image.open(image_path)
-            
-            # Preprocess
-            img = self.preprocess_image(img)
-            
-            # OCR
-            text_from_image = pytesseract.image_to_string(img, lang=self.ocr_lang)
-            print(f"Text extracted from image: {text_from_image.strip()}")
-            return text_from_image.strip()
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+            with timings.stage("ocr"):
+                result = self.ocr_pipeline.recognize(image_bytes, lang=self.ocr_lang)
+            print(f"OCR ({result.tiles} tiles): {result.timings}")
+            print(f"Text extracted from image: {result.text}")
+            return result.text
         except Exception as e:
             print(f"Error processing image with OCR: {e}")
             return ""
 
-    def generate_response(self, text_input, lang, image_text=""):
-        system_prompt = (
-            "You are a helpful English and German tutor. "
-            "If the user makes a mistake in grammar or pronunciation, explain it kindly in Vietnamese. "
-            "Always encourage the user to practice more. "
-        )
+    def _prepare_turn(self, text_input, lang, image_text="", session_id=None):
+        """Trả về (messages, cache_key, session, full_input) của một lượt hỏi."""
+        system_prompt = VOICE_TUTOR_SYSTEM_PROMPT
         
         full_input = text_input
         
@@ -103,26 +157,99 @@ class VoiceTutor:
             analysis_request = self.analysis_prompt_template.format(text=image_text)
             full_input = f"{analysis_request}\n\nUser question: {text_input}"
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": full_input}
-        ]
-        
-        # Apply chat template
-        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        session = None
+        if session_id is not None and self.sessions is not None:
+            # Cùng session_id: gửi kèm lịch sử, KV của các lượt trước được dùng lại nên chỉ prefill tin nhắn mới
+            session = self.sessions.open(session_id)
+            messages = self.sessions.build_messages(
+                session, system_prompt, full_input, self.llm, reserve_tokens=self.generation_kwargs["max_new_tokens"])
+        else:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": full_input}
+            ]
         
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-        outputs = self.model.generate(**inputs, max_new_tokens=512)
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract assistant response (handling different template outputs)
-        if "assistant" in response:
-             response = response.split("assistant")[-1].strip()
-        elif "Assistant:" in response:
-             response = response.split("Assistant:")[-1].strip()
-             
+        # System prompt cố định đứng trước, phần thay đổi nằm ở tin nhắn cuối (dùng lại được prefix cache).
+        # Backend chỉ trả về phần text mới sinh, không cần tách "assistant" khỏi prompt nữa.
+        input_type = "image" if image_text else "text"
+        # Prefix cache chỉ hợp với lượt đầu của phiên (chưa có lịch sử / tóm tắt trong prompt)
+        cache_key = (lang, input_type) if len(messages) == 2 and messages[0]["content"] == system_prompt else None
+        return messages, cache_key, session, full_input
+
+    def _finish_turn(self, session, full_input, response, stats, timings):
+        timings.add_llm_stats(stats)
+        response = response.strip()
+        if session is not None:
+            self.sessions.add_turn(session, full_input, response, stats)
         return response
 
+    def generate_response(self, text_input, lang, image_text="", session_id=None, timings=None):
+        timings = timings or self.timings
+        messages, cache_key, session, full_input = self._prepare_turn(text_input, lang, image_text, session_id)
+        with timings.stage("llm"):
+            generation = self.llm.stream(messages, cache_key=cache_key, session=session)
+            response = "".join(generation)
+        return self._finish_turn(session, full_input, response, generation.stats, timings)
+
+    async def respond(self, audio_path=None, image_path=None, text="", lang=None, session_id=None, output_path=None):
+        """Một lượt hỏi không chặn event loop; trả về TutorTurn.
+
+        STT và OCR chạy song song trên thread khi có cả audio và ảnh. Mỗi câu trả lời vừa sinh xong được
+        gửi sang TTS ngay trong lúc LLM sinh tiếp. Mỗi lượt có JobTimings riêng, nên nhiều phiên có thể
+        gọi respond đồng thời.
+        """
+        timings = JobTimings()
+        loop = asyncio.get_running_loop()
+        stt = ocr = None
+        if audio_path is not None:
+            stt = loop.run_in_executor(self.executor, self.transcribe, audio_path, timings)
+        if image_path is not None and self.ocr_enabled:
+            ocr = loop.run_in_executor(self.executor, self.process_image, image_path, timings)
+
+        user_text, image_text = text, ""
+        if stt is not None:
+            user_text, detected_lang = await stt
+            lang = lang or detected_lang
+        if ocr is not None:
+            image_text = await ocr
+        lang = lang or "en"
+        if not user_text and not image_text:
+            return TutorTurn(user_text, lang, image_text, "", b"", timings.as_dict())
+
+        # Tóm tắt lịch sử phiên / tokenize / dựng prefix cache đều có thể tốn thời gian: không chạy trên event loop
+        messages, cache_key, session, full_input = await loop.run_in_executor(
+            self.executor, self._prepare_turn, user_text, lang, image_text, session_id)
+        llm_start = time.perf_counter()
+        generation = await loop.run_in_executor(
+            self.executor, partial(self.llm.stream, messages, cache_key=cache_key, session=session))
+
+        text_parts = []
+        audio_parts = []
+        last_text = llm_start
+        async for event in stream_text_and_audio(
+            generation,
+            lambda sentence: self.synthesizer.synthesize(sentence, self.voice_vn),
+            min_chars=self.min_sentence_chars,
+        ):
+            if event[0] == "text":
+                last_text = time.perf_counter()
+                text_parts.append(event[1])
+            else:
+                audio_parts.append(event[3])
+        # LLM xong ở đoạn text cuối cùng; phần sau đó là chờ audio của các câu cuối
+        timings.add("llm", last_text - llm_start)
+        timings.add("tts", time.perf_counter() - last_text)
+
+        response = self._finish_turn(session, full_input, "".join(text_parts), generation.stats, timings)
+        audio = b"".join(audio_parts)
+        if output_path:
+            await asyncio.to_thread(_write_bytes, output_path, audio)
+        return TutorTurn(user_text, lang, image_text, response, audio, timings.as_dict())
+
+    def end_session(self, session_id):
+        if self.sessions is not None:
+            self.sessions.close(session_id)
+
     async def speak(self, text, output_path="response.mp3"):
         # Detect language loosely or default to VN for explanations
         voice = self.voice_vn 
@@ -130,10 +257,18 @@ class VoiceTutor:
         # For a tutor, explanations are in VN, examples in EN/DE. 
         # Keeping VN voice for now as it handles mixed well usually or we stick to primary lang.
         
-        communicate = edge_tts.Communicate(text, voice)
-        await communicate.save(output_path)
+        with self.timings.stage("tts"):
+            audio = await self.synthesizer.synthesize(text, voice)
+        with open(output_path, "wb") as f:
+            f.write(audio)
         print(f"Audio saved to {output_path}")
 
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 async def main():
     tutor = VoiceTutor()
     
@@ -141,25 +276,19 @@ async def main():
     audio_input = "user_speech.wav"
     image_input = "grammar_exercise.png"
 
-    user_text = ""
-    user_lang = "en"
-
-    if os.path.exists(audio_input):
-        print("Transcribing audio...")
-        user_text, user_lang = tutor.transcribe(audio_input)
-        print(f"User said ({user_lang}): {user_text}")
-    
-    image_text_content = ""
-    if os.path.exists(image_input) and tutor.ocr_enabled:
-        print("Processing image with OCR...")
-        image_text_content = tutor.process_image(image_input)
-    
-    if user_text or image_text_content:
-        print("Generating response...")
-        response = tutor.generate_response(user_text, user_lang, image_text_content)
-        print(f"Assistant: {response}")
-        
-        await tutor.speak(response)
+    # STT và OCR chạy song song, audio từng câu được tổng hợp trong lúc LLM còn đang sinh
+    print("Processing input (STT / OCR)...")
+    turn = await tutor.respond(
+        audio_path=audio_input if os.path.exists(audio_input) else None,
+        image_path=image_input if os.path.exists(image_input) else None,
+        output_path="response.mp3",
+    )
+    if turn.user_text:
+        print(f"User said ({turn.lang}): {turn.user_text}")
+    if turn.response:
+        print(f"Assistant: {turn.response}")
+        print("Audio saved to response.mp3")
+        print(f"Timings: {turn.timings}")
 
 if __name__ == "__main__":
     asyncio.run(main())